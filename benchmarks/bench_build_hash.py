@@ -0,0 +1,74 @@
+#! /bin/env python3
+# Times the content hashing of build contexts used by `build --incremental`: a cold run reads every file, a warm run
+# only stats them and must stay well under a second for an unchanged monorepo.
+#
+#   python benchmarks/bench_build_hash.py [--services 20] [--files 1000] [--size 4096]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from swarm_cli.lib.build_cache import BuildManifest, get_build_targets  # noqa: E402
+
+
+def write_contexts(root: str, services: int, files: int, size: int):
+    definitions = {}
+    for i in range(services):
+        context = os.path.join(root, 'service_{}'.format(i))
+        for j in range(files):
+            directory = os.path.join(context, 'src', 'pkg_{}'.format(j % 20))
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, 'file_{}.py'.format(j)), 'wb') as outfile:
+                outfile.write(os.urandom(size))
+        os.makedirs(os.path.join(context, 'node_modules', 'dep'), exist_ok=True)
+        with open(os.path.join(context, 'node_modules', 'dep', 'index.js'), 'w') as outfile:
+            outfile.write('ignored')
+        with open(os.path.join(context, '.dockerignore'), 'w') as outfile:
+            outfile.write('node_modules\n**/*.pyc\n')
+        with open(os.path.join(context, 'Dockerfile'), 'w') as outfile:
+            outfile.write('FROM python:3\nCOPY . /app\n')
+        definitions['service_{}'.format(i)] = {'build': {'context': context, 'args': {'VERSION': '1'}},
+                                               'image': 'bench/service_{}:latest'.format(i)}
+    return definitions
+
+
+def timed(manifest: BuildManifest, targets):
+    start = time.perf_counter()
+    hashes = manifest.hash_targets(targets)
+    return time.perf_counter() - start, hashes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=4096)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        os.environ['SWARM_CLI_CACHE_DIR'] = os.path.join(root, 'cache')
+        targets = get_build_targets(write_contexts(root, args.services, args.files, args.size), root)
+        manifest = BuildManifest('bench')
+        cold, cold_hashes = timed(manifest, targets)
+        manifest.save()
+        manifest = BuildManifest('bench')
+        warm, warm_hashes = timed(manifest, targets)
+        assert cold_hashes == warm_hashes
+        with open(os.path.join(targets[0].context, 'src', 'pkg_0', 'file_0.py'), 'ab') as outfile:
+            outfile.write(b'changed')
+        changed, changed_hashes = timed(manifest, targets)
+        assert changed_hashes[targets[0].service] != warm_hashes[targets[0].service]
+        assert all(changed_hashes[t.service] == warm_hashes[t.service] for t in targets[1:])
+
+    total = args.services * args.files
+    print('{} services, {} files of {} bytes'.format(args.services, total, args.size))
+    print('cold (read every file)   {:8.1f} ms'.format(cold * 1000))
+    print('warm (unchanged)         {:8.1f} ms'.format(warm * 1000))
+    print('one file changed         {:8.1f} ms'.format(changed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#! /bin/env python3
+# Compares the native env file parser with the `sh -c "set -a && . ./file && env"` shell-out.
+#
+#   python benchmarks/bench_env_parser.py [--files 6] [--vars 40] [--rounds 20]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from swarm_cli.lib.utils import _read_env_file_native, _read_env_file_shell  # noqa: E402
+
+
+def write_env_files(root: str, files: int, variables: int):
+    paths = []
+    for i in range(files):
+        path = 'env_{}'.format(i)
+        with open(os.path.join(root, path), 'w') as outfile:
+            outfile.write('# generated env file {}\n'.format(i))
+            for j in range(variables):
+                if j % 4 == 0:
+                    outfile.write('export VAR_{}_{}="value {} ${{HOME}}"\n'.format(i, j, j))
+                elif j % 4 == 1:
+                    outfile.write("VAR_{}_{}='literal $NOT_EXPANDED'\n".format(i, j))
+                elif j % 4 == 2:
+                    outfile.write('VAR_{}_{}=${{UNSET_{}:-default}}\n'.format(i, j, j))
+                else:
+                    outfile.write('VAR_{}_{}=plain_{}  # comment\n'.format(i, j, j))
+        paths.append(path)
+    return paths
+
+
+def bench(reader, paths, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            reader(path)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=6)
+    parser.add_argument('--vars', type=int, default=40)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            paths = write_env_files(root, args.files, args.vars)
+            for path in paths:
+                native = _read_env_file_native(path)
+                shell = _read_env_file_shell(path)
+                mismatches = [k for k, v in native.items() if shell.get(k) != v]
+                if mismatches:
+                    print('Mismatch in {}: {}'.format(path, ', '.join(mismatches)))
+                    sys.exit(1)
+            shell_time = bench(_read_env_file_shell, paths, args.rounds)
+            native_time = bench(_read_env_file_native, paths, args.rounds)
+        finally:
+            os.chdir(cwd)
+
+    print('{} files x {} variables'.format(args.files, args.vars))
+    print('  shell : {:8.2f} ms'.format(shell_time * 1000))
+    print('  native: {:8.2f} ms'.format(native_time * 1000))
+    print('  speedup: {:.1f}x'.format(shell_time / native_time))
+
+
+if __name__ == '__main__':
+    main()
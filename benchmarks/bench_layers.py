@@ -0,0 +1,64 @@
+#! /bin/env python3
+# Times the loading of swarm-config.yml and its layers, as done by every `swarm` command: the first run scans the
+# layers and reads the *.stack.yml files, the following ones only validate the cached index.
+#
+#   python benchmarks/bench_layers.py [--layers 4] [--stacks 200] [--rounds 10]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from swarm_cli.lib.swarm_mode.swarm_mode_state import SwarmModeState  # noqa: E402
+
+
+def write_layers(root: str, layers: int, stacks: int):
+    paths = []
+    for i in range(layers):
+        layer = os.path.join(root, 'layers', 'layer_{}'.format(i))
+        for j in range(stacks):
+            stack_dir = os.path.join(layer, 'stack{}'.format(j))
+            os.makedirs(os.path.join(stack_dir, 'files'), exist_ok=True)
+            with open(os.path.join(stack_dir, 'stack{}_v1.stack.yml'.format(j)), 'w') as outfile:
+                outfile.write('files_dir: files\n')
+            with open(os.path.join(stack_dir, 'docker-compose.yml'), 'w') as outfile:
+                outfile.write('version: "3.7"\nservices:\n')
+                for k in range(10):
+                    outfile.write('  svc{}:\n    image: reg/svc{}:latest\n    environment:\n      A: "1"\n'.format(k, k))
+        paths.append(layer)
+    with open(os.path.join(root, 'swarm-config.yml'), 'w') as outfile:
+        outfile.write('layers:\n')
+        for path in paths:
+            outfile.write('  - {}\n'.format(path))
+        outfile.write('presets:\n  p1:\n    stacks:\n      stack0: {variant: v1}\n')
+
+
+def load(root: str):
+    start = time.perf_counter()
+    state = SwarmModeState()
+    state.initFromFile(os.path.join(root, 'swarm-config.yml'))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--stacks', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        os.environ['SWARM_CLI_CACHE_DIR'] = os.path.join(root, 'cache')
+        write_layers(root, args.layers, args.stacks)
+        cold = load(root)
+        warm = sum(load(root) for _ in range(args.rounds)) / args.rounds
+
+    print('{} layers of {} stacks'.format(args.layers, args.stacks))
+    print('cold (scan layers)       {:8.1f} ms'.format(cold * 1000))
+    print('warm (cached index)      {:8.1f} ms'.format(warm * 1000))
+
+
+if __name__ == '__main__':
+    main()
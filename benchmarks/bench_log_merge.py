@@ -0,0 +1,62 @@
+#! /bin/env python3
+# Throughput of the merged `stack logs` mode (several services or --all-replicas) with one busy replica and one quiet
+# one: the busy lines must flow at full speed, a quiet replica only delays them by the reorder window. Exits with an
+# error when the merge is slower than --min-rate lines/s.
+#
+#   python benchmarks/bench_log_merge.py [--lines 20000] [--quiet 2] [--min-rate 10000]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from swarm_cli.lib.stack_mode.log_streams import LogStream, merge_log_streams  # noqa: E402
+
+
+def busy_stream(lines: int):
+    # A --tail backlog arrives in a few large chunks
+    data = b''.join(b'2021-11-05T10:00:%02d.%06dZ request=%d\n' % (i // 100000 % 60, i % 100000, i)
+                    for i in range(lines))
+    for i in range(0, len(data), 65536):
+        yield data[i:i + 65536]
+
+
+def quiet_stream(seconds: float):
+    # Stays silent, then logs a single line and ends
+    time.sleep(seconds)
+    yield b'2021-11-05T11:00:00Z done\n'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--quiet', type=float, default=2.0, help="Seconds the quiet replica stays silent")
+    parser.add_argument('--min-rate', type=float, default=10000)
+    args = parser.parse_args()
+
+    received = {'busy': 0, 'quiet': 0}
+    busy_done = []
+    start = time.monotonic()
+
+    def emit(prefix: str, message: bytes):
+        received[prefix] += 1
+        if prefix == 'busy' and received['busy'] == args.lines:
+            busy_done.append(time.monotonic() - start)
+
+    streams = [LogStream('busy', busy_stream(args.lines)), LogStream('quiet', quiet_stream(args.quiet))]
+    merge_log_streams(streams, emit)
+    total = time.monotonic() - start
+
+    if received != {'busy': args.lines, 'quiet': 1} or not busy_done:
+        sys.exit('lines lost: {}'.format(received))
+    rate = args.lines / busy_done[0]
+    print('{} busy lines merged in {:.3f}s ({:,.0f} lines/s), quiet replica ended after {:.1f}s'.format(
+        args.lines, busy_done[0], rate, total))
+    if rate < args.min_rate:
+        sys.exit('merge too slow: {:,.0f} lines/s while a replica is quiet, expected {:,.0f}'.format(
+            rate, args.min_rate))
+
+
+if __name__ == '__main__':
+    main()
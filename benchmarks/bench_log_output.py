@@ -0,0 +1,115 @@
+#! /bin/env python3
+# Throughput of the `stack logs` output paths against a fake multiplexed log stream written to /dev/null. Before
+# timing, the stream is served with chunked transfer encoding by a fake daemon and read back with raw_log_chunks, which
+# must hand the frames over intact.
+#
+#   python benchmarks/bench_log_output.py [--lines 500000] [--chunk-size 32768]
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from swarm_cli.lib.stack_mode.log_output import FrameDecoder, LogPump, raw_log_chunks  # noqa: E402
+
+
+def fake_stream(lines: int, chunk_size: int):
+    # One frame per line like the docker daemon does, with some stderr and invalid UTF-8, then cut in fixed size
+    # chunks that do not respect frame or line boundaries
+    frames = bytearray()
+    for i in range(lines):
+        stream = 2 if i % 10 == 0 else 1
+        payload = b'2021-11-05T10:00:00.000000000Z level=info request=%d path=/api/v1/items status=200 \xff\n' % i
+        frames += struct.pack('>BxxxL', stream, len(payload)) + payload
+    frames = bytes(frames)
+    return [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+
+
+def frame_payloads(chunks):
+    # What docker-py hands to the historical path: one item per frame, already demultiplexed. This is done before
+    # timing so the slow path is not charged for it
+    data = b''.join(chunks)
+    payloads = []
+    offset = 0
+    while offset < len(data):
+        _, length = struct.unpack_from('>BxxxL', data, offset)
+        payloads.append(data[offset + 8:offset + 8 + length])
+        offset += 8 + length
+    return payloads
+
+
+class FakeDaemon(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    chunks = []
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.docker.multiplexed-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in self.chunks:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, *args):
+        pass
+
+
+def check_chunked_stream(chunks, payloads):
+    import docker
+    FakeDaemon.chunks = chunks
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeDaemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = docker.DockerClient(base_url='tcp://127.0.0.1:{}'.format(server.server_address[1]), version='1.41')
+    try:
+        decoder = FrameDecoder()
+        received = [bytes(payload) for chunk in raw_log_chunks(client, 'fake', follow=False)
+                    for _, payload in decoder.feed(chunk)]
+    finally:
+        client.close()
+        server.shutdown()
+    if received != payloads or decoder.pending:
+        sys.exit('raw_log_chunks corrupted the chunked stream: {} of {} frames'.format(len(received), len(payloads)))
+
+
+def slow_path(payloads, devnull):
+    # The historical path: decode every frame, strip it and print it with click
+    for payload in payloads:
+        decoded = payload.decode('utf-8', errors='replace').rstrip()
+        click.secho(decoded, file=devnull)
+
+
+def fast_path(chunks, devnull, grep=None):
+    LogPump(devnull.buffer, devnull.buffer, grep=grep).run(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=500000)
+    parser.add_argument('--chunk-size', type=int, default=32768)
+    args = parser.parse_args()
+
+    chunks = fake_stream(args.lines, args.chunk_size)
+    payloads = frame_payloads(chunks)
+    size = sum(len(chunk) for chunk in chunks)
+    print('{} lines, {:.1f} MB in {} chunks'.format(args.lines, size / 1e6, len(chunks)))
+    check_chunked_stream(chunks, payloads)
+    with open(os.devnull, 'w') as devnull:
+        for name, fn in [('slow', lambda: slow_path(payloads, devnull)),
+                         ('fast', lambda: fast_path(chunks, devnull)),
+                         ('fast --grep', lambda: fast_path(chunks, devnull, grep='request=1'))]:
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            print('  {:<12s} {:8.3f} s  {:12,.0f} lines/s  {:8.1f} MB/s'.format(
+                name, elapsed, args.lines / elapsed, size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
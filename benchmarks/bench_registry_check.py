@@ -0,0 +1,83 @@
+#! /bin/env python3
+# Times the registry checks of `push --skip-existing` against an in-process fake registry: one HEAD request per
+# image, over pooled connections, sequential (-j 1) and in parallel. Half of the images are already in the registry.
+#
+#   python benchmarks/bench_registry_check.py [--images 50] [--latency 0.02] [--jobs 8]
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from swarm_cli.lib.registry import PushPlan  # noqa: E402
+
+
+class FakeRegistry(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    manifests = {}
+
+    def do_HEAD(self):
+        time.sleep(self.latency)
+        digest = self.manifests.get(self.path)
+        self.send_response(200 if digest else 404)
+        if digest:
+            self.send_header('Docker-Content-Digest', digest)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeApi:
+    def __init__(self, images: dict):
+        self.images = images
+
+    def inspect_image(self, image):
+        return self.images[image]
+
+
+class FakeClient:
+    def __init__(self, images: dict):
+        self.api = FakeApi(images)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the registry takes per request")
+    parser.add_argument('--jobs', type=int, default=8)
+    args = parser.parse_args()
+
+    FakeRegistry.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeRegistry)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    registry = '127.0.0.1:{}'.format(server.server_address[1])
+
+    images = {}
+    services = {}
+    for i in range(args.images):
+        repository = '{}/app/svc{}'.format(registry, i)
+        digest = 'sha256:{:064x}'.format(i)
+        images['{}:1.0'.format(repository)] = {'RepoDigests': ['{}@{}'.format(repository, digest)],
+                                               'Size': 200 * 1000 * 1000}
+        # Odd images were rebuilt since their last push, the registry has another digest
+        FakeRegistry.manifests['/v2/app/svc{}/manifests/1.0'.format(i)] = digest if i % 2 == 0 else 'sha256:' + '0' * 64
+        services['svc{}'.format(i)] = {'build': '.', 'image': '{}:1.0'.format(repository)}
+    document = {'services': services}
+    client = FakeClient(images)
+
+    for jobs in (1, args.jobs):
+        plan = PushPlan(client, document, jobs=jobs)
+        print('-j {:<3} {} images checked in {:8.1f} ms, {} to push'.format(
+            jobs, len(plan.checks), plan.check_duration * 1000, len(plan.services)))
+    plan.report('bench')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
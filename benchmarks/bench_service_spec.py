@@ -0,0 +1,94 @@
+#! /bin/env python3
+# Times the rendering and diffing of service specs done by `deploy --skip-unchanged` and `deploy --services`, on a
+# stack whose live specs match the compose file. Before timing, checks that the live specs (as docker stores them) are
+# seen as unchanged and that a targeted update keeps what the compose file sets.
+#
+#   python benchmarks/bench_service_spec.py [--services 200] [--rounds 10]
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from swarm_cli.lib.service_spec import apply_spec, diff_spec, diff_stack, render_stack_specs  # noqa: E402
+
+
+def write_stack(root: str, services: int) -> dict:
+    env_file = os.path.join(root, 'db.env')
+    with open(env_file, 'w') as outfile:
+        outfile.write('# database\nDB_PASSWORD=secret\nDB_HOST=db\n')
+    document = {'services': {}, 'volumes': {'data': {}}}
+    for i in range(services):
+        document['services']['svc{}'.format(i)] = {
+            # Docker Hub images are stored with their familiar name and tag: nginx:latest
+            'image': 'reg.example.com/app/svc{}:1.0'.format(i) if i % 10 else 'nginx',
+            'env_file': [env_file],
+            'environment': {'A': '1'},
+            'volumes': ['data:/data'],
+            'deploy': {'replicas': 2, 'labels': {'team': 'core'}},
+        }
+    return document
+
+
+def live_spec(rendered: dict) -> dict:
+    # What docker stores: pinned image, stack image label, mount options
+    spec = copy.deepcopy(rendered)
+    container_spec = spec['TaskTemplate']['ContainerSpec']
+    spec['Labels']['com.docker.stack.image'] = container_spec['Image']
+    image = container_spec['Image']
+    if ':' not in image.rsplit('/', 1)[-1]:
+        image += ':latest'
+    container_spec['Image'] = image + '@sha256:' + '0' * 64
+    for mount in container_spec['Mounts']:
+        mount['VolumeOptions'] = {'Labels': {'com.docker.stack.namespace': 'app'}}
+        mount.pop('ReadOnly')
+    return spec
+
+
+def check(document: dict):
+    rendered = render_stack_specs('app', document, {})
+    live = {name: live_spec(spec) for name, spec in rendered.items()}
+    name = 'app_svc1'
+    env = rendered[name]['TaskTemplate']['ContainerSpec']['Env']
+    if env != ['A=1', 'DB_HOST=db', 'DB_PASSWORD=secret']:
+        sys.exit('env_file not rendered: {}'.format(env))
+    changes = diff_stack(rendered, live)
+    if changes:
+        sys.exit('live specs seen as changed: {}'.format(changes))
+
+    # Targeted update of the image only: the env file variables must survive
+    changed = copy.deepcopy(document)
+    changed['services']['svc1']['image'] = 'reg.example.com/app/svc1:1.1'
+    target = render_stack_specs('app', changed, {})[name]
+    fields = diff_spec(target, live[name])
+    updated = apply_spec(live[name], target, fields)
+    if fields != ['TaskTemplate.ContainerSpec.Image']:
+        sys.exit('unexpected changes: {}'.format(fields))
+    if updated['TaskTemplate']['ContainerSpec']['Env'] != env:
+        sys.exit('Env lost by the targeted update: {}'.format(updated['TaskTemplate']['ContainerSpec']['Env']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        document = write_stack(root, args.services)
+        check(document)
+        rendered = render_stack_specs('app', document, {})
+        live = {name: live_spec(spec) for name, spec in rendered.items()}
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            diff_stack(render_stack_specs('app', document, {}), live)
+        elapsed = (time.perf_counter() - start) / args.rounds
+
+    print('{} services: render + diff {:8.1f} ms'.format(args.services, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
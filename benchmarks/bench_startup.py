@@ -0,0 +1,88 @@
+#! /bin/env python3
+# Measures the import time of `swarm-cli version` and `swarm-cli stack ls` and fails when a budget is exceeded.
+#
+#   python benchmarks/bench_startup.py [--rounds 5] [--version-budget 75] [--stack-ls-budget 100]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STACK_CONFIG = """basename: bench
+environments:
+  base: {}
+  dev:
+    extends: base
+"""
+
+COMPOSE = """version: '3.7'
+services:
+  web:
+    image: nginx
+  worker:
+    image: busybox
+"""
+
+
+def write_project(root: str):
+    with open(os.path.join(root, 'stack-config.yml'), 'w') as outfile:
+        outfile.write(STACK_CONFIG)
+    for env in ['base', 'dev']:
+        os.makedirs(os.path.join(root, env))
+        with open(os.path.join(root, env, 'docker-compose.yml'), 'w') as outfile:
+            outfile.write(COMPOSE)
+
+
+def measure(args, cwd: str):
+    # Sum of the top-level imports done from the moment swarm_cli starts being imported, this includes the
+    # dependencies imported lazily by the command itself
+    env = dict(os.environ, SWARM_CLI_NO_DAEMON='1', PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'swarm_cli.entrypoint'] + args, cwd=cwd, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    wall = time.perf_counter() - start
+    total = 0
+    started = False
+    for line in res.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if name.startswith('  '):
+            continue
+        name = name.strip()
+        if name.startswith('swarm_cli'):
+            started = True
+        if started:
+            total += int(cumulative)
+    return total / 1000, wall * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--version-budget', type=float, default=75, help="Import time budget in ms")
+    parser.add_argument('--stack-ls-budget', type=float, default=100, help="Import time budget in ms")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as root:
+        write_project(root)
+        # Warm up the config cache, stack ls is mostly run against an unchanged project
+        measure(['stack', 'ls'], root)
+        for cmd, budget in [(['version'], args.version_budget), (['stack', 'ls'], args.stack_ls_budget)]:
+            samples = [measure(cmd, root) for _ in range(args.rounds)]
+            imports = statistics.median(sample[0] for sample in samples)
+            wall = statistics.median(sample[1] for sample in samples)
+            ok = imports <= budget
+            failed = failed or not ok
+            print('swarm-cli {:<10s} imports {:7.1f} ms (budget {:5.0f} ms)  wall {:7.1f} ms  {}'.format(
+                ' '.join(cmd), imports, budget, wall, 'OK' if ok else 'OVER BUDGET'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
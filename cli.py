@@ -1,6 +1,6 @@
 #! /bin/env python3
 
-from swarm_cli.cli import root
+from swarm_cli.entrypoint import main
 
 if __name__ == '__main__':
-    root()
+    main()
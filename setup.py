@@ -25,7 +25,7 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'swarm-cli = swarm_cli.cli:root'
+            'swarm-cli = swarm_cli.entrypoint:main'
         ]
     },
     author='Luca Nardelli',
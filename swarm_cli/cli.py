@@ -1,22 +1,41 @@
 #! /bin/env python3
+import importlib
 import logging
 import os
 import subprocess
 import sys
-from io import StringIO
-from typing import List
+from typing import Dict
 
 import click
 import verboselogs
-from dotenv import load_dotenv
 
-from swarm_cli import cli_stack
-from swarm_cli.cli_swarm import swarm
 from swarm_cli.lib.logging import logger
-from .lib import SwarmModeState
 
 
-@click.group()
+class LazyGroup(click.Group):
+    """Group whose subcommands are imported only when they are dispatched.
+
+    `lazy_subcommands` maps a command name to the "module:attribute" path of the command object.
+    """
+
+    def __init__(self, *args, lazy_subcommands: Dict[str, str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands.keys()))
+
+    def get_command(self, ctx: click.Context, cmd_name: str):
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            module_name, attr = self.lazy_subcommands[cmd_name].split(':')
+            self.add_command(getattr(importlib.import_module(module_name), attr), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+
+@click.group(cls=LazyGroup, lazy_subcommands={
+    'swarm': 'swarm_cli.cli_swarm:swarm',
+    'stack': 'swarm_cli.cli_stack:stack',
+})
 @click.option('-v', '--verbose', count=True)
 @click.pass_context
 def root(ctx: click.Context, verbose: int):
@@ -42,8 +61,57 @@ def printenv():
 def version():
     print('2021-11-05')
 
-root.add_command(swarm)
-root.add_command(cli_stack.stack)
+@root.group()
+def daemon():
+    pass
+
+
+@daemon.command('run')
+@click.option('--idle-timeout', type=float, default=3600, help="Exit after this many seconds without requests")
+def daemon_run(idle_timeout: float):
+    from swarm_cli.daemon import Daemon, get_socket_path
+    Daemon(get_socket_path(), idle_timeout=idle_timeout).serve()
+
+
+@daemon.command('start')
+@click.option('--idle-timeout', type=float, default=3600, help="Exit after this many seconds without requests")
+def daemon_start(idle_timeout: float):
+    from swarm_cli.daemon import send_control, get_socket_path
+    status = send_control('status')
+    if status:
+        click.secho('Daemon already running with pid {}'.format(status['pid']))
+        return
+    if getattr(sys, 'frozen', False):
+        cmd = [sys.executable]
+    else:
+        cmd = [sys.executable, '-m', 'swarm_cli.entrypoint']
+    cmd += ['daemon', 'run', '--idle-timeout', str(idle_timeout)]
+    log_path = os.path.join(os.path.dirname(get_socket_path()), 'daemon.log')
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, 'a') as log_file:
+        subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file, start_new_session=True,
+                         env=dict(os.environ, SWARM_CLI_NO_DAEMON='1'))
+    click.secho('Daemon started, logging to {}'.format(log_path))
+
+
+@daemon.command('stop')
+def daemon_stop():
+    from swarm_cli.daemon import send_control
+    if send_control('stop') is None:
+        click.secho('Daemon is not running')
+    else:
+        click.secho('Daemon stopped')
+
+
+@daemon.command('status')
+def daemon_status():
+    from swarm_cli.daemon import send_control, get_socket_path
+    status = send_control('status')
+    if status is None:
+        click.secho('Daemon is not running')
+        sys.exit(1)
+    click.secho('Daemon running with pid {} on {}'.format(status['pid'], get_socket_path()))
+
 
 if __name__ == '__main__':
     root()
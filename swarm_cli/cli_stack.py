@@ -1,13 +1,17 @@
 import os
 import pprint
+import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union, List
 
 import click
-import dpath.util
 
 from swarm_cli.lib import load_env_files, run_cmd
 from swarm_cli.lib.logging import logger
+from swarm_cli.lib.utils import run_cmd_prefixed
+from swarm_cli.lib.stack_mode.replica_policy import POLICY_LOCAL_FIRST, replica_option
 from swarm_cli.lib.stack_mode.stack_mode_state import StackModeState
 
 
@@ -16,9 +20,7 @@ from swarm_cli.lib.stack_mode.stack_mode_state import StackModeState
 @click.option('--env', type=str, default='dev')
 @click.option('-y', '--yes', is_flag=True, type=bool, default=False)
 def stack(ctx: click.Context, env: str = 'env', yes=False):
-    state = StackModeState()
-    state.initFromFile('stack-config.yml')
-    state.selectEnv(env, ignore_prompt=yes)
+    state = StackModeState.load('stack-config.yml', env, ignore_prompt=yes)
     ctx.obj = state
     pass
 
@@ -29,39 +31,147 @@ def ls(ctx: click.Context):
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
     click.secho("Available services:")
-    for service in sorted(state.current_env.services.keys()):
+    for service in sorted(state.current_env.get_services()):
         click.secho("{}".format(service))
 
 
 @stack.command()
 @click.pass_context
-@click.argument('service')
+@click.argument('services', nargs=-1, required=True)
 @click.option('--tail', type=str, default='100')
-def logs(ctx: click.Context, service: str, tail: Union[str, int] = '100'):
+@click.option('--all-replicas', is_flag=True, help="Follow every running replica instead of the first one")
+@click.option('--buffer', type=int, default=1000, help="Maximum number of lines buffered per replica")
+@click.option('--since', type=str, default=None, help="Show logs since a UNIX timestamp, ISO date or duration (10m)")
+@click.option('--until', type=str, default=None, help="Show logs until a UNIX timestamp, ISO date or duration (10m)")
+@click.option('--grep', type=str, default=None, help="Only show lines matching this regular expression")
+@click.option('--fast', is_flag=True, help="Write raw log bytes to stdout/stderr, for high volume services")
+def logs(ctx: click.Context, services: List[str], tail: Union[str, int] = '100', all_replicas=False, buffer=1000,
+         since: str = None, until: str = None, grep: str = None, fast=False):
+    from swarm_cli.lib.stack_mode.log_output import parse_time_filter, raw_log_chunks, LogPump
+
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
-    state.current_env.ensure_has_service(service)
+    for service in services:
+        state.current_env.ensure_has_service(service)
 
     try:
         tail = int(tail)
     except:
         pass
-
-    fqsn = state.current_env.get_full_service_name(service)
+    try:
+        since, until = parse_time_filter(since), parse_time_filter(until)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    # Docker only stops following when --until is given
+    follow = until is None
+
+    if len(services) > 1 or all_replicas:
+        if fast:
+            logger.warn('--fast only applies to a single replica, ignoring it')
+        _merged_logs(state, services, tail, all_replicas=all_replicas, buffer=buffer, since=since, until=until,
+                     grep=grep, follow=follow)
+        return
+
+    fqsn = state.current_env.get_full_service_name(services[0])
     docker_container, client = state.get_first_running_container_for_service(fqsn=fqsn)
     if docker_container:
-        for log in docker_container.logs(follow=True, stream=True, tail=tail):
-            decoded: str = log.decode("utf-8")
+        if fast:
+            tty = docker_container.attrs.get('Config', {}).get('Tty', False)
+            pump = LogPump(sys.stdout.buffer, sys.stderr.buffer, tty=tty, grep=grep)
+            pump.run(raw_log_chunks(client, docker_container.id, follow=follow, tail=tail, since=since, until=until))
+            return
+        pattern = re.compile(grep) if grep else None
+        for log in docker_container.logs(follow=follow, stream=True, tail=tail, since=since, until=until):
+            decoded: str = log.decode("utf-8", errors="replace")
             decoded = decoded.rstrip()
+            if pattern and not pattern.search(decoded):
+                continue
             click.secho(decoded)
 
 
-def _build(state: StackModeState, dry_run=False):
+def _merged_logs(state: StackModeState, services: List[str], tail: Union[str, int], all_replicas=False, buffer=1000,
+                 since: float = None, until: float = None, grep: str = None, follow=True):
+    from swarm_cli.lib.stack_mode.log_streams import LogStream, merge_log_streams
+
+    streams = []
+    for service in services:
+        for replica, docker_container in _get_replicas(state, service, all_replicas=all_replicas):
+            chunks = docker_container.logs(follow=follow, stream=True, tail=tail, timestamps=True, since=since,
+                                           until=until)
+            streams.append(LogStream(replica, chunks, max_lines=buffer))
+    if not streams:
+        logger.error('No running container found')
+        sys.exit(1)
+
+    colors = ['cyan', 'yellow', 'green', 'magenta', 'blue', 'red']
+    width = max(len(stream.prefix) for stream in streams)
+    styled = {stream.prefix: click.style(stream.prefix.ljust(width), fg=colors[i % len(colors)])
+              for i, stream in enumerate(streams)}
+    pattern = re.compile(grep.encode()) if grep else None
+
+    def emit(prefix: str, message: bytes):
+        if pattern and not pattern.search(message):
+            return
+        click.echo('{} | {}'.format(styled[prefix], message.decode('utf-8', errors='replace').rstrip()))
+
+    merge_log_streams(streams, emit)
+
+
+def _get_replicas(state: StackModeState, service: str, all_replicas=True):
+    # Returns (service.slot@node, container) pairs for the running tasks of a service
+    from swarm_cli.lib.stack_mode.log_streams import task_prefix
+    fqsn = state.current_env.get_full_service_name(service)
+    containers = state.get_running_containers_for_service(fqsn, limit=None if all_replicas else 1)
+    if not containers:
+        logger.warn("No running task found for {}".format(fqsn))
+    res = []
+    for task, docker_container, _ in containers:
+        node_host, _ = state.get_node_address(task['NodeID'])
+        res.append((task_prefix(service, task, node_host), docker_container))
+    return res
+
+
+def _exec_on_all_replicas(state: StackModeState, service: str, cmd: List[str], jobs: int):
+    from swarm_cli.lib.stack_mode.fan_out import exec_on_replicas, print_replica_results
+    from swarm_cli.lib.stack_mode.log_streams import task_prefix
+    fqsn = state.current_env.get_full_service_name(service)
+    # Only the task list is fetched here, each container (and node connection) is resolved by its worker
+    replicas = [(task_prefix(service, task, state.get_node_address(task['NodeID'])[0]),
+                 lambda task=task: state.get_container_for_task(task)[0])
+                for task in state.get_running_tasks_for_service(fqsn)]
+    if not replicas:
+        logger.error('No running container found')
+        sys.exit(1)
+    logger.notice('Running {} on {} replicas'.format(' '.join(cmd), len(replicas)))
+    results = exec_on_replicas(replicas, cmd, jobs=jobs)
+    print_replica_results(results)
+    sys.exit(0 if all(result.ok for result in results) else 1)
+
+
+def _build(state: StackModeState, dry_run=False, incremental=False):
     state.use_base_docker_host()
     load_env_files(state.current_env.get_env_files_list(), ignore_missing=True)
     env = os.environ.copy()
     cmd = 'docker-compose {} build'.format(state.current_env.build_compose_override_list())
-    return run_cmd(cmd, dry_run=dry_run, env=env)
+    if not incremental:
+        return run_cmd(cmd, dry_run=dry_run, env=env)
+
+    from swarm_cli.lib.build_cache import BuildManifest, IncrementalBuild, get_build_targets
+    targets = get_build_targets(state.current_env.get_service_definitions(), state.current_env.get_project_dir(), env)
+    manifest = BuildManifest('stack:{}:{}'.format(os.path.abspath(state.config_path), state.env))
+    build = IncrementalBuild(manifest, targets, dry_run=dry_run)
+    try:
+        services = build.plan()
+        if services:
+            res = run_cmd('{} {}'.format(cmd, ' '.join(services)), dry_run=dry_run, env=env)
+            if res != 0:
+                return res
+        build.commit(services)
+    finally:
+        build.close()
+    logger.notice('Built {} of {} services'.format(len(services), len(targets)))
+    return 0
 
 
 def _pull(state: StackModeState, dry_run=False):
@@ -72,36 +182,205 @@ def _pull(state: StackModeState, dry_run=False):
     return run_cmd(cmd, dry_run=dry_run, env=env)
 
 
-def _push(state: StackModeState, dry_run=False):
+def _push(state: StackModeState, dry_run=False, skip_existing=False, jobs=8):
     state.use_base_docker_host()
     load_env_files(state.current_env.get_env_files_list(), ignore_missing=True)
     env = os.environ.copy()
     cmd = 'docker-compose {} push'.format(state.current_env.build_compose_override_list())
-    return run_cmd(cmd, dry_run=dry_run, env=env)
+    if not skip_existing:
+        return run_cmd(cmd, dry_run=dry_run, env=env)
 
-
-def _deploy(state: StackModeState, dry_run=False):
+    import docker
+    from swarm_cli.lib.registry import PushPlan
+    client = docker.from_env(environment=env)
+    try:
+        plan = PushPlan(client, state.get_resolved_compose().document, jobs=jobs)
+    finally:
+        client.close()
+    plan.print()
+    res = 0
+    started = time.monotonic()
+    if plan.services:
+        res = run_cmd('{} {}'.format(cmd, ' '.join(plan.services)), dry_run=dry_run, env=env)
+    plan.report(state.current_env.cfg.stack_name, None if dry_run else time.monotonic() - started)
+    return res
+
+
+def _pipelined_build_push(state: StackModeState, dry_run=False, push_jobs=2):
+    # Services are built one at a time and each image is pushed as soon as its build completes, so uploads overlap
+    # with the builds of the following services
+    state.use_base_docker_host()
+    load_env_files(state.current_env.get_env_files_list(), ignore_missing=True)
+    env = os.environ.copy()
+    overrides = state.current_env.build_compose_override_list()
+    services = state.current_env.get_buildable_services()
+    width = max([len(service) for service in services] + [0]) + len(':build')
+    pushes = {}
+    res = 0
+    with ThreadPoolExecutor(max_workers=max(1, push_jobs)) as executor:
+        for service in services:
+            cmd = 'docker-compose {} build {}'.format(overrides, service)
+            res = run_cmd_prefixed(cmd, '{}:build'.format(service).ljust(width), dry_run=dry_run, env=env)
+            if res != 0:
+                logger.error('Build of {} failed, waiting for running pushes'.format(service))
+                for future in pushes.values():
+                    future.cancel()
+                break
+            cmd = 'docker-compose {} push {}'.format(overrides, service)
+            pushes[service] = executor.submit(run_cmd_prefixed, cmd, '{}:push'.format(service).ljust(width),
+                                              dry_run=dry_run, env=env)
+    if res != 0:
+        return res
+    for service, future in pushes.items():
+        if future.result() != 0:
+            logger.error('Push of {} failed'.format(service))
+            res = future.result()
+    return res
+
+
+def _get_stack_changes(state: StackModeState):
+    from swarm_cli.lib.service_spec import diff_stack, get_undeclared, print_stack_changes, render_stack_specs
+    stack_name = state.current_env.cfg.stack_name
+    rendered = render_stack_specs(stack_name, state.get_resolved_compose().document)
+    index = state.get_service_index(refresh=True)
+    live = {name: service.attrs['Spec'] for name, service in index.services.items()}
+    changes = diff_stack(rendered, live)
+    print_stack_changes(stack_name, changes, get_undeclared(rendered, live))
+    return changes
+
+
+def _deploy(state: StackModeState, dry_run=False, wait=False, timeout=300, skip_unchanged=False):
+    state.use_env_docker_host()
+    load_env_files(state.current_env.get_env_files_list(), ignore_missing=True)
+    if skip_unchanged and not _get_stack_changes(state):
+        return 0
+    if not wait or dry_run:
+        with state.stack_file_args(dry_run=dry_run) as args:
+            cmd = 'docker stack deploy {} {} --with-registry-auth'.format(args, state.current_env.cfg.stack_name)
+            return run_cmd(cmd, dry_run=dry_run)
+
+    from swarm_cli.lib.stack_mode.rollout import get_update_started_at
+    # The baselines tell the rollouts started by this deploy apart from the previous ones
+    baselines = {name: get_update_started_at(service)
+                 for name, service in state.get_service_index(refresh=True).services.items()}
+    started = time.monotonic()
+    with state.stack_file_args() as args:
+        cmd = 'docker stack deploy {} {} --with-registry-auth'.format(args, state.current_env.cfg.stack_name)
+        res = run_cmd(cmd)
+    if res != 0:
+        return res
+    return _wait_for_stack_rollout(state, baselines, started, timeout)
+
+
+def _deploy_services(state: StackModeState, services: List[str], dry_run=False, wait=False, timeout=300, jobs=4):
+    # Targeted deploy: the new specs of the named services are sent with service updates, the rest of the stack (and
+    # `docker stack deploy`) is left alone
+    from swarm_cli.lib.service_spec import print_stack_changes, render_service_spec
+    from swarm_cli.lib.stack_mode.rollout import get_update_started_at
+    from swarm_cli.lib.stack_mode.service_update import apply_service_update, plan_service_updates
     state.use_env_docker_host()
     load_env_files(state.current_env.get_env_files_list(), ignore_missing=True)
-    cmd = 'docker stack deploy {} {} --with-registry-auth'.format(state.current_env.build_stack_override_list(),
-                                                                  state.current_env.cfg.stack_name)
-    return run_cmd(cmd, dry_run=dry_run)
+    for service in services:
+        state.current_env.ensure_has_service(service)
+    stack_name = state.current_env.cfg.stack_name
+    document = state.get_resolved_compose().document
+    index = state.get_service_index(refresh=True)
+    missing = index.missing(services)
+    if missing:
+        logger.error('Services {} are not deployed yet, run a full deploy'.format(', '.join(missing)))
+        return 1
+    names = [index.get_full_service_name(service) for service in services]
+    rendered = {index.get_full_service_name(service): render_service_spec(stack_name, service,
+                                                                          document['services'][service] or {},
+                                                                          document)
+                for service in services}
+    client = state.get_docker_client()
+    updates = plan_service_updates(client, index, rendered, names)
+    print_stack_changes(stack_name, {update.name: update.fields for update in updates})
+    blocked = [update for update in updates if update.blocked_by]
+    for update in blocked:
+        logger.error('{} changes {}, run a full deploy'.format(update.name, ', '.join(update.blocked_by)))
+    if blocked:
+        return 1
+    if dry_run or not updates:
+        return 0
+
+    baselines = {update.name: get_update_started_at(update.service) for update in updates}
+    started = time.monotonic()
+
+    def update_service(update):
+        try:
+            apply_service_update(client, update)
+            return True
+        except Exception as e:
+            logger.error('Update of {} failed: {}'.format(update.name, e))
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(update_service, updates))
+    if not all(results):
+        return 1
+    if not wait:
+        return 0
+    return _wait_for_stack_rollout(state, baselines, started, timeout, services=services)
+
+
+def _wait_for_stack_rollout(state: StackModeState, baselines: dict, started: float, timeout: float,
+                            services: List[str] = None):
+    from swarm_cli.lib.stack_mode.rollout import RolloutWaker, wait_for_rollout, print_rollout_summary
+
+    index = state.get_service_index(refresh=True)
+    services = index.declared if services is None else services
+    index.report_missing(services)
+    docker_services = [index.get_declared(service) for service in services if index.get_declared(service)]
+    if not docker_services:
+        return 0
+    waker = RolloutWaker(state.get_docker_client(), state.current_env.cfg.stack_name)
+    for docker_service in docker_services:
+        waker.get(docker_service.name)
+    try:
+        waker.start()
+        poll_interval = 5.0
+    except Exception as e:
+        logger.warning('Unable to follow docker events, polling services: {}'.format(e))
+        poll_interval = 2.0
+
+    def wait(docker_service):
+        return wait_for_rollout(docker_service, baselines.get(docker_service.name), timeout=timeout,
+                                started=started, poll_interval=poll_interval, wake=waker.get(docker_service.name))
+
+    # Waiting is mostly idle, every service is followed at the same time
+    try:
+        with ThreadPoolExecutor(max_workers=len(docker_services)) as executor:
+            results = list(executor.map(wait, docker_services))
+    finally:
+        waker.stop()
+    print_rollout_summary(results)
+    logger.notice('Stack {} rolled out in {:.1f}s'.format(state.current_env.cfg.stack_name,
+                                                           time.monotonic() - started))
+    return 0 if all(result.ok for result in results) else 1
 
 
 @stack.command()
 @click.option('--dry-run', is_flag=True)
+@click.option('--incremental', is_flag=True, help="Only build the services whose build context, Dockerfile or build "
+                                                   "args changed since the previous build")
 @click.pass_context
-def build(ctx: click.Context, dry_run=False):
+def build(ctx: click.Context, dry_run=False, incremental=False):
     state: StackModeState = ctx.obj
-    _build(state, dry_run)
+    _build(state, dry_run, incremental=incremental)
 
 
 @stack.command()
 @click.pass_context
 def config(ctx: click.Context):
+    from swarm_cli.lib.compose_merge import MERGE_NATIVE, get_compose_merge
     state: StackModeState = ctx.obj
     state.use_base_docker_host()
     load_env_files(state.current_env.get_env_files_list(), ignore_missing=True)
+    if get_compose_merge() == MERGE_NATIVE:
+        click.echo(state.get_resolved_compose().display_content, nl=False)
+        return
     env = os.environ.copy()
     cmd = 'docker-compose {} config'.format(state.current_env.build_compose_override_list())
     return run_cmd(cmd, env=env)
@@ -117,30 +396,56 @@ def pull(ctx: click.Context, dry_run=False):
 
 @stack.command()
 @click.option('--dry-run', is_flag=True)
+@click.option('--skip-existing', is_flag=True, help="Only push the images whose digest differs from the registry one")
+@click.option('--jobs', '-j', type=int, default=8, help="Registry checks run in parallel with --skip-existing")
 @click.pass_context
-def push(ctx: click.Context, dry_run=False):
+def push(ctx: click.Context, dry_run=False, skip_existing=False, jobs=8):
     state: StackModeState = ctx.obj
-    _push(state, dry_run)
+    _push(state, dry_run, skip_existing=skip_existing, jobs=jobs)
 
 
 @stack.command()
 @click.option('--dry-run', is_flag=True)
+@click.option('--wait', is_flag=True, help="Wait until every service of the stack has converged or rolled back")
+@click.option('--timeout', type=float, default=300, help="Seconds to wait for the rollout with --wait")
+@click.option('--skip-unchanged', is_flag=True, help="Only deploy when a service spec differs from the live one. "
+                                                      "Networks and the content of configs and secrets are not "
+                                                      "compared")
+@click.option('--services', type=str, default=None,
+              help="Comma separated services to update in place, without redeploying the rest of the stack")
+@click.option('--jobs', '-j', type=int, default=4, help="Services updated in parallel with --services")
 @click.pass_context
-def deploy(ctx: click.Context, dry_run=False):
+def deploy(ctx: click.Context, dry_run=False, wait=False, timeout=300, skip_unchanged=False, services=None, jobs=4):
     state: StackModeState = ctx.obj
-    _deploy(state, dry_run)
+    if services:
+        services = [service.strip() for service in services.split(',') if service.strip()]
+        res = _deploy_services(state, services, dry_run, wait=wait, timeout=timeout, jobs=jobs)
+        if res != 0:
+            sys.exit(res)
+        return
+    res = _deploy(state, dry_run, wait=wait, timeout=timeout, skip_unchanged=skip_unchanged)
+    if wait and res != 0:
+        sys.exit(res)
 
 
 @stack.command()
 @click.option('--dry-run', is_flag=True)
+@click.option('--pipeline', is_flag=True, help="Push each image as soon as its build completes")
+@click.option('--push-jobs', type=int, default=2, help="Maximum number of concurrent pushes in pipeline mode")
+@click.option('--wait', is_flag=True, help="Wait until every service of the stack has converged or rolled back")
+@click.option('--timeout', type=float, default=300, help="Seconds to wait for the rollout with --wait")
 @click.pass_context
-def bpd(ctx: click.Context, dry_run=False):
+def bpd(ctx: click.Context, dry_run=False, pipeline=False, push_jobs=2, wait=False, timeout=300):
     state = ctx.obj
-    res = _build(state, dry_run)
-    if res != 0: sys.exit(res)
-    res = _push(state, dry_run)
-    if res != 0: sys.exit(res)
-    res = _deploy(state, dry_run)
+    if pipeline:
+        res = _pipelined_build_push(state, dry_run, push_jobs=push_jobs)
+        if res != 0: sys.exit(res)
+    else:
+        res = _build(state, dry_run)
+        if res != 0: sys.exit(res)
+        res = _push(state, dry_run)
+        if res != 0: sys.exit(res)
+    res = _deploy(state, dry_run, wait=wait, timeout=timeout)
     sys.exit(res)
 
 
@@ -150,42 +455,53 @@ def bpd(ctx: click.Context, dry_run=False):
 def rm(ctx: click.Context, dry_run=False):
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
-    for service_name in sorted(state.current_env.services.keys()):
-        fqsn = state.current_env.get_full_service_name(service_name)
-        service = state.get_docker_client().services.get(fqsn)
-        click.secho("Removing {} - {}".format(fqsn, service.id))
-        service.remove()
+    index = state.get_service_index()
+    index.report_missing()
+    for service_name in sorted(state.current_env.get_services()):
+        service = index.get_declared(service_name)
+        if service is None:
+            continue
+        click.secho("Removing {} - {}".format(service.name, service.id))
+        if not dry_run:
+            service.remove()
 
 
 @stack.command()
 @click.argument('service')
 @click.argument('cmd', required=False)
+@click.option('--all-replicas', is_flag=True, help="Run cmd in every running replica")
+@click.option('--jobs', '-j', type=int, default=8, help="Maximum number of replicas running cmd at the same time")
+@replica_option
 @click.pass_context
-def sh(ctx: click.Context, service: str, cmd: str = None):
+def sh(ctx: click.Context, service: str, cmd: str = None, all_replicas=False, jobs=8, replica=POLICY_LOCAL_FIRST):
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
-    _launch_shell(state, service, cmd, shell='sh')
+    _launch_shell(state, service, cmd, shell='sh', all_replicas=all_replicas, jobs=jobs, replica=replica)
 
 
 @stack.command()
 @click.argument('service')
 @click.argument('cmd', required=False)
+@click.option('--all-replicas', is_flag=True, help="Run cmd in every running replica")
+@click.option('--jobs', '-j', type=int, default=8, help="Maximum number of replicas running cmd at the same time")
+@replica_option
 @click.pass_context
-def bash(ctx: click.Context, service: str, cmd: str = None):
+def bash(ctx: click.Context, service: str, cmd: str = None, all_replicas=False, jobs=8, replica=POLICY_LOCAL_FIRST):
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
-    _launch_shell(state, service, cmd, shell='bash')
+    _launch_shell(state, service, cmd, shell='bash', all_replicas=all_replicas, jobs=jobs, replica=replica)
 
 
 @stack.command()
 @click.argument('service')
+@replica_option
 @click.pass_context
-def attach(ctx: click.Context, service: str, cmd: str = None):
+def attach(ctx: click.Context, service: str, cmd: str = None, replica=POLICY_LOCAL_FIRST):
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
     state.current_env.ensure_has_service(service)
     fqsn = state.current_env.get_full_service_name(service)
-    docker_container, client = state.get_first_running_container_for_service(fqsn=fqsn)
+    docker_container, client = state.get_replica_container_for_service(fqsn, replica)
     if docker_container:
         logger.notice('Attaching to \'{}\''.format(docker_container.id))
         env = os.environ.copy()
@@ -197,11 +513,17 @@ def attach(ctx: click.Context, service: str, cmd: str = None):
         logger.error('No running container found')
 
 
-def _launch_shell(state: StackModeState, service, cmd: str = None, shell: str = 'sh'):
+def _launch_shell(state: StackModeState, service, cmd: str = None, shell: str = 'sh', all_replicas=False, jobs=8,
+                  replica=POLICY_LOCAL_FIRST):
     state.current_env.ensure_has_service(service)
+    if all_replicas:
+        if not cmd:
+            logger.error('A command is required with --all-replicas')
+            sys.exit(1)
+        _exec_on_all_replicas(state, service, [shell, '-c', cmd], jobs)
 
     fqsn = state.current_env.get_full_service_name(service)
-    docker_container, client = state.get_first_running_container_for_service(fqsn=fqsn)
+    docker_container, client = state.get_replica_container_for_service(fqsn, replica)
     if docker_container:
         logger.notice('Attaching to \'{}\''.format(docker_container.id))
         env = os.environ.copy()
@@ -222,13 +544,22 @@ def _launch_shell(state: StackModeState, service, cmd: str = None, shell: str =
 @click.argument('service')
 @click.argument('cmd')
 @click.argument('other', nargs=-1)
+@click.option('--all-replicas', is_flag=True, help="Run cmd in every running replica")
+@click.option('--jobs', '-j', type=int, default=8, help="Maximum number of replicas running cmd at the same time")
+@replica_option
 @click.pass_context
-def execCmd(ctx: click.Context, service: str, cmd: str, other: List[str], t=False, i=False):
+def execCmd(ctx: click.Context, service: str, cmd: str, other: List[str], t=False, i=False, all_replicas=False,
+            jobs=8, replica=POLICY_LOCAL_FIRST):
     state: StackModeState = ctx.obj
     state.current_env.ensure_has_service(service)
+    if all_replicas:
+        if t or i:
+            logger.error('-t and -i need a terminal, they can\'t be used with --all-replicas')
+            sys.exit(1)
+        _exec_on_all_replicas(state, service, [cmd] + list(other), jobs)
 
     fqsn = state.current_env.get_full_service_name(service)
-    docker_container, client = state.get_first_running_container_for_service(fqsn=fqsn)
+    docker_container, client = state.get_replica_container_for_service(fqsn, replica)
     if docker_container:
         logger.notice('Attaching to \'{}\''.format(docker_container.id))
         env = os.environ.copy()
@@ -247,10 +578,19 @@ def execCmd(ctx: click.Context, service: str, cmd: str, other: List[str], t=Fals
 
 @stack.command(name='ps')
 @click.argument('other', nargs=-1)
+@click.option('--watch', '-w', is_flag=True, help="Keep the task list up to date from the Docker events stream")
+@click.option('--resync', type=float, default=30, help="Seconds between two full task listings with --watch")
 @click.pass_context
-def ps(ctx: click.Context, other: List[str]):
+def ps(ctx: click.Context, other: List[str], watch=False, resync=30):
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
+    if watch:
+        from swarm_cli.lib.stack_mode.task_view import TaskView
+        try:
+            TaskView(state.get_docker_client(), state.current_env.cfg.stack_name, resync_interval=resync).watch()
+        except KeyboardInterrupt:
+            pass
+        return
     env = os.environ.copy()
     sys.exit(run_cmd("docker stack ps {}".format(state.current_env.cfg.stack_name), env=env))
 
@@ -279,38 +619,57 @@ def run(ctx: click.Context, dry_run=False, cmd: List[str] = []):
 @click.argument('services', nargs=-1)
 @click.pass_context
 def ports(ctx: click.Context, services: List[str]):
+    import dpath.util
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
     if len(services) == 0:
-        services = state.current_env.get_services()
-
-    client = state.get_docker_client()
+        services = sorted(state.current_env.get_services())
     for service in services:
         state.current_env.ensure_has_service(service)
-        fqsn = state.current_env.get_full_service_name(service)
-        service = client.services.get(fqsn)
-        if service:
-            ports = dpath.util.values(service.attrs, 'Endpoint/Ports/*')
+
+    index = state.get_service_index()
+    index.report_missing(services)
+    for service in services:
+        docker_service = index.get_declared(service)
+        if docker_service:
+            ports = dpath.util.values(docker_service.attrs, 'Endpoint/Ports/*')
             if len(ports) > 0:
-                print(fqsn)
+                print(docker_service.name)
                 for port in ports:
                     print("\t{:>6s}: {:>6s} -> {:6s}".format(str(port['Protocol']), str(port['PublishedPort']), str(port['TargetPort'])))
-        else:
-            logger.error('No service found')
 
 
 @stack.command()
 @click.argument('services', nargs=-1)
+@click.option('--wait', is_flag=True, help="Wait until every service has converged or rolled back")
+@click.option('--jobs', '-j', type=int, default=4, help="Maximum number of services updated at the same time with --wait")
+@click.option('--timeout', type=float, default=300, help="Seconds to wait for each service with --wait")
 @click.pass_context
-def force_update(ctx: click.Context, services: List[str]):
+def force_update(ctx: click.Context, services: List[str], wait=False, jobs=4, timeout=300):
     state: StackModeState = ctx.obj
     state.use_env_docker_host()
     for service in services:
         state.current_env.ensure_has_service(service)
-        client = state.get_docker_client()
-        fqsn = state.current_env.get_full_service_name(service)
-        service = client.services.get(fqsn)
-        if service:
-            print(service.force_update())
-        else:
-            logger.error('No service found {}'.format(service))
+
+    index = state.get_service_index()
+    index.report_missing(services)
+    docker_services = [index.get_declared(service) for service in services if index.get_declared(service)]
+    if not wait:
+        for docker_service in docker_services:
+            print(docker_service.force_update())
+        return
+
+    from swarm_cli.lib.stack_mode.rollout import get_update_started_at, wait_for_rollout, print_rollout_summary
+
+    def update_and_wait(docker_service):
+        baseline = get_update_started_at(docker_service)
+        started = time.monotonic()
+        logger.notice('Updating {}'.format(docker_service.name))
+        docker_service.force_update()
+        return wait_for_rollout(docker_service, baseline, timeout=timeout, started=started)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(update_and_wait, docker_services))
+    print_rollout_summary(results)
+    if not all(result.ok for result in results):
+        sys.exit(1)
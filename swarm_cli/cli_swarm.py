@@ -1,8 +1,14 @@
+import sys
+import time
 from typing import List
 
 import click
 
-from swarm_cli.lib import SwarmModeState, load_env_files, run_cmd
+from swarm_cli.lib import load_env_files, run_cmd
+from swarm_cli.lib.utils import run_cmd_prefixed
+from swarm_cli.lib.logging import logger
+from swarm_cli.lib.swarm_mode.swarm_mode_state import SwarmModeState
+from swarm_cli.lib.task_graph import TaskGraph, print_task_summary, all_tasks_succeeded
 
 
 @click.group()
@@ -40,44 +46,126 @@ def preset_ls(ctx: click.Context, preset: str):
 @preset.command('deploy')
 @click.option('--preset', '-p', help="Select a preset", required=True)
 @click.option('--dry-run', is_flag=True)
+@click.option('--jobs', '-j', type=int, default=1, help="Number of stacks to deploy concurrently")
+@click.option('--skip-unchanged', is_flag=True, help="Only deploy the stacks whose service specs differ from the "
+                                                      "live ones. Networks and the content of configs and secrets "
+                                                      "are not compared")
 @click.pass_context
-def preset_deploy(ctx: click.Context, preset: str = None, dry_run=False):
+def preset_deploy(ctx: click.Context, preset: str = None, dry_run=False, jobs=1, skip_unchanged=False):
     state: SwarmModeState = ctx.obj
     state.ensure_preset(preset)
     preset_data = state.cfg['presets'][preset]
     load_env_files(preset_data.get('env_files', []), ignore_missing=True)
     stacks = state.cfg['presets'][preset]['stacks']
+
+    def get_stack_changes(name, variant, env):
+        import docker
+        from swarm_cli.lib.compose_merge import resolve_compose
+        from swarm_cli.lib.service_spec import diff_stack, get_undeclared, print_stack_changes, render_stack_specs
+        from swarm_cli.lib.stack_mode.service_index import ServiceIndex
+        document = resolve_compose(state.get_stack_files(name, variant), environ=env, cache=state.config_cache).document
+        rendered = render_stack_specs(name, document, env)
+        client = docker.from_env(environment=env)
+        try:
+            index = ServiceIndex(client, name, [])
+        finally:
+            client.close()
+        live = {fqsn: service.attrs['Spec'] for fqsn, service in index.services.items()}
+        changes = diff_stack(rendered, live)
+        print_stack_changes(name, changes, get_undeclared(rendered, live))
+        return changes
+
+    def deploy_stack(name, variant):
+        env = state.get_environment_for_stack(preset, name, variant)
+        if skip_unchanged and not get_stack_changes(name, variant, env):
+            return 0
+        with state.deploy_file_args_for_stack(name, variant, env, dry_run) as args:
+            cmd = ' '.join(['docker', 'stack', 'deploy', args, name])
+            return run_cmd(cmd, dry_run=dry_run, env=env, check=False)
+
+    graph = TaskGraph()
     for k, v in stacks.items():
         name, variant = k, v['variant']
-        cmd = ' '.join(['docker', 'stack', 'deploy', state.build_deploy_sequence_for_stack(name, variant), name])
-        run_cmd(cmd, dry_run=dry_run, env=state.get_environment_for_stack(preset, name, variant))
+        graph.add(name, lambda name=name, variant=variant: deploy_stack(name, variant),
+                  depends_on=state.get_stack_dependencies(preset, name))
+    try:
+        results = graph.run(jobs=jobs)
+    except ValueError as e:
+        logger.error('{}. Check swarm-config.yml'.format(e))
+        exit(1)
+    print_task_summary(results, title='Deploy summary')
+    if not all_tasks_succeeded(results):
+        sys.exit(1)
 
 
 @preset.command('build')
 @click.option('--preset', '-p', help="Select a preset", required=True)
 @click.option('--dry-run', is_flag=True)
+@click.option('--jobs', '-j', type=int, default=1, help="Number of stacks to build concurrently")
+@click.option('--incremental', is_flag=True, help="Only build the services whose build context, Dockerfile or build "
+                                                   "args changed since the previous build")
 @click.pass_context
-def preset_build(ctx: click.Context, preset: str = None, dry_run=False):
+def preset_build(ctx: click.Context, preset: str = None, dry_run=False, jobs=1, incremental=False):
     state: SwarmModeState = ctx.obj
     state.ensure_preset(preset)
     preset_data = state.cfg['presets'][preset]
     load_env_files(preset_data.get('env_files', []), ignore_missing=True)
     stacks = state.cfg['presets'][preset]['stacks']
-    for k, v in stacks.items():
-        name, variant = k, v['variant']
+    parallel = jobs > 1
+    width = max([len(k) for k in stacks.keys()] + [0])
+
+    def run_build(name, cmd, cwd, env):
+        if not parallel:
+            return run_cmd(cmd, dry_run=dry_run, cwd=cwd, env=env, check=False)
+        # BuildKit builds layers concurrently and shares the cache between the parallel builds, plain progress
+        # keeps its output line based so that it can be prefixed
+        env.setdefault('DOCKER_BUILDKIT', '1')
+        env.setdefault('COMPOSE_DOCKER_CLI_BUILD', '1')
+        env.setdefault('BUILDKIT_PROGRESS', 'plain')
+        return run_cmd_prefixed(cmd, name.ljust(width), dry_run=dry_run, cwd=cwd, env=env)
+
+    def build_stack(name, variant):
         state.prepare_build_folder(preset, name, variant)
         cmd = ' '.join(['docker-compose', state.build_compose_sequence_for_stack(name, variant), 'build'])
-        run_cmd(cmd,
-                dry_run=dry_run,
-                cwd=state.get_build_folder(preset, name, variant),
-                env=state.get_environment_for_stack(preset, name, variant)
-                )
+        cwd = state.get_build_folder(preset, name, variant)
+        env = state.get_environment_for_stack(preset, name, variant)
+        if not incremental:
+            return run_build(name, cmd, cwd, env)
+
+        from swarm_cli.lib.build_cache import BuildManifest, IncrementalBuild, get_build_targets
+        targets = get_build_targets(state.get_services_for_stack(name, variant),
+                                    state.get_project_dir_for_stack(name, variant), env)
+        build = IncrementalBuild(BuildManifest('preset:{}:{}:{}'.format(preset, name, variant)), targets,
+                                 dry_run=dry_run)
+        try:
+            services = build.plan()
+            if services:
+                res = run_build(name, '{} {}'.format(cmd, ' '.join(services)), cwd, env)
+                if res != 0:
+                    return res
+            build.commit(services)
+        finally:
+            build.close()
+        logger.notice('{}: built {} of {} services'.format(name, len(services), len(targets)))
+        return 0
+
+    graph = TaskGraph()
+    for k, v in stacks.items():
+        name, variant = k, v['variant']
+        graph.add(name, lambda name=name, variant=variant: build_stack(name, variant))
+    results = graph.run(jobs=jobs)
+    print_task_summary(results, title='Build summary')
+    if not all_tasks_succeeded(results):
+        sys.exit(1)
+
 
 @preset.command('push')
 @click.option('--preset', '-p', help="Select a preset", required=True)
 @click.option('--dry-run', is_flag=True)
+@click.option('--skip-existing', is_flag=True, help="Only push the images whose digest differs from the registry one")
+@click.option('--jobs', '-j', type=int, default=8, help="Registry checks run in parallel with --skip-existing")
 @click.pass_context
-def preset_push(ctx: click.Context, preset: str = None, dry_run=False):
+def preset_push(ctx: click.Context, preset: str = None, dry_run=False, skip_existing=False, jobs=8):
     state: SwarmModeState = ctx.obj
     state.ensure_preset(preset)
     preset_data = state.cfg['presets'][preset]
@@ -86,10 +174,29 @@ def preset_push(ctx: click.Context, preset: str = None, dry_run=False):
     for k, v in stacks.items():
         name, variant = k, v['variant']
         cmd = ' '.join(['docker-compose', state.build_compose_sequence_for_stack(name, variant), 'push'])
-        run_cmd(cmd,
-                dry_run=dry_run,
-                env=state.get_environment_for_stack(preset, name, variant)
-                )
+        env = state.get_environment_for_stack(preset, name, variant)
+        if not skip_existing:
+            run_cmd(cmd,
+                    dry_run=dry_run,
+                    env=env
+                    )
+            continue
+
+        import docker
+        from swarm_cli.lib.compose_merge import resolve_compose
+        from swarm_cli.lib.registry import PushPlan
+        document = resolve_compose(state.get_stack_files(name, variant), environ=env,
+                                   cache=state.config_cache).document
+        client = docker.from_env(environment=env)
+        try:
+            plan = PushPlan(client, document, jobs=jobs)
+        finally:
+            client.close()
+        plan.print()
+        started = time.monotonic()
+        if plan.services:
+            run_cmd('{} {}'.format(cmd, ' '.join(plan.services)), dry_run=dry_run, env=env)
+        plan.report(name, None if dry_run else time.monotonic() - started)
 
 # @swarm.group()
 # def stack():
@@ -1,8 +1,10 @@
-import socket
+import time
 
 from docker import DockerClient
 
 from swarm_cli.lib.logging import logger
+from swarm_cli.lib.ssh_transport import get_ssh_transport, parse_ssh_url, resolve_host, SshMultiplexer, \
+    TRANSPORT_MULTIPLEX, TRANSPORT_SSH
 
 
 class Client(DockerClient):
@@ -10,12 +12,20 @@ class Client(DockerClient):
 
     def __init__(self, *args, base_url: str = None, **kwargs):
         logger.notice('Connecting to docker at {}'.format(base_url))
-        if base_url is not None and 'ssh://' in base_url:
-            host = base_url.strip("ssh://").split('@')[1]
-            ip = socket.gethostbyname(host)
-            base_url = base_url.replace(host, ip)
-            logger.verbose('Retrieved ip, new base_url {}'.format(base_url))
+        start = time.monotonic()
+        if base_url is not None and base_url.startswith('ssh://'):
+            transport = get_ssh_transport()
+            user, host, port = parse_ssh_url(base_url)
+            if transport == TRANSPORT_MULTIPLEX:
+                base_url = SshMultiplexer(user, host, port).ensure()
+                kwargs.pop('use_ssh_client', None)
+            else:
+                ip = resolve_host(host)
+                base_url = base_url.replace(host, ip, 1)
+                kwargs['use_ssh_client'] = transport == TRANSPORT_SSH
+            logger.verbose('Using {} transport, new base_url {}'.format(transport, base_url))
         self.docker_host = base_url
         kwargs['timeout'] = kwargs.get('timeout', 5)
         kwargs['version'] = kwargs.get('version', 'auto')
         super().__init__(*args, base_url=base_url, **kwargs)
+        logger.verbose('Connected to {} in {:.1f} ms'.format(base_url, (time.monotonic() - start) * 1000))
@@ -0,0 +1,224 @@
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import List, Optional
+
+# This module is imported by the thin client on every invocation, keep its top-level imports light: everything that
+# is only needed by the daemon itself is imported inside serve() and friends.
+
+# Commands that are safe to run inside the daemon: short lived and without side effects on the daemon process
+FORWARDED_COMMANDS = [
+    ('version',),
+    ('stack', 'ls'),
+    ('stack', 'ports'),
+    ('stack', 'ps'),
+    ('stack', 'config'),
+    ('stack', 'env'),
+    ('swarm', 'preset', 'ls'),
+]
+
+# Options turning a forwarded command into a long running one, which would block the daemon
+FOREGROUND_OPTIONS = ['--watch', '-w']
+
+
+def get_socket_path():
+    return os.environ.get('SWARM_CLI_DAEMON_SOCKET',
+                          os.path.expanduser(os.path.join('~', '.swarm-cli', 'daemon.sock')))
+
+
+def _recv_exactly(conn: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return data
+
+
+def _send_message(conn: socket.socket, payload: dict, fds: List[int] = None):
+    data = json.dumps(payload).encode()
+    header = struct.pack('!I', len(data))
+    if fds:
+        socket.send_fds(conn, [header], fds)
+    else:
+        conn.sendall(header)
+    conn.sendall(data)
+
+
+def _recv_message(conn: socket.socket, max_fds: int = 0):
+    fds = []
+    if max_fds:
+        header, fds, _, _ = socket.recv_fds(conn, 4, max_fds)
+        if len(header) < 4:
+            header += _recv_exactly(conn, 4 - len(header))
+    else:
+        header = _recv_exactly(conn, 4)
+    size, = struct.unpack('!I', header)
+    return json.loads(_recv_exactly(conn, size).decode()), fds
+
+
+def forward(argv: List[str]) -> Optional[int]:
+    """Runs the command in the daemon if one is listening. Returns None when the caller has to run it itself."""
+    path = get_socket_path()
+    if not hasattr(socket, 'send_fds') or not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(path)
+            # The daemon writes straight to our stdio, so colors, tty detection and subprocess output just work
+            _send_message(conn, {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}, fds=[0, 1, 2])
+            reply, _ = _recv_message(conn)
+    except (OSError, ValueError):
+        return None
+    if not reply.get('handled'):
+        return None
+    return reply.get('exit', 0)
+
+
+def resolve_command_path(root, argv: List[str]):
+    import click
+    path = []
+    cmd = root
+    try:
+        ctx = root.make_context('swarm-cli', list(argv), resilient_parsing=True)
+        while isinstance(cmd, click.MultiCommand):
+            rest = ctx.protected_args + ctx.args
+            if not rest:
+                break
+            name, sub, rest = cmd.resolve_command(ctx, rest)
+            if sub is None:
+                break
+            path.append(name)
+            ctx = sub.make_context(name, rest, parent=ctx, resilient_parsing=True)
+            cmd = sub
+    except click.ClickException:
+        return None
+    return tuple(path)
+
+
+class Daemon:
+    def __init__(self, socket_path: str, idle_timeout: float = 3600):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.running = True
+        self.lock = threading.Lock()
+
+    def run_command(self, argv: List[str], cwd: str, env: dict, fds: List[int]) -> Optional[int]:
+        from swarm_cli.cli import root
+        from swarm_cli.lib.stack_mode.stack_mode_state import StackModeState
+
+        if resolve_command_path(root, argv) not in FORWARDED_COMMANDS:
+            return None
+        if any(arg in FOREGROUND_OPTIONS for arg in argv):
+            return None
+        saved_fds = [os.dup(fd) for fd in (0, 1, 2)]
+        saved_cwd = os.getcwd()
+        saved_env = dict(os.environ)
+        code = 0
+        try:
+            for target, fd in zip((0, 1, 2), fds):
+                os.dup2(fd, target)
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env)
+            StackModeState.keep_warm = True
+            try:
+                root.main(args=argv, prog_name='swarm-cli', standalone_mode=True)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception as e:
+                sys.stderr.write('Error: {}\n'.format(e))
+                code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for target, fd in zip((0, 1, 2), saved_fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+        return code
+
+    def handle(self, conn: socket.socket):
+        request, fds = _recv_message(conn, max_fds=3)
+        try:
+            if request.get('control') == 'stop':
+                self.running = False
+                _send_message(conn, {'handled': True, 'exit': 0})
+                return
+            if request.get('control') == 'status':
+                _send_message(conn, {'handled': True, 'pid': os.getpid()})
+                return
+            if len(fds) != 3:
+                _send_message(conn, {'handled': False})
+                return
+            start = time.monotonic()
+            with self.lock:
+                code = self.run_command(request['argv'], request['cwd'], request['env'], fds)
+            if code is None:
+                _send_message(conn, {'handled': False})
+            else:
+                _send_message(conn, {'handled': True, 'exit': code})
+                self.log('{} -> {} in {:.1f} ms'.format(' '.join(request['argv']), code,
+                                                         (time.monotonic() - start) * 1000))
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def log(self, message: str):
+        sys.stderr.write('[{}] {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'), message))
+        sys.stderr.flush()
+
+    def serve(self):
+        # Warm up the imports the commands need before accepting connections
+        import swarm_cli.cli  # noqa: F401
+        import swarm_cli.cli_stack  # noqa: F401
+
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(16)
+        server.settimeout(self.idle_timeout)
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        self.log('Listening on {}'.format(self.socket_path))
+        try:
+            while self.running:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    self.log('Idle for {}s, exiting'.format(self.idle_timeout))
+                    break
+                with conn:
+                    conn.settimeout(None)
+                    try:
+                        self.handle(conn)
+                    except (OSError, ValueError) as e:
+                        self.log('Request failed: {}'.format(e))
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+def send_control(command: str) -> Optional[dict]:
+    path = get_socket_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(path)
+            _send_message(conn, {'control': command})
+            reply, _ = _recv_message(conn)
+            return reply
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,17 @@
+import os
+import sys
+
+
+def main():
+    # Hand the command to a running daemon before importing anything heavy, fall back to running it here
+    if not os.environ.get('SWARM_CLI_NO_DAEMON'):
+        from swarm_cli.daemon import forward
+        code = forward(sys.argv[1:])
+        if code is not None:
+            sys.exit(code)
+    from swarm_cli.cli import root
+    root(prog_name='swarm-cli')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1 @@
-from swarm_cli.lib.swarm_mode.swarm_mode_state import SwarmModeState
 from .utils import load_required_yaml, load_env_files, run_cmd, load_env_dict, load_env_val
\ No newline at end of file
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import re
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from swarm_cli.lib.config_cache import get_cache_dir
+from swarm_cli.lib.env_parser import expand_vars
+from swarm_cli.lib.logging import logger
+
+# Bump whenever the way contexts are hashed changes, every service is then rebuilt once
+MANIFEST_VERSION = 1
+
+
+def _pattern_to_regex(pattern: str):
+    # Same syntax as the .dockerignore patterns of the docker CLI: * and ? never match /, ** matches any number of
+    # directories
+    res = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            res += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            res += '.*'
+            i += 2
+            continue
+        if c == '*':
+            res += '[^/]*'
+        elif c == '?':
+            res += '[^/]'
+        elif c == '[':
+            end = pattern.find(']', i)
+            if end == -1:
+                res += re.escape(c)
+            else:
+                res += pattern[i:end + 1].replace('[!', '[^')
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            res += re.escape(pattern[i])
+        else:
+            res += re.escape(c)
+        i += 1
+    return re.compile('^{}$'.format(res))
+
+
+class DockerIgnore:
+    def __init__(self, patterns: List[str]):
+        self.rules: List[Tuple[object, bool]] = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negate = pattern.startswith('!')
+            if negate:
+                pattern = pattern[1:].strip()
+            pattern = os.path.normpath(pattern).replace(os.sep, '/').lstrip('/')
+            if pattern in ('', '.'):
+                continue
+            self.rules.append((_pattern_to_regex(pattern), negate))
+        self.has_exceptions = any(negate for _, negate in self.rules)
+
+    @classmethod
+    def from_context(cls, context: str) -> 'DockerIgnore':
+        try:
+            with open(os.path.join(context, '.dockerignore'), 'r') as infile:
+                return cls(infile.read().splitlines())
+        except OSError:
+            return cls([])
+
+    def is_excluded(self, path: str) -> bool:
+        # A pattern also excludes everything below a directory it matches
+        parents = [path]
+        while '/' in parents[-1]:
+            parents.append(parents[-1].rsplit('/', 1)[0])
+        excluded = False
+        for regex, negate in self.rules:
+            if any(regex.match(candidate) for candidate in parents):
+                excluded = not negate
+        return excluded
+
+
+def _walk_context(context: str, ignore: DockerIgnore) -> Dict[str, Tuple[int, int, int]]:
+    """Returns {relative path: (mtime_ns, size, mode)} for every file of a build context docker would send."""
+    files = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(context, rel_dir) if rel_dir else context)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                rel = '{}/{}'.format(rel_dir, entry.name) if rel_dir else entry.name
+                excluded = ignore.is_excluded(rel)
+                if entry.is_dir(follow_symlinks=False):
+                    # Files of an excluded directory can only come back through an exception pattern
+                    if not excluded or ignore.has_exceptions:
+                        stack.append(rel)
+                    continue
+                if excluded:
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                files[rel] = (st.st_mtime_ns, st.st_size, st.st_mode)
+    return files
+
+
+def _hash_file(path: str, mode: int) -> str:
+    digest = hashlib.sha256()
+    if stat.S_ISLNK(mode):
+        digest.update(os.readlink(path).encode())
+        return digest.hexdigest()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BuildTarget:
+    def __init__(self, service: str, context: str, dockerfile: str, args: Dict[str, str], target: Optional[str],
+                 image: str):
+        self.service = service
+        self.context = context
+        self.dockerfile = dockerfile
+        self.args = args
+        self.target = target
+        self.image = image
+
+
+def get_build_targets(services: Dict[str, dict], project_dir: str, environ: Dict[str, str] = None) -> List[BuildTarget]:
+    """Resolves the build section of compose service definitions the way docker-compose does."""
+    environ = os.environ if environ is None else environ
+    project = re.sub(r'[^-_a-z0-9]', '', os.path.basename(os.path.abspath(project_dir)).lower())
+
+    def interpolate(value):
+        return expand_vars(str(value), environ.get) if value is not None else None
+
+    targets = []
+    for name, definition in sorted(services.items()):
+        build = (definition or {}).get('build')
+        if build is None:
+            continue
+        if not isinstance(build, dict):
+            build = {'context': build}
+        context = os.path.abspath(os.path.join(project_dir, interpolate(build.get('context', '.'))))
+        dockerfile = os.path.join(context, interpolate(build.get('dockerfile', 'Dockerfile')))
+        args = build.get('args') or {}
+        if isinstance(args, list):
+            args = dict(arg.split('=', 1) if '=' in arg else (arg, None) for arg in args)
+        # Arguments without a value are taken from the environment
+        args = {k: interpolate(v) if v is not None else environ.get(k) for k, v in args.items()}
+        image = interpolate(definition.get('image')) or '{}_{}'.format(project, name)
+        targets.append(BuildTarget(name, context, dockerfile, args, interpolate(build.get('target')), image))
+    return targets
+
+
+class BuildManifest:
+    """Content hashes of the build inputs of each service and the image built from them.
+
+    The digests of the context files are kept along with their mtime and size, only files that changed since the
+    previous run are read again.
+    """
+
+    def __init__(self, name: str, jobs: int = 8):
+        key = hashlib.sha1(name.encode()).hexdigest()[:16]
+        self.path = os.path.join(get_cache_dir(), 'builds', '{}.json'.format(key))
+        self.jobs = jobs
+        self.contexts: Dict[str, Dict[str, list]] = {}
+        self.services: Dict[str, dict] = {}
+        try:
+            with open(self.path, 'r') as infile:
+                data = json.load(infile)
+            if data.get('version') == MANIFEST_VERSION:
+                self.contexts = data.get('contexts', {})
+                self.services = data.get('services', {})
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as outfile:
+                json.dump({'version': MANIFEST_VERSION, 'contexts': self.contexts, 'services': self.services}, outfile)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.debug('Unable to write build manifest: {}'.format(e))
+
+    def hash_targets(self, targets: List[BuildTarget]) -> Dict[str, str]:
+        contexts = sorted(set(target.context for target in targets))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            walked = dict(zip(contexts, executor.map(
+                lambda context: _walk_context(context, DockerIgnore.from_context(context)), contexts)))
+
+            # Only the files whose mtime or size changed are read
+            to_hash = []
+            for context, files in walked.items():
+                previous = self.contexts.get(context, {})
+                for rel, (mtime, size, mode) in files.items():
+                    cached = previous.get(rel)
+                    if cached is None or cached[0] != mtime or cached[1] != size:
+                        to_hash.append((context, rel, mode))
+            digests = executor.map(lambda item: _hash_file(os.path.join(item[0], item[1]), item[2]), to_hash)
+            fresh = {(context, rel): digest for (context, rel, _), digest in zip(to_hash, digests)}
+            logger.verbose('Hashed {} changed files in {} build contexts'.format(len(to_hash), len(contexts)))
+
+        for context, files in walked.items():
+            previous = self.contexts.get(context, {})
+            self.contexts[context] = {
+                rel: [mtime, size, fresh[(context, rel)] if (context, rel) in fresh else previous[rel][2]]
+                for rel, (mtime, size, mode) in files.items()
+            }
+
+        res = {}
+        for target in targets:
+            digest = hashlib.sha256()
+            for rel, (_, _, file_digest) in sorted(self.contexts[target.context].items()):
+                mode = walked[target.context][rel][2]
+                digest.update('{}\0{}\0{:o}\n'.format(rel, file_digest, mode & 0o777).encode())
+            # The Dockerfile can live outside of the context
+            try:
+                digest.update(_hash_file(target.dockerfile, os.lstat(target.dockerfile).st_mode).encode())
+            except OSError:
+                digest.update(b'missing dockerfile')
+            digest.update(json.dumps([os.path.relpath(target.dockerfile, target.context), sorted(target.args.items()),
+                                      target.target]).encode())
+            res[target.service] = digest.hexdigest()
+        return res
+
+    def get_image_id(self, target: BuildTarget, digest: str) -> Optional[str]:
+        record = self.services.get(target.service)
+        if record is None or record.get('hash') != digest:
+            return None
+        return record.get('image_id')
+
+    def record(self, target: BuildTarget, digest: str, image_id: str):
+        self.services[target.service] = {'hash': digest, 'image': target.image, 'image_id': image_id}
+
+
+def _split_image(image: str):
+    # The tag is after the last colon, unless that colon belongs to a registry port
+    repository, _, tag = image.rpartition(':')
+    if not repository or '/' in tag:
+        return image, 'latest'
+    return repository, tag
+
+
+class IncrementalBuild:
+    """Decides which services of a compose project need a build and reuses the previous images for the others."""
+
+    def __init__(self, manifest: BuildManifest, targets: List[BuildTarget], dry_run=False):
+        self.manifest = manifest
+        self.targets = {target.service: target for target in targets}
+        self.dry_run = dry_run
+        self.hashes: Dict[str, str] = {}
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import docker
+            self._client = docker.from_env()
+        return self._client
+
+    def plan(self) -> List[str]:
+        """Returns the services to build, the images of the others are tagged with their current name."""
+        from docker.errors import ImageNotFound
+        self.hashes = self.manifest.hash_targets(list(self.targets.values()))
+        to_build = []
+        for service, target in self.targets.items():
+            image_id = self.manifest.get_image_id(target, self.hashes[service])
+            if image_id is None:
+                to_build.append(service)
+                continue
+            try:
+                image = self._get_client().images.get(image_id)
+            except ImageNotFound:
+                logger.verbose('{}: previous image {} is gone'.format(service, image_id[:19]))
+                to_build.append(service)
+                continue
+            if target.image not in image.tags:
+                logger.notice('{}: unchanged, tagging {} as {}'.format(service, image_id[:19], target.image))
+                if not self.dry_run:
+                    repository, tag = _split_image(target.image)
+                    image.tag(repository, tag)
+            else:
+                logger.notice('{}: unchanged, reusing {}'.format(service, target.image))
+        return to_build
+
+    def commit(self, services: List[str]):
+        """Records the images built for `services`."""
+        if self.dry_run:
+            return
+        for service in services:
+            target = self.targets[service]
+            try:
+                image_id = self._get_client().images.get(target.image).id
+            except Exception as e:
+                logger.warning('{}: unable to find the image {}: {}'.format(service, target.image, e))
+                continue
+            self.manifest.record(target, self.hashes[service], image_id)
+        self.manifest.save()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -0,0 +1,300 @@
+import contextlib
+import hashlib
+import os
+import re
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+from swarm_cli.lib.config_cache import ConfigCache
+from swarm_cli.lib.env_parser import expand_vars
+from swarm_cli.lib.logging import logger
+from swarm_cli.lib.utils import load_required_yaml
+
+# Layered compose files are merged in process into a single resolved document, `docker stack deploy` then gets one
+# -c and `stack config` never starts docker-compose. SWARM_CLI_COMPOSE_MERGE=cli passes every file to docker instead.
+MERGE_NATIVE = 'native'
+MERGE_CLI = 'cli'
+
+
+def get_compose_merge():
+    return os.environ.get('SWARM_CLI_COMPOSE_MERGE', MERGE_NATIVE)
+
+
+# Mappings that can also be written as lists of KEY=VALUE (or KEY:VALUE) strings
+_KEY_VALUE_LISTS = {'environment': '=', 'labels': '=', 'args': '=', 'sysctls': '=', 'extra_hosts': ':'}
+# Lists merged per key, an override replaces the item with the same key
+_KEYED_LISTS = ['ports', 'volumes', 'devices', 'secrets', 'configs']
+# Lists merged as sets, in order of appearance
+_UNIQUE_LISTS = ['cap_add', 'cap_drop', 'expose', 'dns', 'dns_search', 'env_file', 'tmpfs', 'security_opt',
+                 'external_links', 'volumes_from', 'depends_on']
+# Always replaced as a whole
+_REPLACED = ['command', 'entrypoint', 'test']
+
+# Values that docker expects typed, interpolated strings are converted back. Same list as the docker CLI loader.
+_INT_PATHS = [
+    'services.*.deploy.replicas', 'services.*.deploy.update_config.parallelism',
+    'services.*.deploy.rollback_config.parallelism', 'services.*.deploy.restart_policy.max_attempts',
+    'services.*.healthcheck.retries', 'services.*.ports.*.target', 'services.*.ports.*.published',
+    'services.*.ulimits.*', 'services.*.ulimits.*.hard', 'services.*.ulimits.*.soft',
+    'services.*.deploy.placement.max_replicas_per_node',
+]
+_BOOL_PATHS = [
+    'services.*.read_only', 'services.*.stdin_open', 'services.*.tty', 'services.*.privileged', 'services.*.init',
+    'services.*.volumes.*.read_only', 'networks.*.external', 'networks.*.attachable', 'networks.*.internal',
+    'volumes.*.external', 'secrets.*.external', 'configs.*.external',
+]
+
+
+def _to_mapping(value, separator: str) -> Dict[str, Any]:
+    if isinstance(value, dict):
+        return dict(value)
+    res = {}
+    for item in value or []:
+        key, sep, val = str(item).partition(separator)
+        res[key.strip()] = val if sep else None
+    return res
+
+
+def _volume_key(volume):
+    if isinstance(volume, dict):
+        return volume.get('target')
+    parts = str(volume).split(':')
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+def _port_key(port):
+    # Like the docker CLI, a published port is overridden per protocol whatever its syntax: "[ip:]published:target"
+    # or {published, target}. Ports that aren't published are keyed by their target.
+    if isinstance(port, dict):
+        published, target, protocol = port.get('published'), port.get('target'), port.get('protocol')
+    else:
+        mapping, _, protocol = str(port).partition('/')
+        parts = mapping.rsplit(':', 2)
+        published, target = (parts[-2] if len(parts) > 1 else None), parts[-1]
+    if published in (None, ''):
+        return 'target', str(target), protocol or 'tcp'
+    return 'published', str(published), protocol or 'tcp'
+
+
+def _list_key(key: str, item):
+    if key in ('volumes', 'devices'):
+        return _volume_key(item)
+    if key in ('secrets', 'configs'):
+        return item.get('source') if isinstance(item, dict) else item
+    if key == 'ports':
+        return _port_key(item)
+    return item if not isinstance(item, dict) else repr(sorted(item.items()))
+
+
+def _merge_keyed_list(key: str, base: list, override: list) -> list:
+    merged = {}
+    for item in list(base or []) + list(override or []):
+        merged[_list_key(key, item)] = item
+    return list(merged.values())
+
+
+def _merge_unique_list(base, override) -> list:
+    res = []
+    for item in _as_list(base) + _as_list(override):
+        if item not in res:
+            res.append(item)
+    return res
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def merge_values(key: Optional[str], base, override):
+    if key in _REPLACED:
+        return override
+    if key in _KEY_VALUE_LISTS and (isinstance(base, (list, dict)) or isinstance(override, (list, dict))):
+        merged = _to_mapping(base, _KEY_VALUE_LISTS[key])
+        merged.update(_to_mapping(override, _KEY_VALUE_LISTS[key]))
+        return merged
+    if key in _KEYED_LISTS and isinstance(base, list) and isinstance(override, list):
+        return _merge_keyed_list(key, base, override)
+    if key in _UNIQUE_LISTS and not isinstance(base, dict) and not isinstance(override, dict):
+        return _merge_unique_list(base, override)
+    if key == 'networks' and (isinstance(base, list) or isinstance(override, list)):
+        base = {name: None for name in base} if isinstance(base, list) else base
+        override = {name: None for name in override} if isinstance(override, list) else override
+    if key == 'build' and (isinstance(base, str) or isinstance(override, str)):
+        base = {'context': base} if isinstance(base, str) else base
+        override = {'context': override} if isinstance(override, str) else override
+    if key == 'logging' and isinstance(base, dict) and isinstance(override, dict):
+        # Options only carry over when the driver stays the same
+        if override.get('driver') not in (None, base.get('driver')):
+            return override
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for k, v in override.items():
+            merged[k] = merge_values(k, merged[k], v) if k in merged else v
+        return merged
+    return override
+
+
+def merge_compose(documents: List[dict]) -> dict:
+    """Merges compose documents with the override semantics of docker-compose: later documents override earlier ones,
+    mappings are merged, lists of ports, volumes, secrets... are merged per key and command/entrypoint are replaced."""
+    merged: Dict[str, Any] = {}
+    for document in documents:
+        for key, value in (document or {}).items():
+            if key in ('services', 'networks', 'volumes', 'secrets', 'configs'):
+                section = merged.setdefault(key, {})
+                for name, definition in (value or {}).items():
+                    section[name] = merge_values(None, section[name], definition or {}) \
+                        if name in section and section[name] is not None else (definition or {})
+            else:
+                merged[key] = merge_values(key, merged[key], value) if key in merged else value
+    return merged
+
+
+def _interpolate(value, lookup: Callable[[str], Optional[str]], path: List[str], typed: Dict[str, str]):
+    if isinstance(value, dict):
+        return {k: _interpolate(v, lookup, path + [str(k)], typed) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_interpolate(v, lookup, path + ['*'], typed) for v in value]
+    if not isinstance(value, str) or '$' not in value:
+        return value
+    res = expand_vars(value, lookup)
+    kind = _match_type(path, typed)
+    if kind == 'int' and re.match(r'^-?\d+$', res):
+        return int(res)
+    if kind == 'bool' and res.lower() in ('true', 'false', 'yes', 'no', '1', '0'):
+        return res.lower() in ('true', 'yes', '1')
+    return res
+
+
+def _match_type(path: List[str], typed: Dict[str, str]) -> Optional[str]:
+    for pattern, kind in typed.items():
+        parts = pattern.split('.')
+        if len(parts) == len(path) and all(p == '*' or p == c for p, c in zip(parts, path)):
+            return kind
+    return None
+
+
+def interpolate(document: dict, environ: Dict[str, str]) -> dict:
+    typed = dict([(path, 'int') for path in _INT_PATHS] + [(path, 'bool') for path in _BOOL_PATHS])
+    return _interpolate(document, environ.get, [], typed)
+
+
+def _absolute(path: str, project_dir: str) -> str:
+    if path.startswith('~'):
+        return os.path.expanduser(path)
+    return os.path.normpath(os.path.join(project_dir, path))
+
+
+def _is_relative_path(path: str) -> bool:
+    return path.startswith('.') or path.startswith('~')
+
+
+def absolutize_paths(document: dict, project_dir: str) -> dict:
+    """Makes relative build contexts, bind mounts, env files and file based secrets/configs absolute, so that the
+    resolved file can live anywhere."""
+    for definition in (document.get('services') or {}).values():
+        build = definition.get('build')
+        if isinstance(build, str) and '://' not in build:
+            definition['build'] = _absolute(build, project_dir)
+        elif isinstance(build, dict) and '://' not in str(build.get('context', '.')):
+            build['context'] = _absolute(str(build.get('context', '.')), project_dir)
+        if definition.get('env_file') is not None:
+            definition['env_file'] = [_absolute(path, project_dir) for path in _as_list(definition['env_file'])]
+        volumes = []
+        for volume in definition.get('volumes') or []:
+            if isinstance(volume, dict):
+                if volume.get('type', 'volume') == 'bind' and _is_relative_path(str(volume.get('source', ''))):
+                    volume = dict(volume, source=_absolute(volume['source'], project_dir))
+            else:
+                source, sep, rest = str(volume).partition(':')
+                if sep and _is_relative_path(source):
+                    volume = '{}:{}'.format(_absolute(source, project_dir), rest)
+            volumes.append(volume)
+        if 'volumes' in definition:
+            definition['volumes'] = volumes
+    for section in ('secrets', 'configs'):
+        for definition in (document.get(section) or {}).values():
+            if isinstance(definition, dict) and definition.get('file'):
+                definition['file'] = _absolute(definition['file'], project_dir)
+    return document
+
+
+def _escape(value):
+    # Everything is interpolated already, docker must not interpolate again
+    if isinstance(value, dict):
+        return {k: _escape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_escape(v) for v in value]
+    if isinstance(value, str):
+        return value.replace('$', '$$')
+    return value
+
+
+def dump_yaml(document: dict) -> str:
+    import yaml
+    dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    return yaml.dump(document, Dumper=dumper, default_flow_style=False, sort_keys=False)
+
+
+class ResolvedCompose:
+    """The merged and interpolated compose document of a stack. It can hold values of env and secret files: it is only
+    written to disk, readable by the user alone, while a command needs it."""
+
+    def __init__(self, document: dict, content: str):
+        self.document = document
+        self.content = content
+
+    @property
+    def digest(self):
+        return hashlib.sha256(self.content.encode()).hexdigest()[:16]
+
+    @property
+    def display_content(self):
+        # As `docker-compose config` shows it, without the $$ escaping meant for docker
+        return dump_yaml(self.document)
+
+    @contextlib.contextmanager
+    def written(self, dry_run=False):
+        """Writes the content to a private temporary file, removed when the block exits.
+
+        A dry run prints the content instead and yields '-', as `docker stack deploy -c -` reads it from stdin.
+        """
+        if dry_run:
+            click.echo(self.content, nl=False)
+            yield '-'
+            return
+        fd, path = tempfile.mkstemp(prefix='swarm-cli-{}-'.format(self.digest), suffix='.yml')
+        try:
+            with os.fdopen(fd, 'w') as outfile:
+                outfile.write(self.content)
+            logger.debug('Wrote resolved compose file {}'.format(path))
+            yield path
+        finally:
+            os.unlink(path)
+
+
+def load_merged(paths: List[str], cache: ConfigCache = None) -> dict:
+    """Merged (not interpolated) content of the compose files, cached until one of them changes."""
+    cache = cache or ConfigCache()
+    key = 'compose:{}'.format('|'.join(os.path.abspath(path) for path in paths))
+    merged = cache.get('compose-merge', key)
+    if merged is None:
+        merged = merge_compose([load_required_yaml(path) for path in paths])
+        cache.put('compose-merge', key, paths, merged)
+    return merged
+
+
+def resolve_compose(paths: List[str], environ: Dict[str, str] = None, project_dir: str = None,
+                    cache: ConfigCache = None) -> ResolvedCompose:
+    """Merges and interpolates the compose files `paths`, in memory.
+
+    Relative paths are resolved against `project_dir`, the directory of the first file by default, like docker does.
+    """
+    environ = os.environ if environ is None else environ
+    project_dir = project_dir or os.path.dirname(os.path.abspath(paths[0]))
+    document = absolutize_paths(interpolate(load_merged(paths, cache), environ), project_dir)
+    return ResolvedCompose(document, dump_yaml(_escape(document)))
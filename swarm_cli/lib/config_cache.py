@@ -0,0 +1,87 @@
+import hashlib
+import os
+import pickle
+from typing import Any, List, Optional
+
+from swarm_cli.lib.logging import logger
+from swarm_cli.lib.utils import load_required_yaml
+
+# Bump whenever the layout of cached objects changes so that stale entries are ignored
+CACHE_VERSION = 5
+
+
+def get_cache_dir():
+    return os.environ.get('SWARM_CLI_CACHE_DIR', os.path.join('.swarm-cli', 'cache'))
+
+
+def is_cache_enabled():
+    return os.environ.get('SWARM_CLI_NO_CACHE', '') == ''
+
+
+def file_signature(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return os.path.abspath(path), None, None
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+class ConfigCache:
+    """On-disk cache for objects derived from configuration files.
+
+    Every entry records the (path, mtime, size) signature of the files it was built from and is discarded as soon as
+    one of them changes.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or get_cache_dir()
+        self.enabled = is_cache_enabled()
+
+    def _entry_path(self, namespace: str, key: str):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.root, namespace, '{}.pickle'.format(digest))
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        path = self._entry_path(namespace, key)
+        try:
+            with open(path, 'rb') as infile:
+                entry = pickle.load(infile)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        if entry.get('version') != CACHE_VERSION or entry.get('key') != key:
+            return None
+        for signature in entry['deps']:
+            if file_signature(signature[0]) != tuple(signature):
+                logger.debug('Cache entry {} is stale: {} changed'.format(key, signature[0]))
+                return None
+        logger.debug('Cache hit for {}'.format(key))
+        return entry['payload']
+
+    def put(self, namespace: str, key: str, deps: List[str], payload: Any):
+        if not self.enabled:
+            return
+        path = self._entry_path(namespace, key)
+        entry = {
+            'version': CACHE_VERSION,
+            'key': key,
+            'deps': [file_signature(dep) for dep in deps],
+            'payload': payload,
+        }
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'wb') as outfile:
+                pickle.dump(entry, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug('Unable to write cache entry {}: {}'.format(key, e))
+
+    def load_yaml(self, path: str):
+        key = 'yaml:{}'.format(os.path.abspath(path))
+        data = self.get('yaml', key)
+        if data is None:
+            data = load_required_yaml(path)
+            self.put('yaml', key, [path], data)
+        return data
@@ -0,0 +1,214 @@
+import re
+from typing import Callable, Dict, Optional, Tuple
+
+# Native parser for the env/secrets files that are otherwise sourced through `sh -c "set -a && . ./file && env"`.
+# It understands the subset of the shell syntax used by env files: comments, `export`, single and double quotes
+# (spanning multiple lines), backslash escapes and $VAR / ${VAR} / ${VAR:-default} style expansion. Anything else
+# (command substitution, control flow, ...) raises EnvParseError so that the caller can fall back to the shell.
+
+name_regex = re.compile('[A-Za-z_][A-Za-z0-9_]*')
+
+
+class EnvParseError(Exception):
+    pass
+
+
+Lookup = Callable[[str], Optional[str]]
+
+
+class _Parser:
+    def __init__(self, text: str, lookup: Lookup, source: str = '<string>', strict: bool = True):
+        self.text = text
+        self.pos = 0
+        self.lookup = lookup
+        self.source = source
+        self.strict = strict
+
+    def error(self, message: str):
+        line = self.text.count('\n', 0, self.pos) + 1
+        return EnvParseError('{}:{}: {}'.format(self.source, line, message))
+
+    def peek(self, offset=0) -> str:
+        idx = self.pos + offset
+        return self.text[idx] if idx < len(self.text) else ''
+
+    def skip_blanks(self):
+        while self.peek() in (' ', '\t'):
+            self.pos += 1
+
+    def skip_comment(self):
+        while self.peek() not in ('\n', ''):
+            self.pos += 1
+
+    def read_name(self) -> str:
+        match = name_regex.match(self.text, self.pos)
+        if not match:
+            return ''
+        self.pos = match.end()
+        return match.group(0)
+
+    def parse_statements(self, assign: Callable[[str, str], None]):
+        while True:
+            while self.peek() in (' ', '\t', '\n', '\r', ';'):
+                self.pos += 1
+            c = self.peek()
+            if c == '':
+                return
+            if c == '#':
+                self.skip_comment()
+                continue
+            name = self.read_name()
+            if name == 'export' and self.peek() in (' ', '\t'):
+                self.skip_blanks()
+                name = self.read_name()
+            if not name or self.peek() != '=':
+                raise self.error('unsupported statement')
+            self.pos += 1
+            assign(name, self.parse_word())
+            self.skip_blanks()
+            c = self.peek()
+            if c == '#':
+                self.skip_comment()
+            elif c not in ('\n', '\r', ';', ''):
+                raise self.error('unexpected content after value of {}'.format(name))
+
+    def parse_word(self, terminators: Tuple[str, ...] = (' ', '\t', '\n', '\r', ';', '')) -> str:
+        res = []
+        while True:
+            c = self.peek()
+            if c in terminators:
+                return ''.join(res)
+            if c == "'":
+                end = self.text.find("'", self.pos + 1)
+                if end == -1:
+                    raise self.error('unterminated single quote')
+                res.append(self.text[self.pos + 1:end])
+                self.pos = end + 1
+            elif c == '"':
+                self.pos += 1
+                res.append(self.parse_double_quoted())
+            elif c == '\\':
+                nxt = self.peek(1)
+                self.pos += 2
+                if nxt != '\n':
+                    res.append(nxt)
+            elif c == '$':
+                res.append(self.parse_expansion())
+            elif c == '`':
+                raise self.error('command substitution is not supported')
+            elif c in ('|', '&', '<', '>', '(', ')'):
+                raise self.error('unsupported character {}'.format(c))
+            else:
+                res.append(c)
+                self.pos += 1
+
+    def parse_double_quoted(self) -> str:
+        res = []
+        while True:
+            c = self.peek()
+            if c == '':
+                raise self.error('unterminated double quote')
+            if c == '"':
+                self.pos += 1
+                return ''.join(res)
+            if c == '\\':
+                nxt = self.peek(1)
+                self.pos += 2
+                if nxt in ('$', '`', '"', '\\'):
+                    res.append(nxt)
+                elif nxt != '\n':
+                    res.append('\\' + nxt)
+            elif c == '$':
+                res.append(self.parse_expansion())
+            elif c == '`':
+                raise self.error('command substitution is not supported')
+            else:
+                res.append(c)
+                self.pos += 1
+
+    def parse_expansion(self) -> str:
+        # self.peek() is '$'
+        nxt = self.peek(1)
+        if nxt == '{':
+            self.pos += 2
+            name = self.read_name()
+            if not name:
+                raise self.error('bad substitution')
+            return self.parse_braced(name)
+        if nxt == '(':
+            raise self.error('command substitution is not supported')
+        self.pos += 1
+        name = self.read_name()
+        if not name:
+            if self.strict and nxt and (nxt.isdigit() or nxt in '?!#@*-$'):
+                raise self.error('special parameter ${} is not supported'.format(nxt))
+            return '$'
+        return self.lookup(name) or ''
+
+    def parse_braced(self, name: str) -> str:
+        value = self.lookup(name)
+        c = self.peek()
+        if c == '}':
+            self.pos += 1
+            return value or ''
+        colon = c == ':'
+        if colon:
+            self.pos += 1
+            c = self.peek()
+        if c not in ('-', '=', '+', '?'):
+            raise self.error('unsupported expansion for {}'.format(name))
+        self.pos += 1
+        word = self.parse_word(terminators=('}', ''))
+        if self.peek() != '}':
+            raise self.error('unterminated expansion for {}'.format(name))
+        self.pos += 1
+        is_set = value is not None and (value != '' or not colon)
+        if c == '+':
+            return word if is_set else ''
+        if c == '?':
+            if not is_set:
+                raise self.error('{}: {}'.format(name, word or 'parameter not set'))
+            return value
+        return value if is_set else word
+
+    def parse_literal(self) -> str:
+        # Compose style interpolation: only $ is special and $$ is an escaped dollar sign
+        res = []
+        while self.pos < len(self.text):
+            c = self.peek()
+            if c == '$':
+                if self.peek(1) == '$':
+                    res.append('$')
+                    self.pos += 2
+                else:
+                    res.append(self.parse_expansion())
+            else:
+                res.append(c)
+                self.pos += 1
+        return ''.join(res)
+
+
+def expand_vars(value: str, lookup: Lookup) -> str:
+    return _Parser(value, lookup, strict=False).parse_literal()
+
+
+def parse_env_string(text: str, environ: Dict[str, str] = None, source: str = '<string>') -> Dict[str, str]:
+    environ = environ or {}
+    assigned: Dict[str, str] = {}
+
+    # Like `set -a && . file`: values assigned earlier in the file shadow the environment for later expansions
+    def lookup(name: str):
+        if name in assigned:
+            return assigned[name]
+        return environ.get(name)
+
+    def assign(name: str, value: str):
+        assigned[name] = value
+
+    _Parser(text, lookup, source).parse_statements(assign)
+    return assigned
+
+
+def parse_env_file(path: str, environ: Dict[str, str] = None) -> Dict[str, str]:
+    with open(path, 'r') as infile:
+        return parse_env_string(infile.read(), environ, source=path)
@@ -1,11 +1,9 @@
 # Create a logger object.
 import logging
 
-import coloredlogs
 import verboselogs
 
 logger = verboselogs.VerboseLogger('swarm-cli')
-logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
 
 # By default the install() function installs a handler on the root logger,
@@ -18,4 +16,19 @@ logger.setLevel(logging.INFO)
 # messages originating from that logger will show up on the terminal.
 # fmt="%(levelname)s %(message)s"
 fmt = "%(message)s"
-coloredlogs.install(fmt=fmt, level=verboselogs.SPAM, logger=logger)
+
+
+class _ColoredLogsInstaller(logging.Handler):
+    # Importing coloredlogs costs tens of milliseconds, only pay for it once something is actually logged
+    def emit(self, record: logging.LogRecord):
+        import coloredlogs
+        level = logger.level
+        logger.removeHandler(self)
+        coloredlogs.install(fmt=fmt, level=verboselogs.SPAM, logger=logger)
+        logger.setLevel(level)
+        for handler in logger.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+logger.addHandler(_ColoredLogsInstaller())
@@ -0,0 +1,207 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+from swarm_cli.lib.logging import logger
+
+DOCKER_HUB = 'docker.io'
+DOCKER_HUB_API = 'registry-1.docker.io'
+# Same manifest types as `docker push`, the registry answers with the digest of the one the tag points at
+MANIFEST_TYPES = [
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.oci.image.index.v1+json',
+]
+
+_challenge_regex = re.compile(r'(\w+)="([^"]*)"')
+
+
+def get_insecure_registries() -> List[str]:
+    # Registries reached over plain http, localhost always is (like the docker daemon does)
+    return [registry for registry in os.environ.get('SWARM_CLI_INSECURE_REGISTRIES', '').split(',') if registry]
+
+
+def parse_image(image: str) -> Tuple[str, str, str]:
+    """Returns (registry, repository, tag) of an image reference, the repository as the registry API names it."""
+    from docker.auth import resolve_repository_name
+    from docker.utils import parse_repository_tag
+    repository, tag = parse_repository_tag(image)
+    registry, remote_name = resolve_repository_name(repository)
+    if registry == DOCKER_HUB and '/' not in remote_name:
+        remote_name = 'library/{}'.format(remote_name)
+    return registry, remote_name, tag or 'latest'
+
+
+def format_size(size: float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1000:
+            return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(int(size))
+        size /= 1000
+    return '{:.1f} TB'.format(size)
+
+
+class RegistryClient:
+    """Looks up manifest digests with HEAD requests over one pooled session, safe to share between threads.
+
+    Credentials are the ones `docker login` stored, bearer tokens are fetched once per repository.
+    """
+
+    def __init__(self, pool_size=8, timeout=10):
+        import requests
+        from docker.auth import load_config
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = timeout
+        self._auth_config = load_config()
+        self._tokens: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def _base_url(self, registry: str) -> str:
+        if registry == DOCKER_HUB:
+            return 'https://{}'.format(DOCKER_HUB_API)
+        host = registry.split(':')[0]
+        insecure = host in ('localhost', '::1') or host.startswith('127.') or registry in get_insecure_registries()
+        return '{}://{}'.format('http' if insecure else 'https', registry)
+
+    def _credentials(self, registry: str) -> Optional[Tuple[str, str]]:
+        from docker.auth import resolve_authconfig
+        auth = resolve_authconfig(self._auth_config, registry) or {}
+        if auth.get('username') and auth.get('password'):
+            return auth['username'], auth['password']
+        return None
+
+    def _get_token(self, registry: str, repository: str, challenge: str) -> Optional[str]:
+        params = dict(_challenge_regex.findall(challenge))
+        realm = params.pop('realm', None)
+        if not realm:
+            return None
+        params['scope'] = 'repository:{}:pull'.format(repository)
+        res = self.session.get(realm, params=params, auth=self._credentials(registry), timeout=self.timeout)
+        res.raise_for_status()
+        data = res.json()
+        return data.get('token') or data.get('access_token')
+
+    def get_digest(self, image: str) -> Optional[str]:
+        """Returns the digest the tag of `image` points at in its registry, None when the tag doesn't exist."""
+        registry, repository, tag = parse_image(image)
+        url = '{}/v2/{}/manifests/{}'.format(self._base_url(registry), repository, tag)
+        headers = {'Accept': ', '.join(MANIFEST_TYPES)}
+        token = self._tokens.get((registry, repository))
+        if token:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+        res = self.session.head(url, headers=headers, timeout=self.timeout)
+        if res.status_code == 401:
+            challenge = res.headers.get('WWW-Authenticate', '')
+            if challenge.lower().startswith('bearer'):
+                token = self._get_token(registry, repository, challenge)
+                with self._lock:
+                    self._tokens[(registry, repository)] = token
+                headers['Authorization'] = 'Bearer {}'.format(token)
+                res = self.session.head(url, headers=headers, timeout=self.timeout)
+            elif challenge.lower().startswith('basic'):
+                res = self.session.head(url, headers=headers, auth=self._credentials(registry), timeout=self.timeout)
+        if res.status_code == 404:
+            return None
+        res.raise_for_status()
+        return res.headers.get('Docker-Content-Digest')
+
+
+class ImageCheck:
+    def __init__(self, service: str, image: str, present: bool, size: int = 0, message: str = None):
+        self.service = service
+        self.image = image
+        self.present = present
+        self.size = size
+        self.message = message
+
+
+def get_local_digests(client, image: str) -> Tuple[List[str], int]:
+    """Returns the digests the local image was pushed or pulled with, for the repository of `image`, and its size."""
+    from docker.utils import parse_repository_tag
+    attrs = client.api.inspect_image(image)
+    repository = parse_repository_tag(image)[0]
+    digests = [digest.split('@', 1)[1] for digest in attrs.get('RepoDigests') or []
+               if digest.split('@', 1)[0] == repository]
+    return digests, attrs.get('Size') or 0
+
+
+def check_images(client, images: Dict[str, str], jobs=8) -> List[ImageCheck]:
+    """Compares the local images {service: image} with the registry, in parallel.
+
+    An image is present when the registry tag points at a digest the local image already has: it was pushed (or
+    pulled) since it was built. Images that can't be checked are pushed.
+    """
+    registry = RegistryClient(pool_size=max(1, jobs))
+
+    def check(item):
+        service, image = item
+        try:
+            digests, size = get_local_digests(client, image)
+            if not digests:
+                return ImageCheck(service, image, False, size, 'never pushed')
+            remote = registry.get_digest(image)
+            if remote is None:
+                return ImageCheck(service, image, False, size, 'not in the registry')
+            if remote not in digests:
+                return ImageCheck(service, image, False, size, 'registry has {}'.format(remote[:19]))
+            return ImageCheck(service, image, True, size)
+        except Exception as e:
+            logger.debug('Unable to check {}: {}'.format(image, e))
+            return ImageCheck(service, image, False, message='check failed: {}'.format(e))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(images)))) as executor:
+            return list(executor.map(check, sorted(images.items())))
+    finally:
+        registry.session.close()
+
+
+def get_pushable_images(document: dict) -> Dict[str, str]:
+    # Same selection as `docker-compose push`: the services that are built and have an image name
+    return {name: definition['image'] for name, definition in (document.get('services') or {}).items()
+            if definition and definition.get('build') and definition.get('image')}
+
+
+class PushPlan:
+    """The services of a compose document whose image the registry doesn't have yet."""
+
+    def __init__(self, client, document: dict, jobs=8):
+        start = time.monotonic()
+        self.checks = check_images(client, get_pushable_images(document), jobs) if document else []
+        self.check_duration = time.monotonic() - start
+
+    @property
+    def services(self) -> List[str]:
+        return [check.service for check in self.checks if not check.present]
+
+    @property
+    def skipped(self) -> List[ImageCheck]:
+        return [check for check in self.checks if check.present]
+
+    def print(self):
+        for check in self.checks:
+            if check.present:
+                click.secho('  {}: {} is up to date'.format(check.service, check.image), fg='green')
+            else:
+                click.echo('  {}: {} will be pushed ({})'.format(check.service, check.image, check.message))
+
+    def report(self, title: str, push_duration: float = None):
+        """Logs how much the skipped pushes saved. The time is estimated with the throughput of the images pushed in
+        the same run."""
+        skipped = self.skipped
+        saved = sum(check.size for check in skipped)
+        pushed = sum(check.size for check in self.checks if not check.present)
+        msg = '{}: skipped {} of {} images already in the registry, {} not pushed, checked in {:.1f}s'.format(
+            title, len(skipped), len(self.checks), format_size(saved), self.check_duration)
+        if skipped and push_duration and pushed:
+            msg += ', about {:.1f}s saved'.format(saved * push_duration / pushed)
+        logger.notice(msg)
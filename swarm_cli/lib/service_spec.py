@@ -0,0 +1,468 @@
+import copy
+import os
+import re
+import shlex
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+
+# Renders the Docker API ServiceSpec of each service of a resolved compose document (see compose_merge), the same way
+# `docker stack deploy` converts it, and compares it with the spec of the live services.
+#
+# Only the fields managed by the compose file are rendered. Fields that docker leaves out when the compose file does
+# not set them (user, command, env...) are always rendered, `None` meaning "absent", so that removing them is a change.
+# Fields that docker fills with defaults (update_config, restart_policy...) are only rendered when set. Networks are
+# not compared: the live spec references them by id. Neither is the content of top-level configs and secrets, nor the
+# networks and volumes declarations.
+
+STACK_NAMESPACE_LABEL = 'com.docker.stack.namespace'
+STACK_IMAGE_LABEL = 'com.docker.stack.image'
+
+# Dicts compared as a whole rather than key by key
+_LEAF_DICTS = [('Labels',), ('TaskTemplate', 'ContainerSpec', 'Labels'), ('Mode',)]
+
+_duration_regex = re.compile(r'(\d+(?:\.\d+)?)(ns|us|µs|ms|s|m|h)')
+_duration_units = {'ns': 1, 'us': 1e3, 'µs': 1e3, 'ms': 1e6, 's': 1e9, 'm': 60e9, 'h': 3600e9}
+_size_regex = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmgtp]?)b?$', re.IGNORECASE)
+
+
+def parse_duration(value) -> Optional[int]:
+    """Go style duration (1m30s, 500ms...) to nanoseconds."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value * 1e9)
+    parts = _duration_regex.findall(str(value))
+    if not parts or ''.join(number + unit for number, unit in parts) != str(value):
+        raise ValueError('Invalid duration {}'.format(value))
+    return int(sum(float(number) * _duration_units[unit] for number, unit in parts))
+
+
+def parse_size(value) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    match = _size_regex.match(str(value).strip())
+    if not match:
+        raise ValueError('Invalid size {}'.format(value))
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' kmgtp'.index(unit.lower() or ' '))
+
+
+def _without_none(value: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in value.items() if v is not None}
+
+
+def _scoped_name(stack_name: str, name: str, declarations: dict) -> str:
+    # Volumes, secrets and configs of the stack are prefixed with its name, unless external or explicitly named
+    declaration = (declarations or {}).get(name) or {}
+    if declaration.get('name'):
+        return declaration['name']
+    if declaration.get('external'):
+        external = declaration['external']
+        return external.get('name', name) if isinstance(external, dict) else name
+    return '{}_{}'.format(stack_name, name)
+
+
+def _read_env_file(path: str, environ: Dict[str, str]) -> Dict[str, str]:
+    # Same format as `docker stack deploy`: KEY=VALUE lines taken literally (no quotes, no interpolation), a KEY alone
+    # is taken from the environment of the deploy
+    if not os.path.isfile(path):
+        raise click.ClickException('env_file {} does not exist'.format(path))
+    res = {}
+    with open(path, 'r') as infile:
+        for line in infile:
+            line = line.lstrip().rstrip('\r\n')
+            if not line or line.startswith('#'):
+                continue
+            key, sep, value = line.partition('=')
+            if sep:
+                res[key] = value
+            elif key.strip() in environ:
+                res[key.strip()] = environ[key.strip()]
+    return res
+
+
+def _render_env(environment, environ: Dict[str, str], env_files=None) -> List[str]:
+    if isinstance(environment, list):
+        environment = dict(item.split('=', 1) if '=' in item else (item, None) for item in environment)
+    merged = {}
+    for path in [env_files] if isinstance(env_files, str) else env_files or []:
+        merged.update(_read_env_file(path, environ))
+    # `environment` overrides the env files, except a KEY without value which docker only looks up when no env file
+    # sets it
+    merged.update({k: v for k, v in (environment or {}).items() if v is not None or k not in merged})
+    res = []
+    for key, value in merged.items():
+        if value is None:
+            # Taken from the environment of the deploy, dropped when unset
+            if key not in environ:
+                continue
+            value = environ[key]
+        res.append('{}={}'.format(key, 'true' if value is True else 'false' if value is False else value))
+    return sorted(res)
+
+
+def _render_labels(labels) -> Dict[str, str]:
+    if isinstance(labels, list):
+        labels = dict(item.split('=', 1) if '=' in item else (item, '') for item in labels)
+    return {k: str(v) if v is not None else '' for k, v in (labels or {}).items()}
+
+
+def _render_mounts(stack_name: str, volumes: list, document: dict) -> List[dict]:
+    mounts = []
+    for volume in volumes or []:
+        if isinstance(volume, dict):
+            source, target = volume.get('source'), volume.get('target')
+            mount_type = volume.get('type', 'volume')
+            read_only = bool(volume.get('read_only', False))
+        else:
+            parts = str(volume).split(':')
+            if len(parts) == 1:
+                source, target, mode = None, parts[0], ''
+            else:
+                source, target, mode = parts[0], parts[1], parts[2] if len(parts) > 2 else ''
+            mount_type = 'bind' if source and (source.startswith('/') or source.startswith('.')) else 'volume'
+            read_only = 'ro' in mode.split(',')
+        if mount_type == 'volume' and source:
+            source = _scoped_name(stack_name, source, document.get('volumes'))
+        mounts.append({'Type': mount_type, 'Source': source or '', 'Target': target, 'ReadOnly': read_only})
+    return sorted(mounts, key=lambda mount: mount['Target'] or '')
+
+
+def _render_ports(ports: list) -> List[dict]:
+    res = []
+    for port in ports or []:
+        if isinstance(port, dict):
+            res.append({'Protocol': port.get('protocol', 'tcp'), 'TargetPort': int(port['target']),
+                        'PublishedPort': int(port['published']) if port.get('published') is not None else None,
+                        'PublishMode': port.get('mode', 'ingress')})
+            continue
+        spec, _, protocol = str(port).partition('/')
+        parts = spec.split(':')
+        target = parts[-1]
+        published = parts[-2] if len(parts) > 1 else None
+        # Ranges such as 8000-8002:80-82 expand to one port each
+        targets = _port_range(target)
+        publisheds = _port_range(published) if published else [None] * len(targets)
+        for target_port, published_port in zip(targets, publisheds):
+            res.append({'Protocol': protocol or 'tcp', 'TargetPort': target_port, 'PublishedPort': published_port,
+                        'PublishMode': 'ingress'})
+    return sorted([_without_none(port) for port in res],
+                  key=lambda port: (port['TargetPort'], port.get('PublishedPort') or 0, port['Protocol']))
+
+
+def _port_range(value: str) -> List[int]:
+    start, _, end = value.partition('-')
+    return list(range(int(start), int(end or start) + 1))
+
+
+def _render_references(stack_name: str, references: list, declarations: dict, kind: str) -> List[dict]:
+    res = []
+    for reference in references or []:
+        if isinstance(reference, dict):
+            source, target = reference['source'], reference.get('target')
+        else:
+            source, target = reference, None
+        res.append({kind: _scoped_name(stack_name, source, declarations), 'Target': target or source})
+    return sorted(res, key=lambda item: item['Target'])
+
+
+def _render_resources(resources: dict) -> Optional[dict]:
+    if not resources:
+        return None
+    res = {}
+    for compose_key, api_key in (('limits', 'Limits'), ('reservations', 'Reservations')):
+        section = resources.get(compose_key) or {}
+        values = _without_none({
+            'NanoCPUs': int(float(section['cpus']) * 1e9) if section.get('cpus') is not None else None,
+            'MemoryBytes': parse_size(section.get('memory')),
+        })
+        if values:
+            res[api_key] = values
+    return res
+
+
+def _render_update_config(config: dict) -> Optional[dict]:
+    if not config:
+        return None
+    return _without_none({
+        'Parallelism': config.get('parallelism'),
+        'Delay': parse_duration(config.get('delay')),
+        'FailureAction': config.get('failure_action'),
+        'Monitor': parse_duration(config.get('monitor')),
+        'MaxFailureRatio': config.get('max_failure_ratio'),
+        'Order': config.get('order'),
+    })
+
+
+def _render_restart_policy(policy: dict) -> Optional[dict]:
+    if not policy:
+        return None
+    condition = policy.get('condition')
+    return _without_none({
+        'Condition': 'any' if condition == 'always' else condition,
+        'Delay': parse_duration(policy.get('delay')),
+        'MaxAttempts': policy.get('max_attempts'),
+        'Window': parse_duration(policy.get('window')),
+    })
+
+
+def _render_healthcheck(healthcheck: dict) -> Optional[dict]:
+    if not healthcheck:
+        return None
+    if healthcheck.get('disable'):
+        return {'Test': ['NONE']}
+    test = healthcheck.get('test')
+    if isinstance(test, str):
+        test = ['CMD-SHELL', test]
+    return _without_none({
+        'Test': test,
+        'Interval': parse_duration(healthcheck.get('interval')),
+        'Timeout': parse_duration(healthcheck.get('timeout')),
+        'Retries': healthcheck.get('retries'),
+        'StartPeriod': parse_duration(healthcheck.get('start_period')),
+    })
+
+
+def _split_command(command) -> Optional[List[str]]:
+    if command is None:
+        return None
+    return shlex.split(command) if isinstance(command, str) else [str(part) for part in command]
+
+
+def render_service_spec(stack_name: str, service_name: str, definition: dict, document: dict,
+                        environ: Dict[str, str] = None) -> dict:
+    environ = os.environ if environ is None else environ
+    deploy = definition.get('deploy') or {}
+    image = definition.get('image')
+    labels = _render_labels(deploy.get('labels'))
+    labels[STACK_NAMESPACE_LABEL] = stack_name
+    container_labels = _render_labels(definition.get('labels'))
+    container_labels[STACK_NAMESPACE_LABEL] = stack_name
+    if deploy.get('mode') == 'global':
+        mode = {'Global': {}}
+    else:
+        mode = {'Replicated': {'Replicas': deploy.get('replicas', 1)}}
+    extra_hosts = definition.get('extra_hosts')
+    if isinstance(extra_hosts, dict):
+        extra_hosts = ['{}:{}'.format(host, ip) for host, ip in extra_hosts.items()]
+
+    container_spec = {
+        'Image': image,
+        'Labels': container_labels,
+        'Command': _split_command(definition.get('entrypoint')),
+        'Args': _split_command(definition.get('command')),
+        'Env': _render_env(definition.get('environment'), environ, definition.get('env_file')),
+        'Hostname': definition.get('hostname'),
+        'User': definition.get('user'),
+        'Dir': definition.get('working_dir'),
+        'TTY': bool(definition.get('tty', False)),
+        'OpenStdin': bool(definition.get('stdin_open', False)),
+        'ReadOnly': bool(definition.get('read_only', False)),
+        'Init': definition.get('init'),
+        'StopGracePeriod': parse_duration(definition.get('stop_grace_period')),
+        'StopSignal': definition.get('stop_signal'),
+        'Hosts': sorted('{} {}'.format(*reversed(host.split(':', 1))) for host in extra_hosts or []),
+        'Mounts': _render_mounts(stack_name, definition.get('volumes'), document),
+        'Secrets': _render_references(stack_name, definition.get('secrets'), document.get('secrets'), 'SecretName'),
+        'Configs': _render_references(stack_name, definition.get('configs'), document.get('configs'), 'ConfigName'),
+    }
+    healthcheck = _render_healthcheck(definition.get('healthcheck'))
+    if healthcheck is not None:
+        container_spec['Healthcheck'] = healthcheck
+
+    task_template = {'ContainerSpec': container_spec}
+    optional = {
+        'Resources': _render_resources(deploy.get('resources')),
+        'RestartPolicy': _render_restart_policy(deploy.get('restart_policy')),
+    }
+    task_template.update(_without_none(optional))
+    placement = deploy.get('placement') or {}
+    task_template['Placement'] = {'Constraints': sorted(placement['constraints']) if placement.get('constraints') else None}
+    if placement.get('max_replicas_per_node') is not None:
+        task_template['Placement']['MaxReplicas'] = placement['max_replicas_per_node']
+
+    spec = {
+        'Name': '{}_{}'.format(stack_name, service_name),
+        'Labels': labels,
+        'TaskTemplate': task_template,
+        'Mode': mode,
+        'EndpointSpec': {'Ports': _render_ports(definition.get('ports'))},
+    }
+    if (deploy.get('endpoint_mode') or 'vip') != 'vip':
+        spec['EndpointSpec']['Mode'] = deploy['endpoint_mode']
+    for key, value in (('UpdateConfig', _render_update_config(deploy.get('update_config'))),
+                       ('RollbackConfig', _render_update_config(deploy.get('rollback_config')))):
+        if value:
+            spec[key] = value
+    return spec
+
+
+def render_stack_specs(stack_name: str, document: dict, environ: Dict[str, str] = None) -> Dict[str, dict]:
+    """Returns {full service name: rendered spec} for every service of a resolved compose document."""
+    return {'{}_{}'.format(stack_name, name): render_service_spec(stack_name, name, definition or {}, document, environ)
+            for name, definition in (document.get('services') or {}).items()}
+
+
+def _flatten(value, path: Tuple[str, ...] = ()) -> Dict[Tuple[str, ...], Any]:
+    if isinstance(value, dict) and path not in _LEAF_DICTS:
+        res = {}
+        for k, v in value.items():
+            res.update(_flatten(v, path + (k,)))
+        return res
+    return {path: value}
+
+
+def _get_path(spec: dict, path: Tuple[str, ...]):
+    for key in path:
+        if not isinstance(spec, dict):
+            return None
+        spec = spec.get(key)
+    return spec
+
+
+def normalize_image(image: str, keep_digest=False) -> str:
+    """Familiar name of an image with its tag, as docker stores it in a service: `nginx`, `docker.io/library/nginx`
+    and `nginx:latest` are all `nginx:latest`. The digest is dropped unless `keep_digest`."""
+    name, _, digest = image.partition('@')
+    for prefix in ('docker.io/', 'index.docker.io/', 'registry-1.docker.io/'):
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            if name.startswith('library/') and name.count('/') == 1:
+                name = name[len('library/'):]
+            break
+    if ':' not in name.rsplit('/', 1)[-1]:
+        name += ':latest'
+    return '{}@{}'.format(name, digest) if keep_digest and digest else name
+
+
+def _normalize(path: Tuple[str, ...], value):
+    """Puts a value of the live spec in the shape of the rendered one."""
+    if path == ('TaskTemplate', 'ContainerSpec', 'Image') and isinstance(value, str):
+        # With --with-registry-auth docker pins the image digest
+        return normalize_image(value)
+    if path[-1] in ('Env', 'Hosts', 'Constraints') and isinstance(value, list):
+        return sorted(value)
+    if path[-1] == 'Labels' and isinstance(value, dict):
+        return {k: v for k, v in value.items() if k != STACK_IMAGE_LABEL}
+    if path[-1] == 'Mounts' and isinstance(value, list):
+        return sorted([{'Type': mount.get('Type'), 'Source': mount.get('Source', ''), 'Target': mount.get('Target'),
+                        'ReadOnly': bool(mount.get('ReadOnly', False))} for mount in value],
+                      key=lambda mount: mount['Target'] or '')
+    if path[-1] == 'Ports' and isinstance(value, list):
+        return sorted([_without_none({'Protocol': port.get('Protocol', 'tcp'), 'TargetPort': port.get('TargetPort'),
+                                      'PublishedPort': port.get('PublishedPort'),
+                                      'PublishMode': port.get('PublishMode', 'ingress')}) for port in value],
+                      key=lambda port: (port['TargetPort'], port.get('PublishedPort') or 0, port['Protocol']))
+    if path[-1] in ('Secrets', 'Configs') and isinstance(value, list):
+        kind = 'SecretName' if path[-1] == 'Secrets' else 'ConfigName'
+        return sorted([{kind: item.get(kind), 'Target': (item.get('File') or {}).get('Name')} for item in value],
+                      key=lambda item: item['Target'] or '')
+    return value
+
+
+def _is_empty(value) -> bool:
+    return value is None or value is False or value == [] or value == {} or value == ''
+
+
+def diff_spec(rendered: dict, live: dict) -> List[str]:
+    """Returns the dotted paths of the rendered fields that differ in the live spec."""
+    if not live:
+        return []
+    res = []
+    for path, value in _flatten(rendered).items():
+        current = _normalize(path, _get_path(live, path))
+        if path == ('TaskTemplate', 'ContainerSpec', 'Image') and isinstance(value, str):
+            # A digest pinned in the compose file is compared, the one docker resolved for a tag is not
+            value = normalize_image(value, keep_digest=True)
+            if '@' in value:
+                current = normalize_image(_get_path(live, path) or '', keep_digest=True)
+        if _is_empty(value) and _is_empty(current):
+            continue
+        if value != current:
+            res.append('.'.join(path))
+    return res
+
+
+def diff_stack(rendered: Dict[str, dict], live: Dict[str, dict]) -> Dict[str, List[str]]:
+    """Returns {service: changed fields} for the services that differ, new services have the single field 'created'."""
+    res = {}
+    for name, spec in sorted(rendered.items()):
+        if name not in live:
+            res[name] = ['created']
+            continue
+        changes = diff_spec(spec, live[name])
+        if changes:
+            res[name] = changes
+    return res
+
+
+def _apply_mounts(live: list, rendered: list, stack_name: str) -> list:
+    # Mounts are matched by target: the options docker added (volume driver and labels, bind propagation...) are kept
+    # as long as the type doesn't change
+    live_mounts = {mount.get('Target'): mount for mount in live or []}
+    res = []
+    for mount in rendered:
+        current = live_mounts.get(mount['Target'])
+        if current is not None and current.get('Type') == mount['Type']:
+            current = dict(current, Source=mount['Source'])
+        else:
+            current = {'Type': mount['Type'], 'Source': mount['Source'], 'Target': mount['Target']}
+            if mount['Type'] == 'volume' and mount['Source']:
+                current['VolumeOptions'] = {'Labels': {STACK_NAMESPACE_LABEL: stack_name}}
+        if mount['ReadOnly']:
+            current['ReadOnly'] = True
+        else:
+            current.pop('ReadOnly', None)
+        res.append(current)
+    return res
+
+
+def apply_spec(live: dict, rendered: dict, fields: List[str] = None) -> dict:
+    """Returns a copy of the live spec with the rendered fields set, fields that are not managed are kept.
+
+    With `fields` (dotted paths, as returned by diff_spec) only those fields are set.
+    """
+    spec = copy.deepcopy(live)
+    stack_name = rendered.get('Labels', {}).get(STACK_NAMESPACE_LABEL)
+    for path, value in _flatten(rendered).items():
+        if fields is not None and '.'.join(path) not in fields:
+            continue
+        parent = spec
+        for key in path[:-1]:
+            parent = parent.setdefault(key, {})
+        if value is None:
+            parent.pop(path[-1], None)
+        elif path[-1] in ('Secrets', 'Configs'):
+            # Keep the ids docker resolved, only a rendered reference that is already attached can be applied
+            continue
+        elif path == ('TaskTemplate', 'ContainerSpec', 'Mounts'):
+            parent[path[-1]] = _apply_mounts(parent.get(path[-1]), value, stack_name)
+        elif path == ('Labels',):
+            # The label of the stack image is not rendered, it follows the image
+            parent[path[-1]] = dict(value, **{k: v for k, v in (parent.get(path[-1]) or {}).items()
+                                              if k == STACK_IMAGE_LABEL})
+        else:
+            parent[path[-1]] = value
+    image = rendered.get('TaskTemplate', {}).get('ContainerSpec', {}).get('Image')
+    if image and (fields is None or 'TaskTemplate.ContainerSpec.Image' in fields):
+        spec.setdefault('Labels', {})[STACK_IMAGE_LABEL] = image
+    return spec
+
+
+def get_undeclared(rendered: Dict[str, dict], live: Dict[str, dict]) -> List[str]:
+    # Live services of the stack that no compose file declares anymore, `docker stack deploy` leaves them running
+    return sorted(name for name in live.keys() if name not in rendered)
+
+
+def print_stack_changes(stack_name: str, changes: Dict[str, List[str]], undeclared: List[str] = None):
+    for name in undeclared or []:
+        click.secho('{}: {} is deployed but no longer declared'.format(stack_name, name), fg='yellow')
+    if not changes:
+        click.secho('{}: no changes'.format(stack_name), fg='green')
+        return
+    click.secho('{}: {} services changed'.format(stack_name, len(changes)), bold=True)
+    for service, fields in changes.items():
+        click.echo('  {}: {}'.format(service, ', '.join(fields)))
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from swarm_cli.lib.config_cache import get_cache_dir
+from swarm_cli.lib.logging import logger
+
+TRANSPORT_PARAMIKO = 'paramiko'
+TRANSPORT_SSH = 'ssh'
+TRANSPORT_MULTIPLEX = 'multiplex'
+TRANSPORTS = [TRANSPORT_PARAMIKO, TRANSPORT_SSH, TRANSPORT_MULTIPLEX]
+
+REMOTE_DOCKER_SOCKET = '/var/run/docker.sock'
+
+_dns_lock = threading.Lock()
+_dns_cache: Dict[str, Tuple[str, float]] = {}
+_dns_cache_loaded = False
+
+
+def get_ssh_transport():
+    transport = os.environ.get('SWARM_CLI_SSH_TRANSPORT', TRANSPORT_PARAMIKO)
+    if transport not in TRANSPORTS:
+        logger.warning('Unknown ssh transport {}, using {}'.format(transport, TRANSPORT_PARAMIKO))
+        return TRANSPORT_PARAMIKO
+    return transport
+
+
+def parse_ssh_url(base_url: str):
+    url = urlparse(base_url)
+    return url.username, url.hostname, url.port
+
+
+def _dns_cache_path():
+    return os.path.join(get_cache_dir(), 'dns.json')
+
+
+def _dns_ttl():
+    return float(os.environ.get('SWARM_CLI_DNS_TTL', 300))
+
+
+def resolve_host(host: str) -> str:
+    # Resolutions are shared between invocations through a small JSON file in the cache directory
+    global _dns_cache_loaded
+    now = time.time()
+    with _dns_lock:
+        if not _dns_cache_loaded:
+            try:
+                with open(_dns_cache_path(), 'r') as infile:
+                    _dns_cache.update({k: tuple(v) for k, v in json.load(infile).items()})
+            except (OSError, ValueError):
+                pass
+            _dns_cache_loaded = True
+        cached = _dns_cache.get(host)
+        if cached and now - cached[1] < _dns_ttl():
+            logger.spam('DNS cache hit for {}: {}'.format(host, cached[0]))
+            return cached[0]
+    start = time.monotonic()
+    ip = socket.gethostbyname(host)
+    logger.verbose('Resolved {} to {} in {:.1f} ms'.format(host, ip, (time.monotonic() - start) * 1000))
+    with _dns_lock:
+        _dns_cache[host] = (ip, now)
+        try:
+            os.makedirs(os.path.dirname(_dns_cache_path()), exist_ok=True)
+            with open(_dns_cache_path(), 'w') as outfile:
+                json.dump(_dns_cache, outfile)
+        except OSError as e:
+            logger.debug('Unable to persist dns cache: {}'.format(e))
+    return ip
+
+
+class SshMultiplexer:
+    """Keeps an OpenSSH ControlMaster connection open to a docker node.
+
+    The remote docker socket is forwarded to a local unix socket through the master, so both the API client and the
+    docker CLI spawned by `stack sh`/`exec`/`attach` talk to the node without a new SSH handshake. ControlPersist
+    keeps the master, and therefore the forwarded socket, alive between invocations.
+    """
+
+    def __init__(self, user: Optional[str], host: str, port: Optional[int] = None):
+        self.user = user
+        self.host = host
+        self.port = port
+        # Unix socket paths are limited to ~100 characters, keep them short
+        digest = hashlib.sha1('{}@{}:{}'.format(user, host, port).encode()).hexdigest()[:12]
+        self.control_dir = os.environ.get('SWARM_CLI_SSH_DIR', os.path.expanduser(os.path.join('~', '.swarm-cli', 'ssh')))
+        self.control_path = os.path.join(self.control_dir, '{}.ctl'.format(digest))
+        self.socket_path = os.path.join(self.control_dir, '{}.sock'.format(digest))
+        self.persist = os.environ.get('SWARM_CLI_SSH_PERSIST', '10m')
+
+    def _destination(self):
+        args = []
+        if self.port:
+            args += ['-p', str(self.port)]
+        args.append('{}@{}'.format(self.user, self.host) if self.user else self.host)
+        return args
+
+    def _ssh(self, *args) -> int:
+        cmd = ['ssh', '-o', 'BatchMode=yes', '-S', self.control_path] + list(args) + self._destination()
+        logger.spam('+ ' + ' '.join(cmd))
+        return subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL).returncode
+
+    def is_alive(self) -> bool:
+        return os.path.exists(self.control_path) and self._ssh('-O', 'check') == 0
+
+    def start(self):
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+        res = self._ssh('-o', 'ControlMaster=auto', '-o', 'ControlPersist={}'.format(self.persist),
+                        '-o', 'StreamLocalBindUnlink=yes', '-fN')
+        if res != 0:
+            raise ConnectionError('Unable to open ssh master connection to {}'.format(self.host))
+
+    def forward(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        res = self._ssh('-O', 'forward', '-L', '{}:{}'.format(self.socket_path, REMOTE_DOCKER_SOCKET))
+        if res != 0:
+            raise ConnectionError('Unable to forward the docker socket of {}'.format(self.host))
+
+    def ensure(self) -> str:
+        if not self.is_alive():
+            logger.verbose('Opening ssh master connection to {}'.format(self.host))
+            self.start()
+            self.forward()
+        elif not os.path.exists(self.socket_path):
+            self.forward()
+        else:
+            logger.verbose('Reusing ssh master connection to {}'.format(self.host))
+        return 'unix://{}'.format(self.socket_path)
+
+    def stop(self):
+        self._ssh('-O', 'exit')
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
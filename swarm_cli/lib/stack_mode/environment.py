@@ -1,11 +1,51 @@
 import os.path
 from typing import Dict, List
 
+import click
+
 from swarm_cli.lib import load_required_yaml
+from swarm_cli.lib.compose_merge import merge_compose
 from swarm_cli.lib.logging import logger
 from swarm_cli.lib.utils import parse_yaml_bool
 
 
+class EnvironmentResolver:
+    """Resolves the `extends` graph of the environments declared in stack-config.yml.
+
+    Every environment is built once no matter how many paths lead to it, and its compose file is parsed once.
+    """
+
+    def __init__(self, root_path: str, stack_config: dict):
+        self.root_path = root_path
+        self.stack_config = stack_config
+        self._resolved: Dict[str, 'Environment'] = {}
+        self._resolving: List[str] = []
+
+    def resolve(self, name: str) -> 'Environment':
+        if name in self._resolved:
+            return self._resolved[name]
+        if name in self._resolving:
+            cycle = self._resolving[self._resolving.index(name):] + [name]
+            click.secho('Cyclic extends between environments: {}'.format(' -> '.join(cycle)), fg='red', bold=True)
+            exit(1)
+        if name not in self.stack_config['environments']:
+            click.secho('Environment {} does not exist, please check the config file'.format(name), fg='red', bold=True)
+            exit(1)
+        self._resolving.append(name)
+        bases = [self.resolve(base) for base in get_extends(self.stack_config, name)]
+        self._resolving.pop()
+        env = Environment(self.root_path, name, self.stack_config, bases=bases)
+        self._resolved[name] = env
+        return env
+
+
+def get_extends(stack_config: dict, name: str) -> List[str]:
+    extends = (stack_config['environments'][name] or {}).get('extends', [])
+    if type(extends) == str:
+        extends = [extends]
+    return extends
+
+
 class Environment:
     class Config:
         stack_name: str
@@ -14,51 +54,68 @@ class Environment:
         env_file: str = 'env'
         secrets_file: str = 'secrets'
         production = False
+        ssh_transport: str = None
         extends: List[str]
 
-    cfg: Config = Config()
+    cfg: Config
 
-    def __init__(self, root_path: str, name: str, stack_config: dict):
+    def __init__(self, root_path: str, name: str, stack_config: dict, bases: List['Environment'] = None):
         self.name: str = name
         self.root_path: str = root_path
         self.env_path: str = os.path.join(self.root_path, self.name)
         self.stack_base_name: str = stack_config.get('basename', None)
+        self.cfg = Environment.Config()
+        self._own_services: Dict = {}
         self._services: Dict = {}
         self._stack_files: List = []
         self._secret_files: List = []
         self._env_files: List = []
-        configuration = stack_config['environments'][self.name]
+        configuration = stack_config['environments'][self.name] or {}
 
-        self.cfg.extends = configuration.get('extends', [])
-        if type(self.cfg.extends) == str:
-            self.cfg.extends = [self.cfg.extends]
-        self.bases = []
-        for extendEnv in self.cfg.extends:
-            logger.debug("Extending base env '{}' from env '{}'".format(extendEnv, name))
-            temp_env = Environment(root_path, extendEnv, stack_config)
-            self.bases.append(temp_env)
+        self.cfg.extends = get_extends(stack_config, name)
+        if bases is None:
+            resolver = EnvironmentResolver(root_path, stack_config)
+            resolver._resolving.append(name)
+            bases = [resolver.resolve(base) for base in self.cfg.extends]
+        for base in bases:
+            logger.debug("Extending base env '{}' from env '{}'".format(base.name, name))
+        self.bases: List[Environment] = bases
 
         self.cfg.stack_name = configuration.get('stack_name', None) or '{}-{}'.format(self.stack_base_name, self.name)
         self.cfg.docker_host = configuration.get('docker_host', None)
         self.cfg.docker_user = configuration.get('docker_user', 'root')
+        self.cfg.ssh_transport = configuration.get('ssh_transport', None)
         self.cfg.production = parse_yaml_bool(configuration.get('production', False)) or self.name in ['prod', 'production']
 
         self._hydrate()
 
+    def get_source_files(self):
+        return list(self._stack_files)
+
+    def linearize(self) -> List['Environment']:
+        # Depth-first, bases before the environments extending them, each environment listed once
+        res = []
+        seen = set()
+
+        def visit(env: 'Environment'):
+            if env.name in seen:
+                return
+            seen.add(env.name)
+            for base in env.bases:
+                visit(base)
+            res.append(env)
+
+        visit(self)
+        return res
+
     def _hydrate(self):
-        for base in self.bases:
-            # logger.debug("Processing base '{}'".format(base.name))
-            for fp in base._stack_files:
-                self._add_stack_file(fp)
-            # print(base._secret_files)
-            for fp in base._secret_files:
-                self._add_secrets_file(fp)
-            # print(base._env_files)
-            for fp in base._env_files:
-                self._add_env_file(fp)
-        self._add_stack_file(os.path.join(self.env_path, 'docker-compose.yml'))
-        self._add_secrets_file(os.path.join(self.env_path, self.cfg.secrets_file))
-        self._add_env_file(os.path.join(self.env_path, self.cfg.env_file))
+        stack_file = os.path.join(self.env_path, 'docker-compose.yml')
+        data = load_required_yaml(stack_file)
+        self._own_services = (data or {}).get('services') or {}
+        for env in self.linearize():
+            self._add_stack_file(os.path.join(env.env_path, 'docker-compose.yml'), env._own_services)
+            self._add_secrets_file(os.path.join(env.env_path, env.cfg.secrets_file))
+            self._add_env_file(os.path.join(env.env_path, env.cfg.env_file))
         logger.debug("Env '{}' hydrated".format(self.name))
 
     def _add_secrets_file(self, filepath: str):
@@ -67,10 +124,11 @@ class Environment:
     def _add_env_file(self, filepath: str):
         self._env_files.append(filepath)
 
-    def _add_stack_file(self, stack_file: str):
-        data = load_required_yaml(stack_file)
-        for service_name, service_def in data['services'].items():
-            self._services[service_name] = service_def
+    def _add_stack_file(self, stack_file: str, services: Dict = None):
+        if services is None:
+            services = load_required_yaml(stack_file)['services']
+        # Same override semantics as the resolved compose file that gets deployed
+        self._services = merge_compose([{'services': self._services}, {'services': services}])['services']
         self._stack_files.append(stack_file)
 
     def build_compose_override_list(self):
@@ -99,5 +157,15 @@ class Environment:
     def get_services(self):
         return self._services.keys()
 
+    def get_service_definitions(self) -> Dict[str, dict]:
+        return dict(self._services)
+
+    def get_project_dir(self):
+        # docker-compose resolves relative paths against the directory of the first compose file
+        return os.path.dirname(os.path.abspath(self._stack_files[0]))
+
+    def get_buildable_services(self):
+        return [name for name, definition in self._services.items() if 'build' in (definition or {})]
+
     def get_full_service_name(self, service: str):
         return "{}_{}".format(self.cfg.stack_name, service)
@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+import click
+
+
+class ReplicaResult:
+    def __init__(self, replica: str, exit_code: int, stdout: bytes = b'', stderr: bytes = b'', duration: float = 0.0,
+                 error: str = None):
+        self.replica = replica
+        self.exit_code = exit_code
+        self.stdout = stdout or b''
+        self.stderr = stderr or b''
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_code == 0
+
+
+def exec_on_replicas(replicas: List[Tuple[str, Callable[[], object]]], cmd: List[str],
+                     jobs: int = 8) -> List[ReplicaResult]:
+    """Runs cmd through the exec API in every replica, at most `jobs` at the same time.
+
+    Replicas are (name, get_container) pairs. Containers are looked up by the workers: a node that can't be reached
+    only fails its own replicas.
+    """
+
+    def run(replica: str, get_container) -> ReplicaResult:
+        start = time.monotonic()
+        try:
+            exit_code, (stdout, stderr) = get_container().exec_run(cmd, demux=True)
+        except Exception as e:
+            return ReplicaResult(replica, -1, duration=time.monotonic() - start, error=str(e))
+        return ReplicaResult(replica, exit_code, stdout, stderr, duration=time.monotonic() - start)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(run, replica, get_container) for replica, get_container in replicas]
+        return [future.result() for future in futures]
+
+
+def print_replica_results(results: List[ReplicaResult]):
+    for result in results:
+        click.secho('==> {} <=='.format(result.replica), bold=True)
+        if result.stdout:
+            click.echo(result.stdout.decode('utf-8', errors='replace').rstrip())
+        if result.stderr:
+            click.echo(result.stderr.decode('utf-8', errors='replace').rstrip(), err=True)
+        if result.error:
+            click.secho(result.error, fg='red', err=True)
+
+    width = max([len(result.replica) for result in results] + [len('REPLICA')])
+    click.secho('\n{}  {:>5s}  {:>9s}'.format('REPLICA'.ljust(width), 'EXIT', 'DURATION'), bold=True)
+    for result in results:
+        exit_code = 'ERR' if result.error else str(result.exit_code)
+        click.secho('{}  {:>5s}  {:>8.2f}s'.format(result.replica.ljust(width), exit_code, result.duration),
+                    fg='green' if result.ok else 'red')
+    failed = len([result for result in results if not result.ok])
+    click.secho('{} of {} replicas succeeded'.format(len(results) - failed, len(results)),
+                fg='green' if failed == 0 else 'red')
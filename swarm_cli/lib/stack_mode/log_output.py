@@ -0,0 +1,160 @@
+import re
+import struct
+import time
+from datetime import datetime
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+# Fast path for `stack logs`: the raw log stream is demultiplexed and written as bytes to buffered stdout/stderr,
+# without decoding each chunk or going through click.
+
+STREAM_STDOUT = 1
+STREAM_STDERR = 2
+
+_header = struct.Struct('>BxxxL')
+_duration_regex = re.compile(r'^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$')
+
+
+class FrameDecoder:
+    """Splits the multiplexed stream of a non-tty container into (stream, payload) frames.
+
+    Each frame is an 8 bytes header (stream id, 3 padding bytes, big endian payload size) followed by the payload.
+    Frames can be split across chunks in any way.
+    """
+
+    def __init__(self):
+        self.pending = bytearray()
+
+    def feed(self, chunk: bytes) -> List[Tuple[int, bytes]]:
+        pending = self.pending
+        pending += chunk
+        frames = []
+        offset = 0
+        size = len(pending)
+        unpack_from = _header.unpack_from
+        header_size = _header.size
+        while size - offset >= header_size:
+            stream, length = unpack_from(pending, offset)
+            end = offset + header_size + length
+            if end > size:
+                break
+            frames.append((stream, pending[offset + header_size:end]))
+            offset = end
+        if offset:
+            del pending[:offset]
+        return frames
+
+
+class LineBuffer:
+    """Keeps the trailing partial line of a stream so that only complete lines are written."""
+
+    def __init__(self):
+        self.pending = b''
+
+    def feed(self, data: bytes) -> bytes:
+        idx = data.rfind(b'\n')
+        if idx == -1:
+            self.pending += data
+            return b''
+        complete = self.pending + data[:idx + 1] if self.pending else data[:idx + 1]
+        self.pending = data[idx + 1:]
+        return complete
+
+    def flush(self) -> bytes:
+        res, self.pending = self.pending, b''
+        return res
+
+
+class LogPump:
+    def __init__(self, out: BinaryIO, err: BinaryIO, tty: bool = False, grep: Optional[str] = None):
+        self.tty = tty
+        self.decoder = FrameDecoder()
+        self.outputs = {STREAM_STDOUT: out, STREAM_STDERR: err}
+        self.buffers = {STREAM_STDOUT: LineBuffer(), STREAM_STDERR: LineBuffer()}
+        # Matching happens on bytes, invalid UTF-8 never has to be decoded
+        self.grep = re.compile(grep.encode()) if grep else None
+
+    def _write(self, stream: int, data: bytes):
+        if not data:
+            return
+        if self.grep:
+            data = b''.join(line for line in data.splitlines(keepends=True) if self.grep.search(line))
+            if not data:
+                return
+        self.outputs.get(stream, self.outputs[STREAM_STDOUT]).write(data)
+
+    def feed(self, chunk: bytes):
+        if self.tty:
+            self._write(STREAM_STDOUT, self.buffers[STREAM_STDOUT].feed(chunk))
+            return
+        # Join the payloads of each stream so that every chunk results in at most one write per stream
+        parts = {STREAM_STDOUT: [], STREAM_STDERR: []}
+        for stream, payload in self.decoder.feed(chunk):
+            parts.get(stream, parts[STREAM_STDOUT]).append(payload)
+        for stream, payloads in parts.items():
+            if payloads:
+                self._write(stream, self.buffers[stream].feed(b''.join(payloads)))
+
+    def close(self):
+        for stream, buffer in self.buffers.items():
+            remainder = buffer.flush()
+            if remainder:
+                self._write(stream, remainder + b'\n')
+        for output in self.outputs.values():
+            output.flush()
+
+    def run(self, chunks: Iterable[bytes]):
+        try:
+            for chunk in chunks:
+                self.feed(chunk)
+                # Flush once per chunk read from the socket rather than once per line
+                for output in self.outputs.values():
+                    output.flush()
+        finally:
+            self.close()
+
+
+def parse_time_filter(value: Optional[str], now: float = None) -> Optional[float]:
+    """Converts --since/--until values to a UNIX timestamp.
+
+    Accepts UNIX timestamps, ISO 8601 dates and durations relative to now such as 10m, 1h30m or 45s.
+    """
+    if value is None or value == '':
+        return None
+    now = time.time() if now is None else now
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    match = _duration_regex.match(value)
+    if match and any(match.groups()):
+        hours, minutes, seconds = (int(group or 0) for group in match.groups())
+        return now - (hours * 3600 + minutes * 60 + seconds)
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        raise ValueError('Invalid time {}, use a UNIX timestamp, an ISO 8601 date or a duration like 10m'.format(value))
+
+
+def raw_log_chunks(client, container_id: str, follow=True, tail='all', since: float = None,
+                   until: float = None) -> Iterator[bytes]:
+    """Yields the raw (still multiplexed) log stream of a container as soon as data is available on the socket."""
+    params = {
+        'stdout': 1,
+        'stderr': 1,
+        'follow': 1 if follow else 0,
+        'timestamps': 0,
+        'tail': tail,
+    }
+    if since is not None:
+        params['since'] = since
+    if until is not None:
+        params['until'] = until
+    api = client.api
+    res = api._get(api._url('/containers/{0}/logs', container_id), params=params, stream=True)
+    api._raise_for_status(res)
+    if follow:
+        # The client timeout would otherwise close a quiet stream
+        api._disable_socket_timeout(api._get_raw_response_socket(res))
+    # Read through urllib3 like docker-py does: it decodes the chunked transfer encoding and returns the bytes
+    # http.client already buffered, each HTTP chunk is yielded as soon as it arrives
+    yield from res.raw.stream(65536, decode_content=False)
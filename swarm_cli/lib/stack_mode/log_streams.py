@@ -0,0 +1,106 @@
+import heapq
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+from swarm_cli.lib.logging import logger
+
+# Marks the end of a stream in its queue
+_EOF = None
+
+
+def timestamp_sort_key(timestamp: bytes) -> bytes:
+    # Docker trims trailing zeros from the RFC3339Nano fraction, pad it so that timestamps compare lexicographically
+    seconds, _, fraction = timestamp.rstrip(b'Z').partition(b'.')
+    return seconds + b'.' + fraction.ljust(9, b'0')
+
+
+class LogStream(threading.Thread):
+    """Reads the log stream of one container and queues it line by line.
+
+    The queue is bounded: when the consumer falls behind the reader blocks, which stops reading from the docker
+    socket and lets TCP flow control push back on the daemon instead of buffering without limit.
+    """
+
+    def __init__(self, prefix: str, chunks: Iterable[bytes], max_lines: int = 1000):
+        super().__init__(daemon=True)
+        self.prefix = prefix
+        self.chunks = chunks
+        self.max_lines = max_lines
+        self.queue: queue.Queue = queue.Queue(maxsize=max_lines)
+
+    def run(self):
+        pending = b''
+        try:
+            for chunk in self.chunks:
+                pending += chunk
+                lines = pending.split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    self._put_line(line)
+            if pending:
+                self._put_line(pending)
+        except Exception as e:
+            logger.error('{}: log stream interrupted: {}'.format(self.prefix, e))
+        finally:
+            self.queue.put(_EOF)
+
+    def _put_line(self, line: bytes):
+        # Lines are requested with timestamps=True: "<RFC3339Nano timestamp> <message>". The reorder window counts
+        # from the moment the line was read, not from the moment the merger gets to it
+        timestamp, _, message = line.partition(b' ')
+        self.queue.put((timestamp_sort_key(timestamp), time.monotonic(), message))
+
+
+def merge_log_streams(streams: List[LogStream], emit: Callable[[str, bytes], None], window: float = 0.25,
+                      poll_interval: float = 0.01):
+    """Emits the lines of all streams ordered by timestamp.
+
+    Every queued line is moved to a heap on each pass. The oldest line is emitted once every live stream has a line
+    in the heap (so nothing older can still arrive) or has been silent for more than `window` seconds, or when the
+    line itself was read more than `window` seconds ago. A quiet replica delays the others by `window` at most and
+    doesn't slow them down.
+    """
+    heap = []
+    pending = {stream: 0 for stream in streams}
+    last_read = {stream: time.monotonic() for stream in streams}
+    live = set(streams)
+    sequence = 0
+    for stream in streams:
+        stream.start()
+    while live or heap:
+        for stream in list(live):
+            # At most max_lines per stream wait in the heap, a reader that gets ahead blocks on its queue
+            while pending[stream] < stream.max_lines:
+                try:
+                    item = stream.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _EOF:
+                    live.discard(stream)
+                    break
+                sort_key, received_at, message = item
+                # The sequence number keeps the order stable for equal timestamps and avoids comparing streams
+                heapq.heappush(heap, (sort_key, sequence, received_at, stream, message))
+                pending[stream] += 1
+                last_read[stream] = received_at
+                sequence += 1
+        emitted = False
+        now = time.monotonic()
+        while heap:
+            _, _, received_at, stream, message = heap[0]
+            all_streams_ready = all(pending[other] or now - last_read[other] >= window for other in live)
+            if not all_streams_ready and now - received_at < window:
+                break
+            heapq.heappop(heap)
+            pending[stream] -= 1
+            emit(stream.prefix, message)
+            emitted = True
+        if not emitted:
+            time.sleep(poll_interval)
+
+
+def task_prefix(service: str, task: dict, node_host: Optional[str]) -> str:
+    slot = task.get('Slot') or task['NodeID'][:12]
+    return '{}.{}@{}'.format(service, slot, node_host or task['NodeID'][:12])
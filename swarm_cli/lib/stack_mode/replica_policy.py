@@ -0,0 +1,83 @@
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+
+import click
+
+from swarm_cli.lib.logging import logger
+
+POLICY_LOCAL_FIRST = 'local-first'
+POLICY_LEAST_LOADED = 'least-loaded'
+POLICIES = [POLICY_LOCAL_FIRST, POLICY_LEAST_LOADED]
+
+
+def parse_replica_policy(ctx, param, value: str) -> Union[str, int]:
+    # click callback: a policy name or a slot number
+    if value in POLICIES:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise click.BadParameter('use {} or a slot number'.format(', '.join(POLICIES)))
+
+
+def replica_option(fn):
+    return click.option('--replica', default=POLICY_LOCAL_FIRST, callback=parse_replica_policy,
+                        help="Replica to use: local-first (no extra ssh connection when possible), least-loaded "
+                             "or a slot number")(fn)
+
+
+def _select_local_first(state, tasks: List[dict]) -> dict:
+    topology = state.get_topology()
+    local_host = platform.node()
+    for task in tasks:
+        if topology.get_node_address(task['NodeID'])[0] == local_host:
+            return task
+    connected = topology.get_connected_node_id()
+    for task in tasks:
+        if task['NodeID'] == connected:
+            return task
+    return tasks[0]
+
+
+def cpu_percent(stats: dict) -> float:
+    cpu, precpu = stats.get('cpu_stats', {}), stats.get('precpu_stats', {})
+    cpu_delta = cpu.get('cpu_usage', {}).get('total_usage', 0) - precpu.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    return cpu_delta / system_delta * cpu.get('online_cpus', 1) * 100
+
+
+def _select_least_loaded(state, tasks: List[dict]) -> dict:
+    def load(task):
+        try:
+            container, _ = state.get_container_for_task(task)
+            stats = container.stats(stream=False)
+            return cpu_percent(stats), stats.get('memory_stats', {}).get('usage', 0)
+        except Exception as e:
+            logger.debug('Unable to read the stats of task {}: {}'.format(task['ID'], e))
+            return float('inf'), float('inf')
+
+    # Stats take about a second each (the daemon samples cpu usage twice), read them all at once
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        loads = list(executor.map(load, tasks))
+    for task, (cpu, memory) in zip(tasks, loads):
+        logger.verbose('Slot {}: {:.1f}% cpu, {} bytes'.format(task.get('Slot'), cpu, memory))
+    return tasks[min(range(len(tasks)), key=lambda i: loads[i])]
+
+
+def select_replica(state, tasks: List[dict], policy: Union[str, int]) -> Optional[dict]:
+    if not tasks:
+        return None
+    if isinstance(policy, int):
+        for task in tasks:
+            if task.get('Slot') == policy:
+                return task
+        logger.error('No running replica in slot {}'.format(policy))
+        return None
+    if len(tasks) == 1:
+        return tasks[0]
+    if policy == POLICY_LEAST_LOADED:
+        return _select_least_loaded(state, tasks)
+    return _select_local_first(state, tasks)
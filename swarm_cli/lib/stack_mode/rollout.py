@@ -0,0 +1,146 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+import click
+
+from swarm_cli.lib.logging import logger
+
+
+class RolloutResult:
+    CONVERGED = 'converged'
+    ROLLED_BACK = 'rolled back'
+    PAUSED = 'paused'
+    TIMEOUT = 'timeout'
+    ERROR = 'error'
+
+    def __init__(self, service: str, status: str, duration: float, message: str = None):
+        self.service = service
+        self.status = status
+        self.duration = duration
+        self.message = message
+
+    @property
+    def ok(self):
+        return self.status == RolloutResult.CONVERGED
+
+
+def get_update_started_at(service) -> Optional[str]:
+    # Identifies the last update of a service, a different value after an update means that a new rollout started
+    return (service.attrs.get('UpdateStatus') or {}).get('StartedAt')
+
+
+def _tasks_converged(service) -> bool:
+    # Swarm copies the task template of the service into each task it creates: a task with another spec (env,
+    # mounts, resources, command...) belongs to a previous version and is still to be replaced
+    template = service.attrs['Spec']['TaskTemplate']
+    tasks = service.tasks(filters={'desired-state': 'running'})
+    for task in tasks:
+        if task.get('Spec', {}) != template:
+            return False
+        if task.get('Status', {}).get('State') != 'running':
+            return False
+    replicas = service.attrs['Spec'].get('Mode', {}).get('Replicated', {}).get('Replicas')
+    if replicas is not None and len(tasks) < replicas:
+        return False
+    return True
+
+
+def check_rollout(service, baseline: Optional[str]) -> Optional[str]:
+    """Returns the final status of the rollout of a service, or None while it is still in progress."""
+    service.reload()
+    update_status = service.attrs.get('UpdateStatus') or {}
+    if update_status and update_status.get('StartedAt') != baseline:
+        state = update_status.get('State')
+        if state in ('rollback_completed', 'rollback_paused'):
+            return RolloutResult.ROLLED_BACK
+        if state == 'paused':
+            return RolloutResult.PAUSED
+        if state != 'completed':
+            return None
+    return RolloutResult.CONVERGED if _tasks_converged(service) else None
+
+
+def wait_for_rollout(service, baseline: Optional[str], timeout: float = 300, started: float = None,
+                     poll_interval: float = 2.0, wake: threading.Event = None) -> RolloutResult:
+    """Waits until the rollout of a service converges, is paused or rolled back, or `timeout` seconds pass.
+
+    The service is checked every `poll_interval` seconds, or earlier when `wake` is set.
+    """
+    started = time.monotonic() if started is None else started
+    name = service.name
+    while True:
+        try:
+            status = check_rollout(service, baseline)
+        except Exception as e:
+            return RolloutResult(name, RolloutResult.ERROR, time.monotonic() - started, str(e))
+        elapsed = time.monotonic() - started
+        if status is not None:
+            message = (service.attrs.get('UpdateStatus') or {}).get('Message')
+            logger.verbose('{}: {} after {:.1f}s'.format(name, status, elapsed))
+            return RolloutResult(name, status, elapsed, message if status != RolloutResult.CONVERGED else None)
+        if elapsed >= timeout:
+            return RolloutResult(name, RolloutResult.TIMEOUT, elapsed, 'not converged after {:.0f}s'.format(timeout))
+        delay = min(poll_interval, max(0.0, timeout - elapsed))
+        if wake is not None:
+            wake.wait(delay)
+            wake.clear()
+        else:
+            time.sleep(delay)
+
+
+class RolloutWaker:
+    """Wakes the rollout waits of the services of a stack when the events stream reports activity on them.
+
+    Service updates and task container state changes both trigger a check of the service, so a rollout is usually
+    seen as converged right after its last task starts. Container events are only emitted by the node the client is
+    connected to, the polling in `wait_for_rollout` covers the other nodes and an interrupted stream.
+    """
+
+    def __init__(self, client, stack_name: str):
+        self.client = client
+        self.stack_name = stack_name
+        self.wakes: Dict[str, threading.Event] = {}
+        self.stream = None
+        self.thread = None
+
+    def get(self, service_name: str) -> threading.Event:
+        if service_name not in self.wakes:
+            self.wakes[service_name] = threading.Event()
+        return self.wakes[service_name]
+
+    def start(self):
+        self.stream = self.client.events(decode=True, filters={'type': ['service', 'container']})
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for event in self.stream:
+                attributes = event.get('Actor', {}).get('Attributes', {}) or {}
+                if event.get('Type') == 'service':
+                    name = attributes.get('name')
+                else:
+                    name = attributes.get('com.docker.swarm.service.name')
+                if name in self.wakes:
+                    self.wakes[name].set()
+        except Exception as e:
+            logger.debug('Events stream interrupted: {}'.format(e))
+
+    def stop(self):
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except Exception:
+                pass
+
+
+def print_rollout_summary(results: List[RolloutResult]):
+    width = max([len(result.service) for result in results] + [len('SERVICE')])
+    click.secho('\n{}  {:<12s} {:>9s}'.format('SERVICE'.ljust(width), 'STATUS', 'DURATION'), bold=True)
+    for result in results:
+        line = '{}  {:<12s} {:>8.1f}s'.format(result.service.ljust(width), result.status, result.duration)
+        if result.message:
+            line += '  {}'.format(result.message)
+        click.secho(line, fg='green' if result.ok else 'red')
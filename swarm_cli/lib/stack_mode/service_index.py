@@ -0,0 +1,39 @@
+from typing import Dict, Iterable, List, Optional
+
+from swarm_cli.lib.logging import logger
+
+STACK_NAMESPACE_LABEL = 'com.docker.stack.namespace'
+
+
+class ServiceIndex:
+    """All the services of a deployed stack, fetched with a single `services.list` call and indexed by name."""
+
+    def __init__(self, client, stack_name: str, declared: Iterable[str]):
+        self.stack_name = stack_name
+        self.declared = sorted(declared)
+        services = client.services.list(filters={'label': '{}={}'.format(STACK_NAMESPACE_LABEL, stack_name)})
+        self.services: Dict[str, object] = {service.name: service for service in services}
+        logger.debug('Indexed {} services of stack {}'.format(len(self.services), stack_name))
+
+    def get_full_service_name(self, service: str):
+        return '{}_{}'.format(self.stack_name, service)
+
+    def get(self, fqsn: str) -> Optional[object]:
+        return self.services.get(fqsn)
+
+    def get_declared(self, service: str) -> Optional[object]:
+        return self.services.get(self.get_full_service_name(service))
+
+    def missing(self, services: Iterable[str] = None) -> List[str]:
+        # Services declared in the compose files that are not deployed
+        services = self.declared if services is None else services
+        return [service for service in services if self.get_full_service_name(service) not in self.services]
+
+    def undeclared(self) -> List[str]:
+        # Services deployed in the stack that no compose file declares anymore
+        declared = set(self.get_full_service_name(service) for service in self.declared)
+        return sorted(name for name in self.services.keys() if name not in declared)
+
+    def report_missing(self, services: Iterable[str] = None):
+        for service in self.missing(services):
+            logger.warning('Service {} is declared but not deployed'.format(self.get_full_service_name(service)))
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from swarm_cli.lib.logging import logger
+from swarm_cli.lib.service_spec import apply_spec, diff_spec, normalize_image
+
+IMAGE_FIELD = 'TaskTemplate.ContainerSpec.Image'
+# Fields that reference objects only `docker stack deploy` creates (secrets, configs), they can't be updated in place
+_STACK_DEPLOY_FIELDS = ['TaskTemplate.ContainerSpec.Secrets', 'TaskTemplate.ContainerSpec.Configs']
+
+
+class ServiceUpdate:
+    """The new spec of a deployed service, computed from its rendered spec and limited to the fields that changed."""
+
+    def __init__(self, service, rendered: dict, fields: List[str]):
+        self.service = service
+        self.name = service.name
+        self.fields = fields
+        self.spec = apply_spec(service.attrs['Spec'], rendered, fields)
+
+    @property
+    def blocked_by(self) -> List[str]:
+        return [field for field in self.fields if field in _STACK_DEPLOY_FIELDS]
+
+
+def resolve_image_digest(client, image: str) -> Optional[str]:
+    # Same as `docker stack deploy --resolve-image always`: every node runs the image the tag points at right now
+    try:
+        return client.api.inspect_distribution(image)['Descriptor']['digest']
+    except Exception as e:
+        logger.warning('Unable to resolve the digest of {}, deploying the tag: {}'.format(image, e))
+        return None
+
+
+def plan_service_updates(client, index, rendered: Dict[str, dict], names: List[str]) -> List[ServiceUpdate]:
+    """Returns the updates of the deployed services `names`, services without any change are left out.
+
+    The image digests are resolved in parallel, a tag that now points at another digest is a change of the image.
+    """
+    def plan(name):
+        service = index.get(name)
+        live_image = service.attrs['Spec']['TaskTemplate']['ContainerSpec'].get('Image')
+        fields = diff_spec(rendered[name], service.attrs['Spec'])
+        image = rendered[name]['TaskTemplate']['ContainerSpec'].get('Image')
+        digest = resolve_image_digest(client, image) if image and '@' not in image else None
+        # Written the way docker stores it, so that an unchanged digest compares equal to the live image
+        pinned = '{}@{}'.format(normalize_image(image), digest) if digest else image
+        if digest and pinned != live_image and IMAGE_FIELD not in fields:
+            fields.append(IMAGE_FIELD)
+        update = ServiceUpdate(service, rendered[name], fields)
+        if IMAGE_FIELD in fields:
+            update.spec['TaskTemplate']['ContainerSpec']['Image'] = pinned
+        return update
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(names), 8))) as executor:
+        updates = list(executor.map(plan, names))
+    return [update for update in updates if update.fields]
+
+
+def apply_service_update(client, update: ServiceUpdate):
+    """Sends the new spec of a service, at the version it was read at: a concurrent change makes the update fail."""
+    spec = update.spec
+    client.api.update_service(update.service.id, update.service.version, task_template=spec['TaskTemplate'],
+                              name=spec['Name'], labels=spec.get('Labels'), mode=spec.get('Mode'),
+                              update_config=spec.get('UpdateConfig'), rollback_config=spec.get('RollbackConfig'),
+                              endpoint_spec=spec.get('EndpointSpec'))
+    logger.notice('Updated {}: {}'.format(update.name, ', '.join(update.fields)))
@@ -1,15 +1,17 @@
+import contextlib
 import os
 import platform
-from typing import Dict
+import threading
+from typing import TYPE_CHECKING, Dict
 
 import click
-import dpath.util
-from docker import DockerClient
 
-from swarm_cli.lib import load_required_yaml
-from .environment import Environment
+from swarm_cli.lib.config_cache import ConfigCache, file_signature
+from .environment import Environment, EnvironmentResolver
 from ..logging import logger
-from ...client import Client
+
+if TYPE_CHECKING:
+    from swarm_cli.client import Client
 
 
 class StackModeState:
@@ -19,18 +21,50 @@ class StackModeState:
     cfg_basename: str
     cfg_environments: Dict[str, Dict]
     root_path: str
+    config_path: str
 
     base_docker_host: str = None
     current_env: Environment
 
-    _client: DockerClient = None
+    # docker and dpath are imported when a client is first needed, commands such as `stack ls` never pay for them
+    _client: 'Client' = None
     clients: Dict = dict()
+    _clients_lock = threading.Lock()
+    _client_locks: Dict[str, threading.Lock] = dict()
+
+    # Set by the daemon: states are kept alive between commands, along with their docker clients
+    keep_warm = False
+    _warm_states: Dict = dict()
 
     def __init__(self):
         if 'DOCKER_HOST' in os.environ:
             self.base_docker_host = os.environ['DOCKER_HOST']
 
+    @classmethod
+    def load(cls, path: str, env: str, ignore_prompt=False) -> 'StackModeState':
+        key = (os.path.abspath(path), env)
+        state = cls._warm_states.get(key) if cls.keep_warm else None
+        if state is not None and not state.is_stale():
+            # The stack may have been redeployed since the previous command
+            state.invalidate_topology(persisted=False)
+            state.base_docker_host = os.environ.get('DOCKER_HOST', None)
+            state.apply_env(ignore_prompt=ignore_prompt)
+            return state
+        state = cls()
+        state.initFromFile(path)
+        state.selectEnv(env, ignore_prompt=ignore_prompt)
+        if cls.keep_warm:
+            cls._warm_states[key] = state
+        return state
+
+    def _source_files(self):
+        return [self.config_path] + self.current_env.get_source_files()
+
+    def is_stale(self):
+        return [file_signature(path) for path in self._source_files()] != self._signatures
+
     def _init_client(self):
+        from swarm_cli.client import Client
         self._client = Client.from_env()
         self.clients[self._client.docker_host] = self._client
 
@@ -39,48 +73,105 @@ class StackModeState:
             self._init_client()
         return self._client
 
+    def get_service_index(self, refresh=False):
+        from .service_index import ServiceIndex
+        if refresh or getattr(self, '_service_index', None) is None:
+            self._service_index = ServiceIndex(self.get_docker_client(), self.current_env.cfg.stack_name,
+                                               self.current_env.get_services())
+        return self._service_index
+
     def get_client_for_host_or_ip(self, host: str, ip: str):
+        from swarm_cli.client import Client
         if host == platform.node():
-            if platform.node() in self.clients:
-                return self.clients[platform.node()]
-            else:
-                self.clients[platform.node()] = Client(base_url=None)
-                return self.clients[platform.node()]
-        node_conn_string = 'ssh://{}@{}'.format(self.current_env.cfg.docker_user,ip)
-        if node_conn_string in self.clients:
-            return self.clients[node_conn_string]
+            key, base_url = platform.node(), None
         else:
-            self.clients[node_conn_string] = Client(base_url=node_conn_string)
-            return self.clients[node_conn_string]
+            key = base_url = 'ssh://{}@{}'.format(self.current_env.cfg.docker_user, ip)
+        # Replicas are resolved from several threads, each node gets a single client. One lock per node so that
+        # connecting to a slow node doesn't hold the others
+        with self._clients_lock:
+            lock = self._client_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.clients:
+                self.clients[key] = Client(base_url=base_url)
+            return self.clients[key]
+
+    def get_topology(self):
+        from .topology import Topology
+        if getattr(self, '_topology', None) is None:
+            self._topology = Topology(self.get_docker_client(), self.current_env.cfg.stack_name)
+        return self._topology
+
+    def invalidate_topology(self, persisted=True):
+        """Drops the service index and the topology. With `persisted=False` only the copies held in memory are
+        dropped, the persisted topology is reused while it is fresh."""
+        if getattr(self, '_topology', None) is not None and persisted:
+            self._topology.invalidate()
+        self._topology = None
+        self._service_index = None
+
+    def get_node_address(self, node_id: str):
+        return self.get_topology().get_node_address(node_id)
 
     def get_docker_client_for_node(self, node_id: str):
-        node = self.get_docker_client().nodes.get(node_id)
-        node_host = dpath.util.get(node.attrs, "Description/Hostname", default=None)
-        node_ip = dpath.util.get(node.attrs, "Status/Addr", default=None)
-        if node_ip == '0.0.0.0':
-            node_ip = dpath.util.get(node.attrs, "ManagerStatus/Addr", default=None).split(":")[0]
+        if node_id == self.get_topology().get_connected_node_id():
+            # The environment client already talks to this node, no need for another connection
+            return self.get_docker_client()
+        node_host, node_ip = self.get_node_address(node_id)
         return self.get_client_for_host_or_ip(node_host, node_ip)
 
+    def get_running_tasks_for_service(self, fqsn: str):
+        return self.get_topology().get_running_tasks(fqsn)
+
+    def get_container_for_task(self, task: dict):
+        import dpath.util
+        client = self.get_docker_client_for_node(task['NodeID'])
+        container_id = dpath.util.get(task, "Status/ContainerStatus/ContainerID", default=None)
+        return client.containers.get(container_id), client
+
+    def get_running_containers_for_service(self, fqsn: str, limit: int = None):
+        """Returns (task, container, client) for the running tasks of a service, one API call per container."""
+        from docker.errors import NotFound
+        for attempt in range(2):
+            tasks = self.get_running_tasks_for_service(fqsn)
+            try:
+                return [(task,) + self.get_container_for_task(task) for task in tasks[:limit]]
+            except NotFound:
+                # The task list came from the persisted topology and a container is gone since then
+                if attempt:
+                    raise
+                self.invalidate_topology()
+
+    def get_replica_container_for_service(self, fqsn: str, replica):
+        """Returns the container and client of the replica chosen by the `replica` policy, see replica_policy."""
+        from docker.errors import NotFound
+        from .replica_policy import select_replica
+        for attempt in range(2):
+            tasks = self.get_running_tasks_for_service(fqsn)
+            if not tasks:
+                logger.warn("No running task found for {}".format(fqsn))
+                return None, None
+            task = select_replica(self, tasks, replica)
+            if task is None:
+                return None, None
+            try:
+                return self.get_container_for_task(task)
+            except NotFound:
+                if attempt:
+                    raise
+                self.invalidate_topology()
+
     def get_first_running_container_for_service(self, fqsn: str):
-        service = self.get_docker_client().services.get(fqsn)
-        tasks = service.tasks(filters={'name': fqsn, 'desired-state': 'running'})
-        task = tasks[0] if len(tasks) > 0 else None
-        if not task:
+        containers = self.get_running_containers_for_service(fqsn, limit=1)
+        if not containers:
             logger.warn("No running task found for {}".format(fqsn))
             return None, None
-        task_id = task['ID']
-        node_id = task['NodeID']
-        client = self.get_docker_client_for_node(node_id)
-        # pprint.pprint(task, indent=4)
-        container_id = dpath.util.get(task, "Status/ContainerStatus/ContainerID", default=None)
-        state = dpath.util.get(task, "Status/State", default=None)
-        if state != 'running':
-            logger.warn("Task not running")
-            return None, None
-        return client.containers.get(container_id), client
+        _, container, client = containers[0]
+        return container, client
 
     def initFromFile(self, path: str):
-        self.cfg_stack_config = load_required_yaml(path)
+        self.config_cache = ConfigCache()
+        self.config_path = path
+        self.cfg_stack_config = self.config_cache.load_yaml(path)
         self.root_path = os.path.dirname(path)
         self.cfg_basename = self.cfg_stack_config['basename']
         self.cfg_environments = self.cfg_stack_config['environments']
@@ -90,13 +181,43 @@ class StackModeState:
             click.secho('Cannot select environment {}, please check the config file'.format(env), fg='red', bold=True)
             exit(1)
         self.env = env
-        self.current_env = Environment(self.root_path, self.env, self.cfg_stack_config)
+        self.current_env = self._load_environment(env)
+        self._signatures = [file_signature(path) for path in self._source_files()]
+        self.apply_env(ignore_prompt=ignore_prompt)
 
+    def apply_env(self, ignore_prompt=False):
         if self.current_env.cfg.production and not ignore_prompt:
             click.confirm('You are going to run on a PRODUCTION swarm. Confirm?', abort=True)
 
         os.environ['STACK_NAME'] = self.current_env.cfg.stack_name
         os.environ['STACK_ENV'] = self.env
+        if self.current_env.cfg.ssh_transport:
+            # An explicit SWARM_CLI_SSH_TRANSPORT takes precedence over the environment configuration
+            os.environ.setdefault('SWARM_CLI_SSH_TRANSPORT', self.current_env.cfg.ssh_transport)
+
+    def _load_environment(self, env: str) -> Environment:
+        # The hydrated environment only depends on stack-config.yml and on the compose files of the extends chain
+        key = 'env:{}:{}'.format(os.path.abspath(self.config_path), env)
+        environment = self.config_cache.get('environments', key)
+        if environment is None:
+            environment = EnvironmentResolver(self.root_path, self.cfg_stack_config).resolve(env)
+            self.config_cache.put('environments', key, [self.config_path] + environment.get_source_files(), environment)
+        return environment
+
+    def get_resolved_compose(self, environ=None):
+        from swarm_cli.lib.compose_merge import resolve_compose
+        return resolve_compose(self.current_env.get_source_files(), environ=environ,
+                               project_dir=self.current_env.get_project_dir(), cache=self.config_cache)
+
+    @contextlib.contextmanager
+    def stack_file_args(self, environ=None, dry_run=False):
+        # The resolved file only exists while the block runs
+        from swarm_cli.lib.compose_merge import MERGE_NATIVE, get_compose_merge
+        if get_compose_merge() != MERGE_NATIVE:
+            yield self.current_env.build_stack_override_list()
+            return
+        with self.get_resolved_compose(environ).written(dry_run) as path:
+            yield '-c {}'.format(path)
 
     def use_env_docker_host(self):
         if self.current_env.cfg.docker_host is not None:
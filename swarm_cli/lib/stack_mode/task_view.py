@@ -0,0 +1,218 @@
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+from swarm_cli.lib.logging import logger
+from swarm_cli.lib.stack_mode.service_index import STACK_NAMESPACE_LABEL
+
+SWARM_TASK_ID_LABEL = 'com.docker.swarm.task.id'
+TASK_HEADER = ['ID', 'NAME', 'IMAGE', 'NODE', 'DESIRED STATE', 'CURRENT STATE', 'ERROR']
+
+
+def parse_docker_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    # RFC3339Nano, Python only handles microseconds
+    base, _, fraction = value.rstrip('Z').partition('.')
+    fraction = ''.join(c for c in fraction if c.isdigit())[:6]
+    try:
+        parsed = datetime.strptime(base, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return parsed.timestamp() + (float('0.' + fraction) if fraction else 0.0)
+
+
+def humanize_since(timestamp: Optional[float], now: float) -> str:
+    if timestamp is None:
+        return ''
+    seconds = max(0, int(now - timestamp))
+    for unit, size in [('day', 86400), ('hour', 3600), ('minute', 60)]:
+        if seconds >= size:
+            count = seconds // size
+            return '{} {}{} ago'.format(count, unit, 's' if count > 1 else '')
+    return '{} seconds ago'.format(seconds)
+
+
+class TaskView:
+    """Live view of the tasks of a stack.
+
+    One snapshot of tasks, services and nodes is taken at start, then the view is kept up to date from the /events
+    stream: every relevant event costs at most one API call whatever the number of tasks. Container events are only
+    emitted by the node the client is connected to, so a full resync (a single `tasks` call) runs every
+    `resync_interval` seconds to catch state changes happening on other nodes.
+    """
+
+    def __init__(self, client, stack_name: str, resync_interval: float = 30):
+        self.client = client
+        self.api = client.api
+        self.stack_name = stack_name
+        self.resync_interval = resync_interval
+        self.tasks: Dict[str, dict] = {}
+        self.services: Dict[str, str] = {}
+        self.nodes: Dict[str, str] = {}
+        self.api_calls = 0
+        self.events = 0
+        self.last_resync = 0.0
+
+    def _namespace_filter(self):
+        return {'label': '{}={}'.format(STACK_NAMESPACE_LABEL, self.stack_name)}
+
+    def snapshot(self):
+        self.api_calls += 3
+        self.services = {service['ID']: service['Spec']['Name'] for service in
+                         self.api.services(filters=self._namespace_filter())}
+        self.nodes = {node['ID']: node['Description']['Hostname'] for node in self.api.nodes()}
+        self.resync()
+
+    def resync(self):
+        self.api_calls += 1
+        self.tasks = {task['ID']: task for task in self.api.tasks(filters=self._namespace_filter())}
+        self.last_resync = time.monotonic()
+
+    def _refresh_service_tasks(self, service_id: str):
+        self.api_calls += 1
+        for task_id in [task_id for task_id, task in self.tasks.items() if task['ServiceID'] == service_id]:
+            del self.tasks[task_id]
+        for task in self.api.tasks(filters={'service': service_id}):
+            self.tasks[task['ID']] = task
+
+    def apply_event(self, event: dict) -> bool:
+        """Updates the view from an event, returns True when something changed."""
+        event_type = event.get('Type')
+        action = event.get('Action')
+        actor = event.get('Actor', {})
+        attributes = actor.get('Attributes', {}) or {}
+        if event_type == 'service':
+            service_id = actor.get('ID')
+            name = attributes.get('name', '')
+            if service_id not in self.services and not name.startswith('{}_'.format(self.stack_name)):
+                return False
+            self.events += 1
+            if action == 'remove':
+                self.services.pop(service_id, None)
+                for task_id in [task_id for task_id, task in self.tasks.items() if task['ServiceID'] == service_id]:
+                    del self.tasks[task_id]
+            else:
+                if name:
+                    self.services[service_id] = name
+                self._refresh_service_tasks(service_id)
+            return True
+        if event_type == 'container':
+            if attributes.get(STACK_NAMESPACE_LABEL) != self.stack_name:
+                return False
+            task_id = attributes.get(SWARM_TASK_ID_LABEL)
+            if not task_id or action not in ('create', 'start', 'die', 'kill', 'stop', 'destroy', 'health_status'):
+                return False
+            self.events += 1
+            self.api_calls += 1
+            try:
+                self.tasks[task_id] = self.api.inspect_task(task_id)
+            except Exception as e:
+                logger.debug('Unable to inspect task {}: {}'.format(task_id, e))
+                self.tasks.pop(task_id, None)
+            return True
+        if event_type == 'node':
+            node_id = actor.get('ID')
+            self.events += 1
+            self.api_calls += 1
+            try:
+                node = self.api.inspect_node(node_id)
+                self.nodes[node_id] = node['Description']['Hostname']
+            except Exception:
+                self.nodes.pop(node_id, None)
+            return True
+        return False
+
+    def _rows(self, now: float) -> List[Tuple[str, list, tuple]]:
+        """Sorted (task id, columns, state) rows, the state leaves out the relative times that change every second."""
+        rows = []
+        for task in self.tasks.values():
+            service = self.services.get(task['ServiceID'], task['ServiceID'][:12])
+            slot = task.get('Slot') or task.get('NodeID', '')[:12]
+            status = task.get('Status', {})
+            state = status.get('State', '')
+            current = '{} {}'.format(state.capitalize(), humanize_since(parse_docker_time(status.get('Timestamp')), now))
+            image = task.get('Spec', {}).get('ContainerSpec', {}).get('Image', '').split('@')[0]
+            columns = [task['ID'][:12], '{}.{}'.format(service, slot), image,
+                       self.nodes.get(task.get('NodeID'), task.get('NodeID', '')[:12]),
+                       task.get('DesiredState', '').capitalize(), current, status.get('Err', '')]
+            rows.append((
+                (service, str(slot), -(parse_docker_time(task.get('CreatedAt')) or 0)), task['ID'], columns,
+                tuple(columns[:5]) + (state, status.get('Timestamp'), columns[6])
+            ))
+        rows.sort(key=lambda row: row[0])
+        return [row[1:] for row in rows]
+
+    @staticmethod
+    def _format(table: List[list]) -> List[str]:
+        widths = [max(len(str(line[i])) for line in table) for i in range(len(table[0]))]
+        return ['   '.join(str(value).ljust(width) for value, width in zip(line, widths)).rstrip() for line in table]
+
+    def render(self) -> str:
+        lines = self._format([TASK_HEADER] + [columns for _, columns, _ in self._rows(time.time())])
+        lines.append('')
+        lines.append('{} tasks, {} events, {} API calls - {}'.format(
+            len(self.tasks), self.events, self.api_calls, time.strftime('%H:%M:%S')))
+        return '\n'.join(lines)
+
+    def render_changes(self, printed: Dict[str, tuple]) -> str:
+        """Rows of the tasks whose state changed since `printed` (task id -> state), which is updated."""
+        table = []
+        for task_id, columns, state in self._rows(time.time()):
+            if printed.get(task_id) != state:
+                printed[task_id] = state
+                table.append(columns)
+        for task_id in set(printed) - set(self.tasks):
+            del printed[task_id]
+        return '\n'.join(self._format(table)) if table else ''
+
+    def _read_events(self, events: queue.Queue):
+        try:
+            for event in self.client.events(decode=True, filters={'type': ['service', 'container', 'node']}):
+                events.put(event)
+        except Exception as e:
+            logger.error('Event stream interrupted: {}'.format(e))
+            events.put(None)
+
+    def watch(self, refresh_interval: float = 0.5):
+        events: queue.Queue = queue.Queue()
+        threading.Thread(target=self._read_events, args=(events,), daemon=True).start()
+        self.snapshot()
+        in_place = sys.stdout.isatty()
+        # Without a terminal the table is printed once, then only the rows of the tasks that changed
+        printed: Dict[str, tuple] = {}
+        if not in_place:
+            self.render_changes(printed)
+            click.echo(self.render())
+        dirty = True
+        last_render = 0.0
+        while True:
+            try:
+                event = events.get(timeout=refresh_interval)
+                if event is None:
+                    return
+                dirty = self.apply_event(event) or dirty
+            except queue.Empty:
+                pass
+            if time.monotonic() - self.last_resync >= self.resync_interval:
+                self.resync()
+                dirty = True
+            now = time.monotonic()
+            if not in_place:
+                if dirty:
+                    changes = self.render_changes(printed)
+                    if changes:
+                        click.echo(changes)
+                    dirty = False
+                continue
+            # Redraw at most every refresh_interval, and at least once a second for the relative times
+            if (dirty and now - last_render >= refresh_interval) or now - last_render >= 1:
+                output = self.render()
+                click.echo('\x1b[H' + output.replace('\n', '\x1b[K\n') + '\x1b[K\x1b[J', nl=False)
+                dirty = False
+                last_render = now
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from swarm_cli.lib.config_cache import get_cache_dir
+from swarm_cli.lib.logging import logger
+
+
+def _topology_ttl():
+    return float(os.environ.get('SWARM_CLI_TOPOLOGY_TTL', 0))
+
+
+def node_address(node: dict) -> Tuple[Optional[str], Optional[str]]:
+    host = node.get('Description', {}).get('Hostname')
+    ip = node.get('Status', {}).get('Addr')
+    if ip == '0.0.0.0':
+        # Managers report their address in ManagerStatus
+        ip = (node.get('ManagerStatus', {}).get('Addr') or '').split(':')[0] or None
+    return host, ip
+
+
+class Topology:
+    """Nodes of the swarm and running tasks of the services, fetched once and shared by all the lookups of a command.
+
+    Nodes come from a single `nodes` call, the running tasks of a service from a single `tasks` call. With
+    SWARM_CLI_TOPOLOGY_TTL set to a number of seconds, both are also persisted in the cache directory and reused by the
+    next invocations until they expire, in memory as well. `invalidate()` drops everything, e.g. when a cached
+    container is gone.
+    """
+
+    def __init__(self, client, stack_name: str, ttl: float = None):
+        self.client = client
+        self.ttl = _topology_ttl() if ttl is None else ttl
+        key = hashlib.sha1('{}|{}'.format(client.api.base_url, stack_name).encode()).hexdigest()[:16]
+        self.path = os.path.join(get_cache_dir(), 'topology', '{}.json'.format(key))
+        self.nodes: Optional[Dict[str, Tuple[Optional[str], Optional[str]]]] = None
+        self.tasks: Dict[str, List[dict]] = {}
+        # Node of the daemon the client talks to, containers there need no other connection
+        self.connected_node_id: Optional[str] = None
+        self.saved_at = time.time()
+        if self.ttl > 0:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as infile:
+                data = json.load(infile)
+        except (OSError, ValueError):
+            return
+        if time.time() - data.get('saved_at', 0) >= self.ttl:
+            return
+        self.saved_at = data['saved_at']
+        self.nodes = {node_id: tuple(address) for node_id, address in data['nodes'].items()} \
+            if data.get('nodes') is not None else None
+        self.tasks = data.get('tasks', {})
+        self.connected_node_id = data.get('connected_node_id')
+        logger.debug('Loaded swarm topology cached {:.0f}s ago'.format(time.time() - self.saved_at))
+
+    def _save(self):
+        if self.ttl <= 0:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w') as outfile:
+                json.dump({'saved_at': self.saved_at, 'nodes': self.nodes, 'tasks': self.tasks,
+                           'connected_node_id': self.connected_node_id}, outfile)
+        except OSError as e:
+            logger.debug('Unable to persist swarm topology: {}'.format(e))
+
+    def _forget(self):
+        self.nodes = None
+        self.tasks = {}
+        self.connected_node_id = None
+        self.saved_at = time.time()
+
+    def _expire(self):
+        # What was fetched together expires together, like the persisted topology
+        if self.ttl > 0 and time.time() - self.saved_at >= self.ttl:
+            self._forget()
+
+    def invalidate(self):
+        self._forget()
+        if os.path.exists(self.path):
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def get_node_address(self, node_id: str) -> Tuple[Optional[str], Optional[str]]:
+        self._expire()
+        if self.nodes is None or node_id not in self.nodes:
+            self.nodes = {node['ID']: node_address(node) for node in self.client.api.nodes()}
+            self._save()
+        return self.nodes.get(node_id, (None, None))
+
+    def get_running_tasks(self, fqsn: str) -> List[dict]:
+        from docker.errors import NotFound
+        self._expire()
+        if fqsn not in self.tasks:
+            try:
+                tasks = self.client.api.tasks(filters={'service': fqsn, 'desired-state': 'running'})
+            except NotFound:
+                # The service is not deployed
+                return []
+            self.tasks[fqsn] = sorted([task for task in tasks if task.get('Status', {}).get('State') == 'running'],
+                                      key=lambda task: task.get('Slot') or 0)
+            self._save()
+        return self.tasks[fqsn]
+
+    def get_connected_node_id(self) -> Optional[str]:
+        self._expire()
+        if self.connected_node_id is None:
+            self.connected_node_id = self.client.info().get('Swarm', {}).get('NodeID') or None
+            self._save()
+        return self.connected_node_id
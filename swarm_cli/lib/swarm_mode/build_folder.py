@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import stat
+from typing import Dict, List, Tuple
+
+from swarm_cli.lib.logging import logger
+
+MANIFEST_FILE = '.sync-manifest.json'
+
+
+class SyncResult:
+    def __init__(self):
+        self.linked = 0
+        self.copied = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    def __str__(self):
+        return '{} linked, {} copied, {} unchanged, {} removed'.format(self.linked, self.copied, self.unchanged,
+                                                                       self.removed)
+
+
+def _walk_files(root: str) -> Dict[str, os.stat_result]:
+    files = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, rel_dir) if rel_dir else root)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                rel = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel)
+                else:
+                    files[rel] = entry.stat(follow_symlinks=False)
+    return files
+
+
+def merge_layers(sources: List[str]) -> Dict[str, Tuple[str, os.stat_result]]:
+    """Returns {relative path: (source path, stat)}, a file of a layer overrides the same file of the layers before."""
+    view = {}
+    for source in sources:
+        for rel, st in _walk_files(source).items():
+            view[rel] = (os.path.join(source, rel), st)
+    return view
+
+
+def _signature(source: str, st: os.stat_result):
+    return [source, st.st_mtime_ns, st.st_size, st.st_mode]
+
+
+def sync_tree(sources: List[str], dest: str, manifest_path: str) -> SyncResult:
+    """Makes `dest` hold the merged content of the `sources` directories, touching only what changed.
+
+    Files are hardlinked when possible, so that they keep the timestamps of the sources, and copied otherwise (e.g.
+    across file systems). The manifest records which source each file comes from to detect overrides between layers.
+    """
+    result = SyncResult()
+    try:
+        with open(manifest_path, 'r') as infile:
+            manifest = json.load(infile)
+    except (OSError, ValueError):
+        manifest = {}
+    view = merge_layers(sources)
+    existing = _walk_files(dest)
+
+    for rel in sorted(set(existing) - set(view)):
+        os.unlink(os.path.join(dest, rel))
+        result.removed += 1
+
+    new_manifest = {}
+    for rel, (source, st) in view.items():
+        target = os.path.join(dest, rel)
+        signature = _signature(source, st)
+        new_manifest[rel] = signature
+        current = existing.get(rel)
+        if current is not None:
+            same_inode = (current.st_ino, current.st_dev) == (st.st_ino, st.st_dev)
+            if same_inode or (manifest.get(rel) == signature and current.st_size == st.st_size):
+                result.unchanged += 1
+                continue
+            os.unlink(target)
+        elif os.path.isdir(target):
+            # A directory of a previous sync became a file
+            shutil.rmtree(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(source), target)
+            result.copied += 1
+            continue
+        try:
+            os.link(source, target)
+            result.linked += 1
+        except OSError:
+            shutil.copy2(source, target)
+            result.copied += 1
+
+    # Directories left empty by removed files
+    for directory, _, _ in sorted(os.walk(dest), key=lambda item: len(item[0]), reverse=True):
+        if directory != dest and not os.listdir(directory):
+            os.rmdir(directory)
+
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    with open(manifest_path, 'w') as outfile:
+        json.dump(new_manifest, outfile)
+    logger.debug('Synced {}: {}'.format(dest, result))
+    return result
@@ -1,33 +1,66 @@
-import glob
 import os
-from typing import List
-
-import click
+from typing import Dict, List, Optional, Tuple
 
+from swarm_cli.lib.config_cache import ConfigCache
 from swarm_cli.lib.logging import logger
-from swarm_cli.lib.swarm_mode.stack import Stack
+from swarm_cli.lib.swarm_mode.stack import Stack, read_stack_header
+
+
+def _scan_layer(root_path: str) -> Tuple[Dict[Tuple[str, str], dict], List[str]]:
+    """Finds the *.stack.yml files of a layer, returns the (name, variant) index and the directories walked."""
+    index = {}
+    directories = []
+    for directory, subdirectories, files in os.walk(root_path):
+        # Hidden directories hold no stacks, and the cache directory (.swarm-cli) changes on every write: walking
+        # it would invalidate the index it stores
+        subdirectories[:] = sorted(subdirectory for subdirectory in subdirectories if not subdirectory.startswith('.'))
+        directories.append(directory)
+        for filename in sorted(files):
+            if filename.endswith('.stack.yml'):
+                header = read_stack_header(os.path.join(directory, filename))
+                # Like the former linear scan, the first stack found wins
+                index.setdefault((header['name'], header['variant']), header)
+    return index, directories
 
 
 class Layer:
+    """A directory of stacks, indexed by (name, variant).
+
+    The index only needs the *.stack.yml files and is cached: an entry remains valid while none of the stack files and
+    none of the directories of the layer (whose mtime changes when a file is added or removed) changed. The compose
+    file of a stack is only parsed when the stack is used.
+    """
     root_path: str
     name: str
 
-    stacks: List[Stack] = []
-
-    def __init__(self, name: str, root_path: str = None):
+    def __init__(self, name: str, root_path: str = None, cache: ConfigCache = None):
+        self.name = name
+        self.index: Dict[Tuple[str, str], dict] = {}
+        self._stacks: Dict[Tuple[str, str], Stack] = {}
         if root_path:
-            self.load_from_path(root_path)
+            self.load_from_path(root_path, cache)
 
-    def load_from_path(self, root_path):
+    def load_from_path(self, root_path, cache: ConfigCache = None):
         self.root_path = root_path
-        stack_files = glob.glob(os.path.join(root_path, '**/*.stack.yml'), recursive=True)
-        for filepath in stack_files:
-            stack = Stack(stack_file=filepath)
-            logger.verbose('\tLoaded stack {}:{}'.format(stack.name, stack.variant))
-            self.stacks.append(stack)
-
-    def get_stack(self, name, variant):
-        for stack in self.stacks:
-            if stack.name == name and stack.variant == variant:
-                return stack
-        return None
+        cache = cache or ConfigCache()
+        key = 'layer:{}'.format(os.path.abspath(root_path))
+        index = cache.get('layers', key)
+        if index is None:
+            index, directories = _scan_layer(root_path)
+            cache.put('layers', key, directories + [header['path'] for header in index.values()], index)
+        self.index = index
+        for name, variant in sorted(index.keys()):
+            logger.verbose('\tFound stack {}:{}'.format(name, variant))
+
+    @property
+    def stacks(self) -> List[Stack]:
+        return [self.get_stack(name, variant) for name, variant in self.index.keys()]
+
+    def get_stack(self, name, variant) -> Optional[Stack]:
+        key = (name, variant)
+        if key not in self._stacks:
+            header = self.index.get(key)
+            if header is None:
+                return None
+            self._stacks[key] = Stack.from_header(header)
+        return self._stacks[key]
@@ -3,6 +3,20 @@ import os
 from swarm_cli.lib.utils import load_required_yaml, parse_stack_filename
 
 
+def read_stack_header(stack_file: str) -> dict:
+    # Only the small *.stack.yml file is read, the compose file it points to is parsed when the stack is used
+    name, variant = parse_stack_filename(os.path.basename(stack_file).replace('.stack.yml', ''))
+    header = {'path': stack_file, 'name': name, 'variant': variant, 'stack_file': Stack.docker_stack_file,
+              'files_dir': Stack.files_dir}
+    data = load_required_yaml(stack_file)
+    if data is not None:
+        header['name'] = data.get('name', name)
+        header['variant'] = data.get('variant', variant)
+        header['stack_file'] = data.get('stack_file', Stack.docker_stack_file)
+        header['files_dir'] = data.get('files_dir', Stack.files_dir)
+    return header
+
+
 class Stack:
     root_path: str
     name: str
@@ -10,22 +24,34 @@ class Stack:
     docker_stack_file = 'docker-compose.yml'
     files_dir = 'files'
 
-    docker_stack_def: dict
-
     def __init__(self, stack_file=None):
+        self._docker_stack_def = None
         if stack_file:
             self.load_from_path(stack_file)
 
+    @classmethod
+    def from_header(cls, header: dict) -> 'Stack':
+        stack = cls()
+        stack.root_path = os.path.dirname(header['path'])
+        stack.name = header['name']
+        stack.variant = header['variant']
+        stack.docker_stack_file = header['stack_file']
+        stack.files_dir = header['files_dir']
+        return stack
+
     def load_from_path(self, stack_file):
+        header = read_stack_header(stack_file)
         self.root_path = os.path.dirname(stack_file)
-        self.name, self.variant = parse_stack_filename(os.path.basename(stack_file).replace('.stack.yml', ''))
-        data = load_required_yaml(stack_file)
-        if data is not None:
-            self.name = data.get('name', self.name)
-            self.variant = data.get('variant', self.variant)
-            self.docker_stack_file = data.get('stack_file', self.docker_stack_file)
-            self.files_dir = data.get('files_dir', self.files_dir)
-        self.docker_stack_def = load_required_yaml(os.path.join(self.root_path, self.docker_stack_file))
+        self.name = header['name']
+        self.variant = header['variant']
+        self.docker_stack_file = header['stack_file']
+        self.files_dir = header['files_dir']
+
+    @property
+    def docker_stack_def(self) -> dict:
+        if self._docker_stack_def is None:
+            self._docker_stack_def = load_required_yaml(os.path.join(self.root_path, self.docker_stack_file)) or {}
+        return self._docker_stack_def
 
     def get_external_overlay_networks(self):
         res = []
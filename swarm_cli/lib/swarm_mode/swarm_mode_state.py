@@ -1,34 +1,43 @@
+import contextlib
 import os
-import shutil
 import subprocess
 import sys
-from typing import List, Dict
+from typing import TYPE_CHECKING, List, Dict
 
 import click
-import docker
-from docker import DockerClient
 
+from swarm_cli.lib.config_cache import ConfigCache
 from swarm_cli.lib.logging import logger
+from swarm_cli.lib.swarm_mode.build_folder import MANIFEST_FILE, sync_tree
 from swarm_cli.lib.swarm_mode.layer import Layer
 from swarm_cli.lib.swarm_mode.stack import Stack
-from swarm_cli.lib.utils import load_required_yaml, load_env_dict
+from swarm_cli.lib.utils import load_env_dict
+
+if TYPE_CHECKING:
+    import docker
 
 
 class SwarmModeState:
-    layers: List[Layer] = []
+    layers: List[Layer]
     cfg: dict
 
-    layered_stacks: Dict[str, Dict[str, List[Stack]]] = {}
+    # name -> variant -> stacks of that variant in every layer, in layer order
+    layered_stacks: Dict[str, Dict[str, List[Stack]]]
 
-    client: DockerClient
+    client: 'docker.DockerClient' = None
 
     class CliState:
         selected_preset: str
 
-    cli_state: CliState = CliState()
+    def __init__(self):
+        # Per instance: the daemon builds a new state for every command
+        self.layers = []
+        self.layered_stacks = {}
+        self.cli_state = SwarmModeState.CliState()
 
     def initFromFile(self, path: str):
-        data = load_required_yaml(path)
+        self.config_cache = ConfigCache()
+        data = self.config_cache.load_yaml(path)
         self.cfg = data
 
         # Load layers
@@ -39,20 +48,17 @@ class SwarmModeState:
 
     def _get_client(self):
         if not self.client:
+            import docker
             self.client = docker.from_env()
         return self.client
 
     def _load_layers(self, layers: list):
         for layer_root_path in layers:
             logger.verbose('Parsing layer {}'.format(layer_root_path))
-            layer = Layer(os.path.basename(layer_root_path), layer_root_path)
+            layer = Layer(os.path.basename(layer_root_path), layer_root_path, cache=self.config_cache)
 
-            for stack in layer.stacks:
-                variants = self.layered_stacks.get(stack.name, {})
-                stacks = variants.get(stack.variant, [])
-                stacks.append(stack)
-                variants[stack.variant] = stacks
-                self.layered_stacks[stack.name] = variants
+            for name, variant in layer.index.keys():
+                self.layered_stacks.setdefault(name, {}).setdefault(variant, []).append(layer.get_stack(name, variant))
 
             self.layers.append(layer)
 
@@ -68,6 +74,12 @@ class SwarmModeState:
             name, variant = k, v['variant']
             self.ensure_stack_exists(name, variant)
 
+    def get_stack_dependencies(self, preset: str, name: str) -> List[str]:
+        depends_on = self.cfg['presets'][preset]['stacks'][name].get('depends_on', [])
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        return depends_on
+
     def ensure_preconditions(self, name=None, variant=None, dump_cmd=False):
         for stack in self.get_layered_stacks(name, variant):
             for network in stack.get_external_overlay_networks():
@@ -84,6 +96,21 @@ class SwarmModeState:
         cmd = cmd.rstrip()
         return cmd
 
+    def get_stack_files(self, name, variant) -> List[str]:
+        return [os.path.abspath(os.path.join(stack.root_path, stack.docker_stack_file))
+                for stack in self.get_layered_stacks(name, variant)]
+
+    @contextlib.contextmanager
+    def deploy_file_args_for_stack(self, name, variant, environ=None, dry_run=False):
+        # The resolved file only exists while the block runs
+        from swarm_cli.lib.compose_merge import MERGE_NATIVE, get_compose_merge, resolve_compose
+        if get_compose_merge() != MERGE_NATIVE:
+            yield self.build_deploy_sequence_for_stack(name, variant)
+            return
+        resolved = resolve_compose(self.get_stack_files(name, variant), environ=environ, cache=self.config_cache)
+        with resolved.written(dry_run) as path:
+            yield '-c {}'.format(path)
+
     def build_compose_sequence_for_stack(self, name=None, variant=None):
         cmd = ''
         for stack in self.get_layered_stacks(name, variant):
@@ -100,10 +127,17 @@ class SwarmModeState:
             exit(1)
 
     def get_layered_stacks(self, name, variant):
-        for layer in self.layers:
-            stack = layer.get_stack(name, variant)
-            if stack:
-                yield stack
+        return iter(self.layered_stacks.get(name, {}).get(variant, []))
+
+    def get_services_for_stack(self, name, variant) -> Dict[str, dict]:
+        # Merged with the compose override semantics, like the file that gets deployed: an override layer that only
+        # adds a build arg keeps the context and args of the base layer
+        from swarm_cli.lib.compose_merge import load_merged
+        return load_merged(self.get_stack_files(name, variant), self.config_cache).get('services') or {}
+
+    def get_project_dir_for_stack(self, name, variant):
+        stack = next(self.get_layered_stacks(name, variant))
+        return os.path.dirname(os.path.abspath(os.path.join(stack.root_path, stack.docker_stack_file)))
 
     def get_build_folder(self, preset, name, variant):
         root_build_dir = "build/{}/{}/{}".format(preset, name, variant)
@@ -120,12 +154,15 @@ class SwarmModeState:
         return new_env
 
     def prepare_build_folder(self, preset, name, variant):
-        stacks = self.get_layered_stacks(name, variant)
         root_build_dir = self.get_build_folder(preset, name, variant)
-        shutil.rmtree("{}".format(root_build_dir), ignore_errors=True)
         os.makedirs(root_build_dir, exist_ok=True)
-        for stack in stacks:
-            files_dir = os.path.join(stack.root_path, 'files')
+        sources = []
+        for stack in self.get_layered_stacks(name, variant):
+            files_dir = os.path.join(stack.root_path, stack.files_dir)
             if os.path.exists(files_dir):
-                shutil.copytree(files_dir, os.path.join(root_build_dir, 'files'), copy_function=os.link)
                 logger.debug('Preparing folder {}'.format(files_dir))
+                sources.append(files_dir)
+        result = sync_tree(sources, os.path.join(root_build_dir, 'files'),
+                           os.path.join(root_build_dir, MANIFEST_FILE))
+        logger.verbose('Build folder of {}:{}: {}'.format(name, variant, result))
+        return result
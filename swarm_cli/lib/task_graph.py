@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional
+
+import click
+
+from swarm_cli.lib.logging import logger
+
+
+class TaskResult:
+    OK = 'ok'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, name: str, status: str, duration: float = 0.0, returncode: Optional[int] = None,
+                 reason: str = None):
+        self.name = name
+        self.status = status
+        self.duration = duration
+        self.returncode = returncode
+        self.reason = reason
+
+
+class Task:
+    def __init__(self, name: str, fn: Callable[[], int], depends_on: List[str] = None):
+        self.name = name
+        self.fn = fn
+        self.depends_on = list(depends_on or [])
+
+
+class TaskGraph:
+    """Runs tasks concurrently while respecting their dependencies.
+
+    Each task is a callable returning a process exit code, 0 meaning success. When a task fails every task that
+    depends on it (directly or transitively) is skipped, while independent branches keep running.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Task] = {}
+
+    def add(self, name: str, fn: Callable[[], int], depends_on: List[str] = None):
+        if name in self.tasks:
+            raise ValueError('Task {} defined twice'.format(name))
+        self.tasks[name] = Task(name, fn, depends_on)
+
+    def validate(self):
+        for task in self.tasks.values():
+            for dep in task.depends_on:
+                if dep not in self.tasks:
+                    raise ValueError('Task {} depends on unknown task {}'.format(task.name, dep))
+        # Kahn's algorithm, whatever is left over is part of a cycle
+        remaining = {name: len(task.depends_on) for name, task in self.tasks.items()}
+        ready = [name for name, count in remaining.items() if count == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for dependant in self._dependants(name):
+                remaining[dependant] -= 1
+                if remaining[dependant] == 0:
+                    ready.append(dependant)
+        if visited != len(self.tasks):
+            cycle = sorted(name for name, count in remaining.items() if count > 0)
+            raise ValueError('Dependency cycle between tasks: {}'.format(', '.join(cycle)))
+
+    def _dependants(self, name: str):
+        return [task.name for task in self.tasks.values() if name in task.depends_on]
+
+    def run(self, jobs: int = 1) -> Dict[str, TaskResult]:
+        self.validate()
+        jobs = max(1, jobs)
+        results: Dict[str, TaskResult] = {}
+        lock = threading.Lock()
+
+        def execute(task: Task) -> TaskResult:
+            start = time.monotonic()
+            try:
+                returncode = task.fn()
+            except Exception as e:
+                logger.error('Task {} raised: {}'.format(task.name, e))
+                returncode = -1
+            duration = time.monotonic() - start
+            status = TaskResult.OK if returncode == 0 else TaskResult.FAILED
+            return TaskResult(task.name, status, duration, returncode)
+
+        def skip(name: str, reason: str):
+            with lock:
+                if name in results:
+                    return
+                results[name] = TaskResult(name, TaskResult.SKIPPED, reason=reason)
+            logger.warning('Skipping {}: {}'.format(name, reason))
+            for dependant in self._dependants(name):
+                skip(dependant, 'dependency {} was skipped'.format(name))
+
+        # Preserve declaration order among tasks that become ready at the same time
+        pending = list(self.tasks.keys())
+        running = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while pending or running:
+                for name in list(pending):
+                    if name in results:
+                        pending.remove(name)
+                        continue
+                    if len(running) >= jobs:
+                        break
+                    deps = self.tasks[name].depends_on
+                    if all(dep in results and results[dep].status == TaskResult.OK for dep in deps):
+                        pending.remove(name)
+                        running[executor.submit(execute, self.tasks[name])] = name
+                if not running:
+                    # Nothing is running and nothing could be started: the rest was skipped
+                    pending = [name for name in pending if name not in results]
+                    if pending:
+                        raise RuntimeError('Unable to schedule tasks {}'.format(', '.join(pending)))
+                    break
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    with lock:
+                        results[name] = result
+                    if result.status == TaskResult.FAILED:
+                        logger.error('{} failed with exit code {}'.format(name, result.returncode))
+                        for dependant in self._dependants(name):
+                            skip(dependant, 'dependency {} failed'.format(name))
+        return {name: results[name] for name in self.tasks.keys()}
+
+
+def print_task_summary(results: Dict[str, TaskResult], title: str = 'Summary'):
+    colors = {TaskResult.OK: 'green', TaskResult.FAILED: 'red', TaskResult.SKIPPED: 'yellow'}
+    width = max([len(name) for name in results.keys()] + [4])
+    click.secho('\n{}:'.format(title), bold=True)
+    for name, result in results.items():
+        duration = '{:>8.1f}s'.format(result.duration) if result.status != TaskResult.SKIPPED else '{:>9s}'.format('-')
+        line = '  {} {:<7s} {}'.format(name.ljust(width), result.status, duration)
+        if result.reason:
+            line += '  ({})'.format(result.reason)
+        click.secho(line, fg=colors[result.status])
+
+
+def all_tasks_succeeded(results: Dict[str, TaskResult]):
+    return all(result.status == TaskResult.OK for result in results.values())
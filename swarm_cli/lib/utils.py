@@ -2,22 +2,29 @@ import os
 import re
 import subprocess
 import sys
+import threading
 from typing import Union
 
 import click
-import yaml
 
+from swarm_cli.lib.env_parser import parse_env_file, EnvParseError
 from swarm_cli.lib.logging import logger
 
 
 env_var_regex = re.compile('[A-Za-z_0-9]+')
 
+_output_lock = threading.Lock()
+
 def load_required_yaml(path: str):
+    import yaml
     if not os.path.exists(path):
         click.secho('Error: file {} not found'.format(path), bold=True, fg='red')
-        os._exit(1)
+        sys.exit(1)
+    # Use the libyaml bindings when PyYAML was built with them, they are several times faster than the pure Python
+    # loader
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(path, 'r') as infile:
-        data = yaml.safe_load(infile)
+        data = yaml.load(infile, Loader=loader)
         return data
 
 
@@ -36,7 +43,40 @@ def load_env_dict(data: dict, overwrite_existing=False):
         load_env_val(k, v, overwrite_existing=overwrite_existing)
 
 
-def load_env_files(files: list, ignore_missing=False):
+def _read_env_file_shell(filepath: str) -> dict:
+    # Have the shell parse the file for us
+    cmd = 'sh -c "set -a && . ./{} && env"'.format(filepath)
+    res = subprocess.run(cmd, cwd=os.getcwd(), shell=True, env=os.environ, capture_output=True)
+    data = {}
+    dropped = 0
+    for line in res.stdout.decode().splitlines():
+        try:
+            k, v = line.split('=', maxsplit=1)
+            # Ignore PWD as it is always there
+            if k == 'PWD':
+                continue
+            if not env_var_regex.match(k):
+                continue
+            data[k] = v
+        except:
+            dropped += 1
+    # Multi-line values already in the environment show up in the dump as well, only report the file's own
+    dropped -= sum(v.count('\n') for v in os.environ.values())
+    if dropped > 0:
+        logger.warning('{}: {} lines of multi-line values were dropped by the shell parser'.format(filepath, dropped))
+    return data
+
+
+def _read_env_file_native(filepath: str) -> dict:
+    return parse_env_file(filepath, environ=os.environ)
+
+
+def get_env_parser():
+    return os.environ.get('SWARM_CLI_ENV_PARSER', 'native')
+
+
+def load_env_files(files: list, ignore_missing=False, parser: str = None):
+    parser = parser or get_env_parser()
     for filepath in files:
         if not os.path.exists(filepath):
             if ignore_missing:
@@ -45,21 +85,17 @@ def load_env_files(files: list, ignore_missing=False):
             else:
                 logger.error('Can\'t open env file {}'.format(filepath))
                 exit(1)
-        # Have the shell parse the file for us
         logger.debug("Loading {}".format(filepath))
-        cmd = 'sh -c "set -a && . ./{} && env"'.format(filepath)
-        res = subprocess.run(cmd, cwd=os.getcwd(), shell=True, env=os.environ, capture_output=True)
-        for line in res.stdout.decode().splitlines():
+        data = None
+        if parser == 'native':
             try:
-                k, v = line.split('=', maxsplit=1)
-                # Ignore PWD as it is always there
-                if k == 'PWD':
-                    continue
-                if not env_var_regex.match(k):
-                    continue
-                load_env_val(k, v, overwrite_existing=False)
-            except:
-                pass
+                data = _read_env_file_native(filepath)
+            except EnvParseError as e:
+                logger.debug("Falling back to the shell parser: {}".format(e))
+        if data is None:
+            data = _read_env_file_shell(filepath)
+        for k, v in data.items():
+            load_env_val(k, v, overwrite_existing=False)
 
 
 def parse_stack_filename(path: str):
@@ -69,7 +105,7 @@ def parse_stack_filename(path: str):
     # return {'stack_name': parts[0], 'stack_variant': parts[1]}
 
 
-def run_cmd(cmd: str, dry_run=False, cwd: str = os.getcwd(), env=os.environ, check: bool = True) -> int:
+def run_cmd(cmd: str, dry_run=False, cwd: str = None, env=os.environ, check: bool = True) -> int:
     logger.verbose("+ " + cmd)
     if not dry_run:
         res = subprocess.run(cmd, stdin=sys.stdin, stderr=sys.stderr, stdout=sys.stdout, cwd=cwd, shell=True, env=env, check=check)
@@ -77,6 +113,22 @@ def run_cmd(cmd: str, dry_run=False, cwd: str = os.getcwd(), env=os.environ, che
     return 0
 
 
+def run_cmd_prefixed(cmd: str, prefix: str, dry_run=False, cwd: str = None, env=os.environ) -> int:
+    # Used when several commands run at the same time: output is read line by line and tagged with the prefix so
+    # that interleaved lines remain readable
+    logger.verbose("[{}] + {}".format(prefix, cmd))
+    if dry_run:
+        return 0
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd,
+                            shell=True, env=env)
+    for line in iter(proc.stdout.readline, b''):
+        decoded = line.decode('utf-8', errors='replace').rstrip()
+        with _output_lock:
+            click.echo('{} | {}'.format(prefix, decoded))
+    proc.stdout.close()
+    return proc.wait()
+
+
 def parse_yaml_bool(value: Union[bool, str]):
     if isinstance(value, str):
         return value.lower() in ['true', '1', 't', 'y', 'yes']